@@ -4,78 +4,35 @@ from PyQt5.Qt import Qt
 import numpy as np
 import sys
 import os
-from imageio import imread, imsave
 import epics
 from epics.utils import BYTES2STR
 import time
 from itertools import cycle
 import copy
 import time
-from numba import jit
-
-class AD_Reader(QtCore.QObject):
-    imageSizeXChanged=QtCore.pyqtSignal(int)
-    imageSizeYChanged=QtCore.pyqtSignal(int)
-
-    def __init__(self, detPV, parent=None):
-        """
-
-        :detPV: Detector PV (example: 15PS1:)
-        :param parent:
-        """
-        QtCore.QObject.__init__(self, parent=parent)
-        self.connected = True
-        self.detPV=detPV
-        self.init_PVs()
-        QtTest.QTest.qWait(1000)
-        self.sizeX = self.sizeX_PV.value
-        self.sizeY = self.sizeY_PV.value
-        if self.sizeX is None or self.sizeY is None:
-            self.connected=False
-
-
-
-    def init_PVs(self):
-        """
-        Initialize all the PVs
-        :return:
-        """
-        self.minX_PV = epics.PV(BYTES2STR(self.detPV+"cam1:MinX_RBV"), callback = self.onMinXChanged)
-        self.minY_PV = epics.PV(BYTES2STR(self.detPV+"cam1:MinY_RBV"), callback = self.onMinYChanged)
-        self.sizeX_PV = epics.PV(BYTES2STR(self.detPV+"cam1:SizeX_RBV"), callback = self.onSizeXChanged)
-        self.sizeY_PV = epics.PV(BYTES2STR(self.detPV+"cam1:SizeY_RBV"), callback = self.onSizeYChanged)
-        self.data_PV = epics.PV(BYTES2STR(self.detPV+"image1:ArrayData"))
-
-    def onMinXChanged(self, value, **kwargs):
-        self.minX=value
-        # print("minX changed")
-
-    def onMinYChanged(self, value, **kwargs):
-        self.minY=value
-        # print("minY changed")
-
-    def onSizeXChanged(self, value, **kwargs):
-        self.sizeX=value
-        self.imageSizeXChanged.emit(value)
-        # print("sizeX changed")
-
-    def onSizeYChanged(self, value, **kwargs):
-        self.sizeY = value
-        self.imageSizeYChanged.emit(value)
-        # print("sizeY changed")
-
-
+from pv_cache import PVCache, readPVFile
+from beam_analysis import ProjectionCache, Orientation, PeakFitter, fitModels, channelWeights, \
+    analyzeFrame, analysisColumns
+from time_series import TimeSeriesWriter, TimeSeriesBuffer, fileFormats, timeSeriesLayout
+from ad_reader import AD_Reader, releaseFrame
+from frame_correction import loadMap
+from frame_average import averageModes
+from roi_stats import ROIStatistics, roiQuantities, readROIFile, writeROIFile
+from frame_recorder import FrameRecorder, recordFormats
+from crosshairs import CrosshairModel, CrosshairItem, crosshairKeys, newCrosshair, readCrosshairFile, writeCrosshairFile
+from frame_sources import EPICSSource
+from pipeline_stats import PipelineStats
 
 
 class DynamicAD_Viewer(QtGui.QWidget):
-    arrayDataUpdated=QtCore.pyqtSignal()
     imageUpdated = QtCore.pyqtSignal(np.ndarray)
     posTimeSeriesReady = QtCore.pyqtSignal()
     widTimeSeriesReady = QtCore.pyqtSignal()
 
-    def __init__(self, parent = None):
+    def __init__(self, parent = None, detPV = None):
         """
         :param parent:
+        :param detPV: Detector PV, asked for in a dialog if None
 
         """
         QtGui.QWidget.__init__(self,parent=parent)
@@ -90,30 +47,69 @@ class DynamicAD_Viewer(QtGui.QWidget):
         self.expTimeLineEdit.setValidator(self.floatValidator)
         self.acquirePeriodLineEdit.setValidator(self.floatValidator)
         self.startUpdate=False
+        self.startTime=time.time()
+        self.settings=QtCore.QSettings('DynamicAD_Viewer','DynamicAD_Viewer')
+        self.orientationComboBox.addItems(list(Orientation.orientations.keys()))
+        self.orientation=Orientation()
+        self.channelComboBox.addItems(list(channelWeights.keys()))
+        self.channelWeights=channelWeights['Luminance']
+        self.fitModelComboBox.addItems(fitModels)
+        self.fitModelComboBox.setCurrentText(self.settings.value('FitModel', 'Centroid'))
+        self.peakFitter=PeakFitter(self.fitModelComboBox.currentText())
+        self.averageModeComboBox.addItems(averageModes)
+        self.roiStats=ROIStatistics()
+        self.roiValues=np.zeros((0, len(roiQuantities)))
+        self.roiItems=[]
+        self.roiNum=0
+        self.recordFormatComboBox.addItems(list(recordFormats.keys()))
+        self.recordFormatComboBox.setCurrentText(self.settings.value('RecordFormat', 'HDF5'))
+        self.recorder=None
+        self.crosshairModel=CrosshairModel(self)
+        self.crosshairTableView.setModel(self.crosshairModel)
+        self.crosshairItem=CrosshairItem(self.crosshairModel)
+        self.projections=ProjectionCache()
+        self.frameCuts=None
+        self.heldFrame=None
+        self.saveFile=None
+        self.tsWriter=None
+        self.saveFormatComboBox.addItems(list(fileFormats.keys()))
+        self.saveFormatComboBox.setCurrentText(self.settings.value('SaveFormat', 'Text'))
+        self.saveFormatComboBox.currentTextChanged.connect(self.saveFormatChanged)
+        self.seriesLengthSpinBox.setValue(int(self.settings.value('SeriesLength', 10000)))
+        self.seriesLengthSpinBox.editingFinished.connect(self.onSeriesLengthChanged)
+        self.timeSeries=TimeSeriesBuffer(self.seriesLengthSpinBox.value(), ['time', 'horPeakPos', 'verPeakPos',
+                                                                            'horPeakWid', 'verPeakWid'])
+        self.displayTimer=QtCore.QTimer(self)
+        self.displayTimer.setSingleShot(True)
+        self.stats=PipelineStats()
+        self.metricsFile=''
+        self.metricsError=None
+        self.statsTimer=QtCore.QTimer(self)
+        self.statsTimer.setInterval(1000)
+        self.onDisplayRateChanged()
         self.onPixelSizeChanged()
 
-        detPV, okPressed = QtGui.QInputDialog.getText(self, "Get Detector PV", "Detector PV", QtGui.QLineEdit.Normal,
-                                               "15IDPS1:")
-        if not okPressed:
-            detPV="15IDPS1:"
+        if detPV is None:
+            detPV, okPressed = QtGui.QInputDialog.getText(self, "Get Detector PV", "Detector PV", QtGui.QLineEdit.Normal,
+                                                   "15IDPS1:")
+            if not okPressed:
+                detPV="15IDPS1:"
         self.detPVLineEdit.setText(detPV)
+        self.colorMode = self.colorModeComboBox.currentText()
         self.onDetPVChanged()
+        # The signals of the widgets are connected once, the ones of the reader with every new reader
+        self.init_signals()
         self.loadPVs()
-        self.colorMode = self.colorModeComboBox.currentText()
         self.colorModeChanged()
         self.exposureTimeChanged()
         self.acquirePeriodChanged()
         self.removeCrosshairPushButton.setEnabled(False)
-        self.crosshairTableWidget.setEditable(True)
-        self.crosshair=[]
-        self.colorButtons={}
-        self.showCheckBoxes={}
         self.colors=['r', 'g', 'b', 'c', 'm', 'y', 'w']
         self.chColors=cycle(self.colors)
-        self.crosshairPlotItems = {}# pg.ScatterPlotItem()
         self.chNum=0
-#        self.vb.addItem(self.crosshairPlotItem)
         self.vb.scene().sigMouseMoved.connect(self.image_mouseMoved)
+        self.frameStatsLabel.setText('Startup: %.2f s, Connect: %.2f s'%(time.time()-self.startTime,
+                                                                       self.adReader.connectTime))
 
     def image_mouseMoved(self, pos):
         """
@@ -125,17 +121,31 @@ class DynamicAD_Viewer(QtGui.QWidget):
         self.cursorYLabel.setText('Pix [y]: %d [%10.6f mm]' % (int(y/self.pixelSize),y*1e3))
 
     def loadPVs(self):
+        if not isinstance(self.adReader.source, EPICSSource):
+            # Simulated and replayed sources have no camera PVs
+            self.expTimeLineEdit.setText('%.4f'%self.expTime)
+            self.acquirePeriodLineEdit.setText('%.4f'%self.adReader.source.getAcquirePeriod())
+            return
         self.expTimeLineEdit.setPV(self.detPV+'cam1:AcquireTime')
         self.acquirePeriodLineEdit.setPV(self.detPV+'cam1:AcquirePeriod')
         self.expTimeRBV.setPV(self.detPV+'cam1:AcquireTime_RBV')
         self.acquirePeriodRBV.setPV(self.detPV + 'cam1:AcquirePeriod_RBV')
 
     def closeEvent(self,evt):
-        if self.adReader.connected:
-            epics.caput(BYTES2STR(self.detPV + "cam1:Acquire"), 0)
-            epics.caput(BYTES2STR(self.detPV + "cam1:ArrayCounter"), 0)
+        self.shutdown()
         sys.exit()
 
+    def shutdown(self):
+        """
+        Stops the acquisition and closes the autosaved time series and the recorded frames
+        """
+        if self.startUpdate:
+            self.onStopUpdate()
+        self.stopRecording()
+        self.closeTimeSeriesFile()
+        if self.adReader.connected:
+            self.adReader.source.setAcquire(False)
+
     def validateFormat(self):
         self.intValidator=QtGui.QIntValidator()
         self.dblValidator=QtGui.QDoubleValidator()
@@ -146,17 +156,26 @@ class DynamicAD_Viewer(QtGui.QWidget):
         # self.expTimeLineEdit.returnPressed.connect(self.exposureTimeChanged)
         # self.acquirePeriodLineEdit.returnPressed.connect(self.acquirePeriodChanged)
         self.openImageFilePushButton.clicked.connect(self.openImageFile)
+        self.openReplayPushButton.clicked.connect(self.openReplay)
+        self.replayRateSpinBox.valueChanged.connect(self.replayRateChanged)
 
-        self.imageUpdated.connect(self.updatePlots)
+        self.imageUpdated.connect(self.analyzeFrame)
         self.startUpdatePushButton.clicked.connect(self.onStartUpdate)
         self.stopUpdatePushButton.clicked.connect(self.onStopUpdate)
         self.horROIWidthSpinBox.valueChanged.connect(self.onROIWinXChanged)
         self.verROIWidthSpinBox.valueChanged.connect(self.onROIWinYChanged)
-        self.adReader.imageSizeXChanged.connect(self.onSizeXChanged)
-        self.adReader.imageSizeYChanged.connect(self.onSizeYChanged)
         self.pixelSizeLineEdit.returnPressed.connect(self.onPixelSizeChanged)
 
         self.colorModeComboBox.currentIndexChanged.connect(self.colorModeChanged)
+        self.acquisitionModeComboBox.currentIndexChanged.connect(self.acquisitionModeChanged)
+        self.orientationComboBox.currentIndexChanged.connect(self.orientationChanged)
+        self.channelComboBox.currentIndexChanged.connect(self.channelChanged)
+        self.fitModelComboBox.currentIndexChanged.connect(self.fitModelChanged)
+        self.correctionCheckBox.stateChanged.connect(self.correctionChanged)
+        self.captureDarkPushButton.clicked.connect(self.captureDark)
+        self.loadFlatPushButton.clicked.connect(self.openFlatField)
+        self.averageModeComboBox.currentIndexChanged.connect(self.averageChanged)
+        self.averageLengthSpinBox.editingFinished.connect(self.averageChanged)
 
         self.saveImagePushButton.clicked.connect(self.saveImage)
         self.saveHorProfilesPushButton.clicked.connect(self.saveHorProfile)
@@ -169,10 +188,27 @@ class DynamicAD_Viewer(QtGui.QWidget):
         self.removeCrosshairPushButton.clicked.connect(self.removeCrosshair)
         self.openCrosshairPushButton.clicked.connect(self.openCrosshair)
         self.saveCrosshairPushButton.clicked.connect(self.saveCrosshair)
+        self.crosshairTableView.doubleClicked.connect(self.crosshairDoubleClicked)
+        self.openROIsPushButton.clicked.connect(self.openROIs)
+        self.addROIPushButton.clicked.connect(lambda: self.addROI())
+        self.saveROIsPushButton.clicked.connect(self.saveROIs)
+        self.clearROIsPushButton.clicked.connect(self.clearROIs)
+        self.monitorPVsPushButton.clicked.connect(self.openMonitorPVs)
 
         self.hideHorizontalROICheckBox.stateChanged.connect(self.horizontalROI_viewChanged)
         self.hideVerticalROICheckBox.stateChanged.connect(self.verticalROI_viewChanged)
 
+        self.historySlider.valueChanged.connect(self.onHistoryChanged)
+
+        self.displayRateSpinBox.valueChanged.connect(self.onDisplayRateChanged)
+        self.displayTimer.timeout.connect(self.updateDisplay)
+        self.historyLengthSpinBox.valueChanged.connect(self.onHistoryLengthChanged)
+        self.statsTimer.timeout.connect(self.updateStats)
+        self.perfOverlayCheckBox.stateChanged.connect(self.perfOverlayChanged)
+        self.metricsPushButton.clicked.connect(self.openMetricsFile)
+        self.recordCheckBox.stateChanged.connect(self.recordChanged)
+        self.recordFormatComboBox.currentTextChanged.connect(self.recordFormatChanged)
+
     def horizontalROI_viewChanged(self):
         if self.hideHorizontalROICheckBox.checkState()==Qt.Checked:
             self.horLine.hide()
@@ -198,203 +234,145 @@ class DynamicAD_Viewer(QtGui.QWidget):
         self.msgDlg.show()
 
     def addCrosshair(self):
-        self.crosshairTableWidget.blockSignals(True)
-        rowNum = self.crosshairTableWidget.rowCount()
-        colNum = self.crosshairTableWidget.columnCount()
         name='ch_%d'%self.chNum
-        self.crosshair.append({'Name':name,'Pos-X (mm)':self.crosshair_X*1e3,
-                               'Pos-Y (mm)':self.crosshair_Y*1e3,
-                               'Angle (deg)':0.0,
-                               'Linewidth (pix)':1.0,
-                               'Color':next(self.chColors),
-                               'Show':True})
-        self.crosshairTableWidget.setData(self.crosshair)
-        self.colorButtons[rowNum] = pg.ColorButton(color=self.crosshair[rowNum]['Color'])
-        self.colorButtons[rowNum].sigColorChanging.connect(self.cellDataChanged)
-        self.crosshairTableWidget.item(rowNum, 6).setText('')
-        self.crosshairTableWidget.item(rowNum, 6).setFlags(Qt.ItemIsUserCheckable | Qt.ItemIsEnabled)
-        if self.crosshair[rowNum]['Show']:
-            self.crosshairTableWidget.item(rowNum, 6).setCheckState(Qt.Checked)  # , self.showCheckBoxes[rowNum])
-        else:
-            self.crosshairTableWidget.item(rowNum, 6).setCheckState(Qt.Unchecked)  # , self.showCheckBoxes[rowNum])
-        self.crosshairTableWidget.setCellWidget(rowNum, 5, self.colorButtons[rowNum])
-        self.crosshairTableWidget.cellChanged.connect(self.cellDataChanged)
-        for row in range(rowNum):
-            self.colorButtons[row]=pg.ColorButton(color=self.crosshair[row]['Color'])
-            self.colorButtons[row].sigColorChanging.connect(self.cellDataChanged)
-            self.crosshairTableWidget.item(row, 6).setText('')
-            self.crosshairTableWidget.item(row, 6).setFlags(Qt.ItemIsUserCheckable | Qt.ItemIsEnabled)
-            if self.crosshair[row]['Show']:
-                self.crosshairTableWidget.item(row, 6).setCheckState(Qt.Checked)
-            else:
-                self.crosshairTableWidget.item(row, 6).setCheckState(Qt.Unchecked)
-            self.crosshairTableWidget.cellChanged.connect(self.cellDataChanged)
-            self.crosshairTableWidget.setCellWidget(row, 5, self.colorButtons[row])
-        self.updateCrosshairPlot()
+        self.crosshairModel.addCrosshair(newCrosshair(name, self.crosshair_X*1e3, self.crosshair_Y*1e3,
+                                                      color=next(self.chColors)))
         self.msgDlg.accept()
-        self.crosshairTableWidget.blockSignals(False)
         self.removeCrosshairPushButton.setEnabled(True)
         self.chNum+=1
 
-    def cellDataChanged(self):
-        rowNum = self.crosshairTableWidget.rowCount()
-        for row in range(rowNum):
-            self.crosshair[row]['Pos-X (mm)'] = float(self.crosshairTableWidget.item(row, 1).text())
-            self.crosshair[row]['Pos-Y (mm)'] = float(self.crosshairTableWidget.item(row, 2).text())
-            self.crosshair[row]['Angle (deg)'] = float(self.crosshairTableWidget.item(row, 3).text())
-            self.crosshair[row]['Linewidth (pix)'] = float(self.crosshairTableWidget.item(row, 4).text())
-            self.crosshair[row]['Color']=self.colorButtons[row].color()
-            if self.crosshairTableWidget.item(row,6).checkState()==Qt.Checked:
-                self.crosshair[row]['Show']=True
-            else:
-                self.crosshair[row]['Show']=False
-        self.updateCrosshairPlot()
-
-    def updateCrosshairPlot(self):
-        for i, ch in enumerate(self.crosshair):
-            if ch['Show']:
-                # crosshair_list.append({'pos':(ch['Pos-X (mm)']*1e-3,ch['Pos-Y (mm)']*1e-3),
-                #             'size':ch['Size (pix)'],
-                #             'pen':None,
-                #             'brush':ch['Color'],
-                #             'symbol':'x'})
-                try:
-                    self.crosshairPlotItems[ch['Name']]['vertical'].setValue((ch['Pos-X (mm)']*1e-3,ch['Pos-Y (mm)']*1e-3))
-                    self.crosshairPlotItems[ch['Name']]['vertical'].setAngle(90+ch['Angle (deg)'])
-                    self.crosshairPlotItems[ch['Name']]['vertical'].setPen(pg.mkPen(ch['Color'],width=ch['Linewidth ('
-                                                                                                       'pix)']))
-                    self.crosshairPlotItems[ch['Name']]['horizontal'].setValue((ch['Pos-X (mm)']*1e-3,ch['Pos-Y (mm)']*1e-3))
-                    self.crosshairPlotItems[ch['Name']]['horizontal'].setAngle(ch['Angle (deg)'])
-                    self.crosshairPlotItems[ch['Name']]['horizontal'].setPen(pg.mkPen(ch['Color'], width=ch['Linewidth ('
-                                                                                                 'pix)']))
-                except:
-                    self.crosshairPlotItems[ch['Name']]={
-                        'vertical':pg.InfiniteLine(pos=(ch['Pos-X (mm)']*1e-3,ch['Pos-Y (mm)']*1e-3), angle=90+ch[
-                            'Angle (deg)'],
-                                                   pen=pg.mkPen(ch['Color'],
-                                                                                                   width=ch[
-                                                                                                       'Linewidth ('
-                                                                                                       'pix)']),
-                                                   movable=False, label=ch['Name']),
-                        'horizontal': pg.InfiniteLine(pos=(ch['Pos-X (mm)']*1e-3, ch['Pos-Y (mm)'] * 1e-3),
-                                                           angle=ch['Angle (deg)'],
-                        pen=pg.mkPen(ch['Color'],
-                                                                                                        width=ch[
-                                                                                                            'Linewidth ('
-                                                                                                            'pix)']),
-                                                    movable=False, label=ch['Name'])
-                    }
-                    self.vb.addItem(self.crosshairPlotItems[ch['Name']]['vertical'])
-                    self.vb.addItem(self.crosshairPlotItems[ch['Name']]['horizontal'])
-                    print('ch created')
-
-                self.crosshairPlotItems[ch['Name']]['vertical'].show()
-                self.crosshairPlotItems[ch['Name']]['horizontal'].show()
-            else:
-                self.crosshairPlotItems[ch['Name']]['vertical'].hide()
-                self.crosshairPlotItems[ch['Name']]['horizontal'].hide()
-
+    def crosshairDoubleClicked(self, index):
+        """
+        Changes the color of the crosshair when its Color cell is double clicked
+        """
+        if crosshairKeys[index.column()]!='Color':
+            return
+        ch=self.crosshairModel.crosshairs[index.row()]
+        color=QtGui.QColorDialog.getColor(ch['Color'], self, 'Color of %s'%ch['Name'])
+        if color.isValid():
+            self.crosshairModel.setColor(index.row(), color)
 
     def removeCrosshair(self):
-        self.crosshairTableWidget.blockSignals(True)
-        indices=self.crosshairTableWidget.selectionModel().selectedRows()
-        for index in sorted(indices, reverse=True):
-            name=self.crosshairTableWidget.item(index.row(),0).text()
-            self.vb.removeItem(self.crosshairPlotItems[name]['vertical'])
-            self.vb.removeItem(self.crosshairPlotItems[name]['horizontal'])
-            self.crosshair.pop(index.row())
-            del self.crosshairPlotItems[name]
-        self.crosshairTableWidget.setData(self.crosshair)
-        rowNum = self.crosshairTableWidget.rowCount()
-        for row in range(rowNum):
-            self.colorButtons[row] = pg.ColorButton(color=self.crosshair[row]['Color'])
-            self.colorButtons[row].sigColorChanging.connect(self.cellDataChanged)
-            self.crosshairTableWidget.item(row, 6).setText('')
-            self.crosshairTableWidget.item(row, 6).setFlags(Qt.ItemIsUserCheckable | Qt.ItemIsEnabled)
-            if self.crosshair[row]['Show']:
-                self.crosshairTableWidget.item(row, 6).setCheckState(Qt.Checked)
-            else:
-                self.crosshairTableWidget.item(row, 6).setCheckState(Qt.Unchecked)
-            self.crosshairTableWidget.cellChanged.connect(self.cellDataChanged)
-            self.crosshairTableWidget.setCellWidget(row, 5, self.colorButtons[row])
-        self.crosshairTableWidget.blockSignals(False)
-        if self.crosshairTableWidget.rowCount()==0:
+        rows=[index.row() for index in self.crosshairTableView.selectionModel().selectedRows()]
+        self.crosshairModel.removeCrosshairs(rows)
+        if self.crosshairModel.rowCount()==0:
             self.removeCrosshairPushButton.setEnabled(False)
 
     def removeAllCrosshair(self):
-        self.crosshairTableWidget.blockSignals(True)
-        for row in range(self.crosshairTableWidget.rowCount()-1,-1,-1):
-            name = self.crosshairTableWidget.item(row, 0).text()
-            self.vb.removeItem(self.crosshairPlotItems[name]['vertical'])
-            self.vb.removeItem(self.crosshairPlotItems[name]['horizontal'])
-            self.crosshair.pop(row)
-            del self.crosshairPlotItems[name]
-        self.crosshairTableWidget.setData(self.crosshair)
-        self.crosshairTableWidget.blockSignals(False)
+        self.crosshairModel.setCrosshairs([])
         self.removeCrosshairPushButton.setEnabled(False)
         self.chNum=0
 
-
     def openCrosshair(self):
         fname=QtGui.QFileDialog.getOpenFileName(self,'Open Crosshair File','','Crosshair Files (*.chr)')[0]
         if fname!='':
-            fh=open(fname,'r')
-            self.removeAllCrosshair()
-            lines=fh.readlines()
-            keys=lines[1].strip()[1:].split('\t')
-            self.crosshair = []
-            for line in lines:
-                if line[0]!='#':
-                    values=line.strip().split('\t')
-                    ch={}
-                    for i,value in enumerate(values):
-                        try:
-                            ch[keys[i]]=float(value)
-                        except:
-                            ch[keys[i]]=value
-                    self.crosshair.append(ch)
-                    self.chNum+=1
-            self.crosshairTableWidget.blockSignals(True)
-            self.crosshairTableWidget.setData(self.crosshair)
-            rowNum=self.crosshairTableWidget.rowCount()
-            for row in range(rowNum):
-                self.colorButtons[row] = pg.ColorButton(color=self.crosshair[row]['Color'])
-                self.colorButtons[row].sigColorChanging.connect(self.cellDataChanged)
-                self.crosshairTableWidget.item(row, 6).setText('')
-                self.crosshairTableWidget.item(row, 6).setFlags(Qt.ItemIsUserCheckable | Qt.ItemIsEnabled)
-                if self.crosshair[row]['Show']:
-                    self.crosshairTableWidget.item(row, 6).setCheckState(Qt.Checked)
-                else:
-                    self.crosshairTableWidget.item(row, 6).setCheckState(Qt.Unchecked)
-                self.crosshairTableWidget.cellChanged.connect(self.cellDataChanged)
-                self.crosshairTableWidget.setCellWidget(row, 5, self.colorButtons[row])
-            self.crosshairTableWidget.blockSignals(False)
-            self.crosshairPlotItems={}
-            self.updateCrosshairPlot()
-            self.removeCrosshairPushButton.setEnabled(True)
-
+            try:
+                crosshairs=readCrosshairFile(fname)
+            except (IOError, IndexError, ValueError) as err:
+                QtGui.QMessageBox.warning(self,'File Error','Cannot read the crosshair file %s:\n%s'%(fname, err),
+                                          QtGui.QMessageBox.Ok)
+                return
+            self.crosshairModel.setCrosshairs(crosshairs)
+            self.chNum=len(crosshairs)
+            self.removeCrosshairPushButton.setEnabled(len(crosshairs)>0)
 
     def saveCrosshair(self):
-        if self.crosshairTableWidget.rowCount()>0:
+        if self.crosshairModel.rowCount()>0:
             fname=QtGui.QFileDialog.getSaveFileName(self,'Save file as','', 'Crosshair Files (*.chr)')[0]
             if fname!='':
                 if os.path.splitext(fname)[1]=='':
                     fname=fname+'.chr'
-                line='# Crosshair file saved on %s\n'%time.ctime()
-                line+='#'
-                for key in self.crosshair[0]:
-                    line+='%s\t'%key
-                line+='\n'
-                for ch in self.crosshair:
-                    for key in ch.keys():
-                        line+=str(ch[key])+'\t'
-                    line+='\n'
-                fh=open(fname,'w')
-                fh.writelines(line)
-                fh.close()
+                writeCrosshairFile(fname, self.crosshairModel.crosshairs)
 
+    def addROI(self, name=None, rect=None):
+        """
+        Adds a rectangular ROI to the image
 
+        :param name: name of the ROI used in the time series, ROI_<number> by default
+        :param rect: (x0, y0, x1, y1) in pixels of the displayed image, a 50x50 pixels ROI in the middle of the view
+        by default
+        """
+        if self.saveFile is not None:
+            QtGui.QMessageBox.warning(self,"Warning","Please Stop the autosave of the time series first",
+                                      QtGui.QMessageBox.Ok)
+            return
+        if rect is None:
+            (xmin, xmax), (ymin, ymax) = self.vb.viewRange()
+            x, y = int((xmin+xmax)/2/self.pixelSize), int((ymin+ymax)/2/self.pixelSize)
+            rect=(x-25, y-25, x+25, y+25)
+        if name is None:
+            name='ROI_%d'%self.roiNum
+        self.roiNum+=1
+        color=self.colors[len(self.roiItems)%len(self.colors)]
+        roi=pg.RectROI((rect[0]*self.pixelSize, rect[1]*self.pixelSize),
+                       ((rect[2]-rect[0])*self.pixelSize, (rect[3]-rect[1])*self.pixelSize), pen=pg.mkPen(color))
+        label=pg.TextItem(name, color=color, anchor=(0, 0))
+        label.setParentItem(roi)
+        self.vb.addItem(roi)
+        roi.sigRegionChangeFinished.connect(self.roisChanged)
+        self.roiItems.append((name, roi, label))
+        self.roisChanged()
+
+    def roisChanged(self):
+        """
+        Updates the ROIs analyzed in the frames from the ROIs drawn on the image
+        """
+        rois=[]
+        for name, roi, label in self.roiItems:
+            pos, size = roi.pos(), roi.size()
+            rois.append((name, (int(round(pos.x()/self.pixelSize)), int(round(pos.y()/self.pixelSize)),
+                                int(round((pos.x()+size.x())/self.pixelSize)),
+                                int(round((pos.y()+size.y())/self.pixelSize)))))
+        self.roiStats.setROIs(rois)
+        if not self.startUpdate:
+            try:
+                self.roiValues=self.roiStats.compute(self.greyData, self.orientation, weights=self.channelWeights)
+                self.drawROIStats()
+            except AttributeError:
+                pass
 
+    def drawROIStats(self):
+        """
+        Shows the mean and the centroid of every ROI on its label
+        """
+        if len(self.roiValues)!=len(self.roiItems):
+            return
+        for (name, roi, label), values in zip(self.roiItems, self.roiValues):
+            label.setText('%s: %.4g\n(%.4f, %.4f) mm'%(name, values[1], 1e3*self.pixelSize*values[2],
+                                                        1e3*self.pixelSize*values[3]))
+
+    def clearROIs(self):
+        if self.saveFile is not None:
+            QtGui.QMessageBox.warning(self,"Warning","Please Stop the autosave of the time series first",
+                                      QtGui.QMessageBox.Ok)
+            return
+        for name, roi, label in self.roiItems:
+            self.vb.removeItem(roi)
+        self.roiItems=[]
+        self.roiNum=0
+        self.roisChanged()
+
+    def openROIs(self):
+        fname=QtGui.QFileDialog.getOpenFileName(self,'Open ROI File',self.dataDir,'ROI Files (*.roi *.txt)')[0]
+        if fname=='' or self.saveFile is not None:
+            return
+        try:
+            rois=readROIFile(fname)
+        except (IOError, OSError, ValueError, IndexError) as error:
+            QtGui.QMessageBox.warning(self,"File Error","Could not read the ROIs: %s"%error,QtGui.QMessageBox.Ok)
+            return
+        self.clearROIs()
+        for name, rect in rois:
+            self.addROI(name, rect)
+
+    def saveROIs(self):
+        if len(self.roiItems)==0:
+            return
+        fname=QtGui.QFileDialog.getSaveFileName(self,'Save file as',self.dataDir,'ROI Files (*.roi)')[0]
+        if fname!='':
+            if os.path.splitext(fname)[1]=='':
+                fname+='.roi'
+            writeROIFile(fname, self.roiStats.rois)
 
     def exposureTimeChanged(self):
         if self.startUpdate:
@@ -403,7 +381,7 @@ class DynamicAD_Viewer(QtGui.QWidget):
             return
         else:
             self.expTime=float(self.expTimeLineEdit.text())
-            epics.caput(self.detPV + 'cam1:AcquireTime', self.expTime)
+            self.adReader.source.setExposureTime(self.expTime)
 
     def acquirePeriodChanged(self):
         if self.startUpdate:
@@ -412,7 +390,7 @@ class DynamicAD_Viewer(QtGui.QWidget):
             return
         else:
             self.period=float(self.acquirePeriodLineEdit.text())
-            epics.caput(self.detPV+'cam1:AcquirePeriod',self.period)
+            self.adReader.source.setAcquirePeriod(self.period)
 
     def colorModeChanged(self):
         if self.startUpdate:
@@ -421,34 +399,183 @@ class DynamicAD_Viewer(QtGui.QWidget):
             return
         else:
             self.colorMode=self.colorModeComboBox.currentText()
-            if self.colorMode=='Greyscale':
-                epics.caput(self.detPV+'cam1:ColorMode', 0)
-                epics.caput(self.detPV+'cam1:BayerConvert', 0)
-            else:
-                epics.caput(self.detPV+'cam1:ColorMode', 2)
-                epics.caput(self.detPV + 'cam1:BayerConvert', 1)
-            epics.caput(BYTES2STR(self.detPV + "cam1:ArrayCounter"), 0)
-            epics.caput(BYTES2STR(self.detPV + "cam1:Acquire"), 1)
-            time.sleep(0.2)
-            epics.caput(BYTES2STR(self.detPV + "cam1:Acquire"), 0)
-            epics.caput(BYTES2STR(self.detPV + "cam1:ArrayCounter"), 0)
+            self.adReader.colorMode=self.colorMode
+            self.channelComboBox.setEnabled(self.colorMode!='Greyscale')
+            self.adReader.source.setColorMode(self.colorMode)
+
+    def channelChanged(self):
+        """
+        Selects the luminance or a single channel of RGB frames for the analysis
+        """
+        self.channelWeights=channelWeights[self.channelComboBox.currentText()]
+        if not self.startUpdate:
+            try:
+                self.projections.setData(self.greyData)
+                self.updateVerCut()
+                self.updateHorCut()
+            except AttributeError:
+                pass
+
+    def fitModelChanged(self):
+        """
+        Selects the centroid or the Gaussian fit for the peak positions and widths of the cuts
+        """
+        if self.saveFile is not None:
+            QtGui.QMessageBox.warning(self,"Warning","Please Stop the autosave of the time series first",
+                                      QtGui.QMessageBox.Ok)
+            self.fitModelComboBox.blockSignals(True)
+            self.fitModelComboBox.setCurrentText(self.peakFitter.model)
+            self.fitModelComboBox.blockSignals(False)
+            return
+        self.peakFitter=PeakFitter(self.fitModelComboBox.currentText())
+        self.settings.setValue('FitModel', self.peakFitter.model)
+        if not self.startUpdate:
+            try:
+                self.updateVerCut()
+                self.updateHorCut()
+            except AttributeError:
+                pass
+
+    def correctionChanged(self):
+        """
+        Enables the dark-frame and flat-field correction of the next frames
+        """
+        self.adReader.correction.enabled=self.correctionCheckBox.isChecked()
+
+    def captureDark(self):
+        """
+        Averages the next frames of the detector into the dark frame
+        """
+        if not self.startUpdate:
+            QtGui.QMessageBox.warning(self,"Warning","Please Start the updating of the image first",QtGui.QMessageBox.Ok)
+            return
+        self.captureDarkPushButton.setEnabled(False)
+        self.captureDarkPushButton.setText('Capturing...')
+        self.adReader.correction.startDarkCapture(self.darkFramesSpinBox.value())
+
+    def onDarkCaptured(self):
+        self.captureDarkPushButton.setEnabled(True)
+        self.captureDarkPushButton.setText('Capture Dark')
+        self.captureDarkPushButton.setToolTip('Dark frame averaged over %d frames on %s'%(
+            self.darkFramesSpinBox.value(), time.asctime()))
+
+    def openFlatField(self):
+        """
+        Selects the flat-field of the detector. Cancelling removes the flat-field.
+        """
+        fname=QtGui.QFileDialog.getOpenFileName(self,'Open Flat-Field File',self.dataDir,
+                                                'Flat-Field Files (*.tif *.tiff *.npy)')[0]
+        try:
+            self.loadFlatField(fname)
+        except (IOError, OSError, ValueError) as error:
+            QtGui.QMessageBox.warning(self,"File Error","Could not load the flat-field: %s"%error,QtGui.QMessageBox.Ok)
+
+    def loadFlatField(self, fname):
+        """
+        Loads the flat-field of the detector from an image or .npy file in the layout of the detector frames, as
+        saved by saveImage. The flat-field is removed if fname is ''.
+        """
+        self.adReader.correction.setFlat(None)
+        self.settings.setValue('FlatField/'+self.detPV, '')
+        self.loadFlatPushButton.setToolTip('')
+        if fname=='':
+            return
+        flat=loadMap(fname)
+        if self.colorMode=='Greyscale':
+            shape=(self.adReader.sizeY, self.adReader.sizeX)
+        else:
+            shape=(self.adReader.sizeY, self.adReader.sizeX, 3)
+        if flat.shape!=shape:
+            raise ValueError('The flat-field has the shape %s instead of %s'%(flat.shape, shape))
+        self.adReader.correction.setFlat(flat)
+        self.settings.setValue('FlatField/'+self.detPV, fname)
+        self.loadFlatPushButton.setToolTip(fname)
+
+    def averageChanged(self):
+        """
+        Sets the running average of the frames displayed and analyzed. The history is lengthened if it is too short
+        for the rolling average.
+        """
+        mode=self.averageModeComboBox.currentText()
+        length=self.averageLengthSpinBox.value()
+        if mode=='Rolling' and self.historyLengthSpinBox.value()<=length:
+            self.historyLengthSpinBox.setValue(length+1)
+        self.adReader.averager.setMode(mode, length)
+
+    def acquisitionModeChanged(self):
+        if self.startUpdate:
+            QtGui.QMessageBox.warning(self,"Warning","Please Stop the updating of the image first",QtGui.QMessageBox.Ok)
+            self.acquisitionModeComboBox.setCurrentText(self.adReader.acquisitionMode)
+            return
+        else:
+            self.adReader.acquisitionMode=self.acquisitionModeComboBox.currentText()
+
+    def orientationChanged(self):
+        if self.startUpdate:
+            QtGui.QMessageBox.warning(self,"Warning","Please Stop the updating of the image first",QtGui.QMessageBox.Ok)
+            self.orientationComboBox.setCurrentText(self.orientation.name)
+            return
+        else:
+            self.orientation=Orientation(self.orientationComboBox.currentText())
+            self.settings.setValue('Orientation/'+self.detPV, self.orientation.name)
+            try:
+                self.create_PlotLayout(image=None)
+            except:
+                pass
+
+    def loadOrientation(self):
+        """
+        Loads the orientation saved for the detector
+        """
+        name=self.settings.value('Orientation/'+self.detPV, 'Normal')
+        if name not in Orientation.orientations:
+            name='Normal'
+        self.orientation=Orientation(name)
+        self.orientationComboBox.blockSignals(True)
+        self.orientationComboBox.setCurrentText(name)
+        self.orientationComboBox.blockSignals(False)
+
+    def loadDetectorFiles(self):
+        """
+        Loads the monitor PVs and the metrics file saved for the detector, so that the viewers of several detectors
+        keep their own. The files saved before they were kept per detector are used by default.
+        """
+        self.loadMonitorPVs(self.settings.value('MonitorPVFile/'+self.detPV, self.settings.value('MonitorPVFile', '')))
+        self.setMetricsFile(self.settings.value('MetricsFile/'+self.detPV, self.settings.value('MetricsFile', '')))
 
     def onDetPVChanged(self):
+        self.stopRecording()
         self.detPV=self.detPVLineEdit.text()
+        self.loadOrientation()
+        self.loadDetectorFiles()
         self.adReader=AD_Reader(parent=self,detPV=self.detPV)
+        self.adReader.imageSizeXChanged.connect(self.onSizeXChanged)
+        self.adReader.imageSizeYChanged.connect(self.onSizeYChanged)
+        self.adReader.darkCaptured.connect(self.onDarkCaptured)
+        self.adReader.sourceFinished.connect(self.onReplayFinished)
+        self.adReader.stats=self.stats
+        self.adReader.analyze=self.analyzeCuts
+        self.adReader.acquisitionMode=self.acquisitionModeComboBox.currentText()
+        self.adReader.bufferLength=self.historyLengthSpinBox.value()
+        self.adReader.correction.enabled=self.correctionCheckBox.isChecked()
+        self.adReader.averager.setMode(self.averageModeComboBox.currentText(), self.averageLengthSpinBox.value())
+        try:
+            self.adReader.colorMode=self.colorMode
+        except AttributeError:
+            pass
         if self.adReader.connected:
-            self.horROIWidthSpinBox.setMaximum(self.adReader.sizeX)
-            self.verROIWidthSpinBox.setMaximum(self.adReader.sizeY)
             self.ROIWinX=self.horROIWidthSpinBox.value()
             self.ROIWinY=self.verROIWidthSpinBox.value()
             self.create_PlotLayout()
-        #    self.init_signals()
+            try:
+                self.loadFlatField(self.settings.value('FlatField/'+self.detPV, ''))
+            except (IOError, OSError, ValueError):
+                pass
             self.imageSizeXLineEdit.setText('%d'%self.adReader.sizeX)
             self.imageSizeYLineEdit.setText('%d'%self.adReader.sizeY)
         else:
             QtGui.QMessageBox.warning(self,"PV Error","Please check the PV is valid and the Detector IOC is running."
                                                       ,QtGui.QMessageBox.Ok)
-        self.init_signals()
             #self.close()
 
     def openImageFile(self):
@@ -457,6 +584,31 @@ class DynamicAD_Viewer(QtGui.QWidget):
         if fname is not None and os.path.exists(fname):
             self.create_PlotLayout(image=fname)
 
+    def openReplay(self):
+        """
+        Replays a stack of frames through the analysis, the display and the autosave, see
+        frame_sources.StackReplaySource
+        """
+        if self.startUpdate:
+            QtGui.QMessageBox.warning(self,"Warning","Please Stop the updating of the image first",QtGui.QMessageBox.Ok)
+            return
+        fname=QtGui.QFileDialog.getOpenFileName(self,'Select a stack of frames',directory=self.dataDir,
+                                                filter='Stacks (*.tif *.tiff *.h5 *.hdf5 *.npy)')[0]
+        if fname=='':
+            return
+        self.dataDir=os.path.dirname(fname)
+        self.detPVLineEdit.setText('replay:%s,rate=%g'%(fname, self.replayRateSpinBox.value()))
+        self.onDetPVChanged()
+
+    def replayRateChanged(self, rate):
+        try:
+            self.adReader.source.setRate(rate)
+        except AttributeError:
+            pass
+
+    def onReplayFinished(self):
+        if self.startUpdate:
+            self.onStopUpdate()
 
     def saveImage(self):
         try:
@@ -466,7 +618,8 @@ class DynamicAD_Viewer(QtGui.QWidget):
                                                                                                      "*.tif "
                                                                                              "*.tiff)")
             self.dataDir=os.path.dirname(fname[0])
-            imsave(fname[0],data.T)
+            from imageio import imsave
+            imsave(fname[0],data)
         except:
             QtGui.QMessageBox.warning(self,"Data Error","The 2D data doesnot exist. Please make sure the IOC is "
                                                         "running and at least one image is collected from the "
@@ -542,32 +695,40 @@ class DynamicAD_Viewer(QtGui.QWidget):
     def onStartUpdate(self):
         self.cutSeriesExists=False
         self.widSeriesExists=False
-        epics.caput(BYTES2STR(self.detPV + "cam1:ArrayCounter"), 0)
-        epics.caput(BYTES2STR(self.detPV + "cam1:Acquire"), 1)
-        epics.camonitor(BYTES2STR(self.detPV + "image1:ArrayCounter_RBV"),callback=self.onArrayDataUpdate)
-        self.arrayDataUpdated.connect(self.start_stop_Update)
+        self.stats.clear()
+        # The frame counters of the detector may start over
+        self.peakFitter.reset()
+        self.adReader.source.setAcquire(True)
+        self.adReader.frameReady.connect(self.start_stop_Update)
+        self.adReader.startAcquisition()
         self.startUpdate=True
         self.startTime = time.time()
-        self.posTimeData = []
-        self.widTimeData = []
+        self.lastDisplayTime = 0.0
+        self.analysisCount = 0
+        self.displayCount = 0
+        self.fpsTime = self.startTime
+        self.timeSeries.clear()
+        self.statsTimer.start()
         self.startUpdatePushButton.setEnabled(False)
         self.stopUpdatePushButton.setEnabled(True)
         self.setOutputOptions(enabled=False)
+        self.setHistoryOptions(enabled=False)
         self.detPVLineEdit.setEnabled(False)
 
-    def onArrayDataUpdate(self,**kwargs):
-        self.arrayDataUpdated.emit()
-
-
     def onStopUpdate(self):
         self.startUpdate=False
-        self.arrayDataUpdated.disconnect(self.start_stop_Update)
+        self.adReader.stopAcquisition()
+        self.adReader.frameReady.disconnect(self.start_stop_Update)
+        self.displayTimer.stop()
+        self.updateDisplay()
+        self.statsTimer.stop()
+        self.updateStats()
         self.startUpdatePushButton.setEnabled(True)
         self.stopUpdatePushButton.setEnabled(False)
         self.setOutputOptions(enabled=True)
+        self.setHistoryOptions(enabled=True)
         self.detPVLineEdit.setEnabled(True)
-        epics.caput(BYTES2STR(self.detPV + "cam1:Acquire"), 0)
-        epics.caput(BYTES2STR(self.detPV + "cam1:ArrayCounter"),0)
+        self.adReader.source.setAcquire(False)
         if self.widSeriesExists:
             self.widthCutPlot.close()
         if self.cutSeriesExists:
@@ -580,22 +741,197 @@ class DynamicAD_Viewer(QtGui.QWidget):
         self.saveHorProfilesPushButton.setEnabled(enabled)
         self.saveVerProfilesPushButton.setEnabled(enabled)
 
-    def start_stop_Update(self):
-        data=self.adReader.data_PV.get()
-        if self.colorMode == 'Greyscale':
-            self.imgData = np.rot90(data.reshape(self.adReader.sizeY, self.adReader.sizeX), k=-1,
-                                    axes=(0, 1))
-            self.greyData = self.imgData
+    def setHistoryOptions(self,enabled=True):
+        self.historySlider.blockSignals(True)
+        self.historySlider.setValue(0)
+        if enabled and self.adReader.frameBuffer is not None:
+            self.historySlider.setMaximum(max(self.adReader.frameBuffer.count-1,0))
+        self.historySlider.blockSignals(False)
+        self.historySlider.setEnabled(enabled)
+        self.historyLengthSpinBox.setEnabled(enabled)
+        self.historyLabel.setText('History: Live')
+
+    def onHistoryLengthChanged(self):
+        self.adReader.bufferLength=self.historyLengthSpinBox.value()
+
+    def onHistoryChanged(self):
+        """
+        Shows the frame from the frame buffer selected by the history slider
+        """
+        if self.adReader.frameBuffer is None or self.adReader.frameBuffer.count==0:
+            return
+        age=self.historySlider.value()
+        frame=self.adReader.getHistoryFrame(age)
+        self.setFrameData(frame['imgData'], frame['greyData'])
+        self.imgPlot.setImage(self.imgData,autoLevels=False)
+        self.updateVerCut()
+        self.updateHorCut()
+        if age==0:
+            self.historyLabel.setText('History: Live [#%d]'%frame['counter'])
         else:
-            self.imgData = np.rot90(data.reshape(self.adReader.sizeY, self.adReader.sizeX, 3), k=-1, axes=(0, 1))
-            self.greyData = self.imgData[..., :3]#@np.array([0.299, 0.587, 0.114])
+            self.historyLabel.setText('History: -%d [#%d]'%(age,frame['counter']))
+
+    def setFrameData(self, imgData, greyData):
+        """
+        Sets the frame used for displaying (imgData) and for the analysis (greyData)
+        """
+        self.imgData = imgData
+        self.greyData = greyData
+        self.projections.setData(greyData)
+
+    def start_stop_Update(self):
+        """
+        Analyzes all the queued frames and schedules the display of the latest one. The display is refreshed at
+        most at the display rate whereas the analysis and the autosave run for every frame.
+        """
+        frames=self.adReader.frameQueue.getAll()
+        if len(frames)==0:
+            # Frames already consumed by an earlier call
+            return
+        for frame in frames:
+            t=time.perf_counter()
+            self.stats.add('queue', time.time()-frame['time'])
+            self.setFrameData(frame['imgData'], frame['greyData'])
+            self.frameCuts=frame['analysis'].result() if 'analysis' in frame else None
+            self.imageUpdated.emit(self.imgData)
+            # The frame stays in use for the display and the ROI projections until the next frame replaces it
+            if self.heldFrame is not None:
+                releaseFrame(self.heldFrame)
+            self.heldFrame=frame
+            self.analysisCount+=1
+            self.stats.add('analysis', time.perf_counter()-t)
+            self.stats.count('processed')
+        if not self.displayTimer.isActive():
+            wait=self.lastDisplayTime+self.displayInterval-time.time()
+            self.displayTimer.start(max(int(1e3*wait),0))
+
+    def onDisplayRateChanged(self):
+        self.displayInterval=1.0/self.displayRateSpinBox.value()
+
+    def updateDisplay(self):
+        """
+        Redraws the image, the cuts and the time series with the latest analyzed frame
+        """
+        t=time.time()
+        self.lastDisplayTime=t
+        start=time.perf_counter()
         self.imgPlot.setImage(self.imgData,autoLevels=False)
-        self.imageUpdated.emit(self.imgData)
+        imageDrawn=time.perf_counter()
+        self.drawVerCut()
+        self.drawHorCut()
+        self.drawROIStats()
+        cutsDrawn=time.perf_counter()
+        if self.plotPosCheckBox.isChecked() and len(self.timeSeries)>0:
+            self.posTimeSeriesReady.emit()
+        if self.plotWidCheckBox.isChecked() and len(self.timeSeries)>0:
+            self.widTimeSeriesReady.emit()
+        end=time.perf_counter()
+        self.stats.add('setImage', imageDrawn-start)
+        self.stats.add('drawCuts', cutsDrawn-imageDrawn)
+        self.stats.add('drawSeries', end-cutsDrawn)
+        self.stats.add('display', end-start)
+        self.stats.count('displayed')
+        self.displayCount+=1
+        if t-self.fpsTime>=1.0:
+            self.fpsLabel.setText('Analysis: %.1f FPS, Display: %.1f FPS'%(self.analysisCount/(t-self.fpsTime),
+                                                                          self.displayCount/(t-self.fpsTime)))
+            self.analysisCount=0
+            self.displayCount=0
+            self.fpsTime=t
+        self.updateFrameStats()
+
+    def updateFrameStats(self):
+        text='Frames: %d, Dropped: %d'%(self.adReader.receivedFrames, self.adReader.droppedFrames)
+        recorder=self.recorder
+        if recorder is not None:
+            text+=', Recorded: %d, Queued: %d, Not recorded: %d'%(recorder.writtenFrames, recorder.queuedFrames,
+                                                                  recorder.droppedFrames)
+        if self.adReader.firstFrameTime is not None:
+            text+=', First frame: %.0f ms'%(1e3*self.adReader.firstFrameTime)
+        if self.metricsError is not None:
+            text+=', Metrics file not written'
+        self.frameStatsLabel.setText(text)
+
+    def updateStats(self):
+        """
+        Refreshes the performance overlay and writes the metrics file
+        """
+        self.stats.setCount('received', self.adReader.receivedFrames)
+        self.stats.setCount('dropped', self.adReader.droppedFrames)
+        recorder=self.recorder
+        if recorder is not None:
+            self.stats.setCount('recorded', recorder.writtenFrames)
+            self.stats.setCount('unrecorded', recorder.droppedFrames)
+            if recorder.full or recorder.error is not None:
+                self.stopRecording()
+        if self.perfOverlayCheckBox.isChecked():
+            self.perfOverlay.setText(self.stats.formatText())
+        if self.metricsFile!='' and self.metricsError is None:
+            try:
+                self.stats.writeMetrics(self.metricsFile, detector=self.detPV)
+            except OSError as error:
+                # Reported once, the file is not written again until another one is selected
+                self.metricsError=error
+                self.metricsPushButton.setToolTip('Could not write the metrics file %s:\n%s'%(self.metricsFile,
+                                                                                              error))
+                self.updateFrameStats()
+
+    def perfOverlayChanged(self):
+        try:
+            self.perfOverlay.setVisible(self.perfOverlayCheckBox.isChecked())
+        except AttributeError:
+            return
+        if self.perfOverlayCheckBox.isChecked():
+            self.updateStats()
+
+    def openMetricsFile(self):
+        """
+        Selects the file the metrics are written to. Cancelling stops writing the metrics.
+        """
+        fname=QtGui.QFileDialog.getSaveFileName(self, 'Select the metrics file', self.metricsFile,
+                                                filter='Metrics Files (*.prom *.txt)')[0]
+        self.settings.setValue('MetricsFile/'+self.detPV, fname)
+        self.setMetricsFile(fname)
+
+    def setMetricsFile(self, fname):
+        """
+        Sets the file the metrics are written to, none if fname is ''. A previous error of the metrics file is
+        cleared.
+        """
+        self.metricsFile=fname
+        self.metricsError=None
+        self.metricsPushButton.setToolTip(fname)
 
 
     def create_PlotLayout(self,image=None):
-        self.xValues=self.pixelSize*np.arange(self.adReader.sizeX)
-        self.yValues=self.pixelSize*np.arange(self.adReader.sizeY)
+        if image is None:
+            try:
+                data = self.adReader.source.getFrame()
+                if self.colorMode=='Greyscale':
+                    imgData = data.reshape(self.adReader.sizeY, self.adReader.sizeX)
+                    self.setFrameData(imgData, imgData)
+                else:
+                    imgData = data.reshape(self.adReader.sizeY, self.adReader.sizeX,3)
+                    self.setFrameData(imgData, imgData)
+            except:
+                from imageio import imread
+                data=imread('2dimage_2.tif')
+                imgData = data.reshape(self.adReader.sizeY, self.adReader.sizeX)
+                self.setFrameData(imgData, imgData)
+        else:
+            # The image is shown with its own size, which may differ from the one of the detector
+            from imageio import imread
+            imgData=imread(image)
+            self.setFrameData(imgData, imgData)
+        self.imageSizeX, self.imageSizeY = self.orientation.displayShape(self.imgData.shape)
+        self.horROIWidthSpinBox.blockSignals(True)
+        self.verROIWidthSpinBox.blockSignals(True)
+        self.horROIWidthSpinBox.setMaximum(self.imageSizeX)
+        self.verROIWidthSpinBox.setMaximum(self.imageSizeY)
+        self.horROIWidthSpinBox.blockSignals(False)
+        self.verROIWidthSpinBox.blockSignals(False)
+        self.xValues=self.pixelSize*np.arange(self.imageSizeX)
+        self.yValues=self.pixelSize*np.arange(self.imageSizeY)
         #self.vb = self.imageLayout.addViewBox(lockAspect=True)
         self.imagePlot=self.imageLayout.getItem(0,0)
         if self.imagePlot is None:
@@ -603,36 +939,30 @@ class DynamicAD_Viewer(QtGui.QWidget):
             self.imagePlot.setLabel('left',text='Y',units='m')
             self.imagePlot.setLabel('bottom',text='X',units='m')
             self.imagePlot.setAspectLocked(lock=False,ratio=1)
+            # Parented to the view box and not added to it, so that it stays in the corner while zooming
+            self.perfOverlay=pg.TextItem(color='g', anchor=(0, 0), fill=(0, 0, 0, 150))
+            self.perfOverlay.setFont(QtGui.QFont('Monospace', 8))
+            self.perfOverlay.setParentItem(self.imagePlot.getViewBox())
+            self.perfOverlay.setPos(5, 5)
+            self.perfOverlay.setVisible(self.perfOverlayCheckBox.isChecked())
 
         try:
             self.imagePlot.removeItem(self.imgPlot)
         except:
             pass
-        self.imgPlot = pg.ImageItem()
-        self.imgPlot.scale(self.pixelSize, self.pixelSize)
+        # The detector frame is displayed as it is and the orientation is applied by the transform of the item
+        self.imgPlot = pg.ImageItem(axisOrder='row-major')
+        self.imgPlot.setTransform(QtGui.QTransform(*self.orientation.transformMatrix(self.imgData.shape,
+                                                                                     self.pixelSize)))
         self.oldPixelSize=copy.copy(self.pixelSize)
         self.imagePlot.addItem(self.imgPlot)
         self.vb = self.imagePlot.getViewBox()
         self.vb.scene().sigMouseClicked.connect(self.onClick)
         self.vb.addItem(self.imgPlot)
-        self.vb.setRange(QtCore.QRectF(0, 0, self.adReader.sizeX, self.adReader.sizeY))
-        if image is None:
-            try:
-                data = self.adReader.data_PV.get()
-                if self.colorMode=='Greyscale':
-                    self.imgData = np.rot90(data.reshape(self.adReader.sizeY, self.adReader.sizeX), k=-1,
-                                            axes=(0, 1))
-                    self.greyData=self.imgData
-                else:
-                    self.imgData = np.rot90(data.reshape(self.adReader.sizeY, self.adReader.sizeX,3), k=-1, axes=(0, 1))
-                    self.greyData = np.dot(self.imgData[..., :3], [0.299, 0.587, 0.114])
-            except:
-                data=imread('2dimage_2.tif')
-                self.imgData = np.rot90(data.reshape(self.adReader.sizeY, self.adReader.sizeX), k=-1, axes=(0, 1))
-                self.greyData = self.imgData
-        else:
-            data=imread(image)
-            self.imgData = np.rot90(data.reshape(self.adReader.sizeY, self.adReader.sizeX), k=-1, axes=(0, 1))
+        self.crosshairItem.setLength(np.hypot(self.imageSizeX, self.imageSizeY)*self.pixelSize)
+        if self.crosshairItem.scene() is None:
+            self.vb.addItem(self.crosshairItem)
+        self.vb.setRange(QtCore.QRectF(0, 0, self.imageSizeX, self.imageSizeY))
         self.imgPlot.setImage(self.imgData,autoLevels=True)
         self.verCut=self.verCutLayout.getItem(0,0)
         if self.verCut is None:
@@ -652,16 +982,16 @@ class DynamicAD_Viewer(QtGui.QWidget):
             self.horCut.hideAxis('bottom')
             self.horCut.setLabel('left', text='Horizontal Cut', units='Cnts')
             self.horCut.setXLink(self.vb)
-        left=int(self.adReader.sizeX/2)
-        top=int(self.adReader.sizeY/2)
+        left=int(self.imageSizeX/2)
+        top=int(self.imageSizeY/2)
         self.verLine=pg.LinearRegionItem(values=((left - self.ROIWinX/2) * self.pixelSize,
                                                  (left + self.ROIWinX/2) * self.pixelSize),
                                                  orientation=pg.LinearRegionItem.Vertical,bounds=(0,
-                                                                                                  self.adReader.sizeX*self.pixelSize))
+                                                                                                  self.imageSizeX*self.pixelSize))
         self.horLine=pg.LinearRegionItem(values=((top - self.ROIWinX/2) * self.pixelSize,
                                                  (top + self.ROIWinY/2) * self.pixelSize),
                                                  orientation=pg.LinearRegionItem.Horizontal,bounds=(0,
-                                                                                                self.adReader.sizeY*self.pixelSize))
+                                                                                                self.imageSizeY*self.pixelSize))
         try:
             self.imagePlot.removeItem(self.verLine)
             self.imagePlot.removeItem(self.horLine)
@@ -707,7 +1037,7 @@ class DynamicAD_Viewer(QtGui.QWidget):
     def onClick(self,evt):
         pos=self.vb.mapSceneToView(evt.scenePos())
         x,y=int(pos.x()/self.pixelSize),int(pos.y()/self.pixelSize)
-        if 0<=x<self.adReader.sizeX and 0<=y<self.adReader.sizeY:
+        if 0<=x<self.imageSizeX and 0<=y<self.imageSizeY:
             if evt.double():
                 self.verLine.setRegion(((x - self.ROIWinX / 2) * self.pixelSize, (x + self.ROIWinX / 2) * self.pixelSize))
                 self.horLine.setRegion(((y - self.ROIWinY / 2) * self.pixelSize, (y + self.ROIWinY / 2) * self.pixelSize))
@@ -736,120 +1066,263 @@ class DynamicAD_Viewer(QtGui.QWidget):
         self.updateHorCut()
 
     def updateVerCut(self):
-        self.verCutData=np.sum(self.greyData[self.left:self.right,:],axis=0)
+        self.calcVerCut()
+        self.drawVerCut()
+
+    def calcVerCut(self):
+        self.verCutData=self.orientation.verCut(self.projections,self.left,self.right,self.channelWeights)
+        self.cutPeakY, self.cutWidthY, self.cutSigmaY, self.cutFitY = self.peakFitter.peakPosWidth(self.verCutData,
+                                                                                                 self.yValues, 'y')
+
+    def calcCuts(self):
+        """
+        Calculates both the cuts with their peak positions and widths in a single pass over the ROI bands. The
+        results already calculated in the analysis pool for the frame are used if available.
+        """
+        if self.frameCuts is not None:
+            cuts, self.frameCuts = self.frameCuts, None
+        else:
+            cuts=self.analyzeCuts(self.greyData)
+        self.verCutData, self.horCutData, peakX, peakY, self.roiValues = cuts
+        self.cutPeakX, self.cutWidthX, self.cutSigmaX, self.cutFitX = peakX
+        self.cutPeakY, self.cutWidthY, self.cutSigmaY, self.cutFitY = peakY
+
+    def analyzeCuts(self, greyData, counter=None):
+        """
+        Returns the cuts of greyData along the current ROI bands with their peaks and the statistics of the ROIs,
+        see beam_analysis.analyzeFrame. Also runs in the threads of the analysis pool.
+
+        :param counter: counter of the frame, None for the frame on display
+        """
+        return analyzeFrame(greyData, self.orientation, self.left, self.right, self.up, self.down, self.xValues,
+                            self.yValues, self.peakFitter, self.roiStats, weights=self.channelWeights, stats=self.stats,
+                            counter=counter)
+
+    def drawVerCut(self):
         try:
             self.verCutPlot.setData(self.verCutData,self.yValues)
         except:
             self.verCutPlot=self.verCut.plot(self.verCutData,self.yValues, pen=pg.mkPen('y'))
-        minm=np.min(self.verCutData)
-        maxm=np.max(self.verCutData)
-        pos=np.where(self.verCutData>(maxm+minm)/2)
-        verCut = self.verCutData[pos]
-        self.cutPeakY = np.sum(verCut * self.yValues[pos]) / np.sum(verCut)
-        cutY = np.argwhere(verCut >= np.max(verCut) / 2.0)
-        self.cutWidthY = np.abs(self.yValues[cutY[0]] - self.yValues[cutY[-1]])
-        self.verCut.setTitle("Peak=%.4f, Wid=%.4f" % (1e3 * self.cutPeakY, 1e3 * self.cutWidthY))
+        self.verCut.setTitle(self.cutTitle(self.cutPeakY, self.cutWidthY, self.cutSigmaY, self.cutFitY))
         #self.verCut.setXRange(0,np.max(verCut))
 
     def updateHorCut(self):
-        self.horCutData=np.sum(self.greyData[:,self.up:self.down],axis=1)
+        self.calcHorCut()
+        self.drawHorCut()
+
+    def calcHorCut(self):
+        self.horCutData=self.orientation.horCut(self.projections,self.up,self.down,self.channelWeights)
+        self.cutPeakX, self.cutWidthX, self.cutSigmaX, self.cutFitX = self.peakFitter.peakPosWidth(self.horCutData,
+                                                                                                 self.xValues, 'x')
+
+    def drawHorCut(self):
         try:
             self.horCutPlot.setData(self.xValues,self.horCutData)
         except:
             self.horCutPlot=self.horCut.plot(self.xValues,self.horCutData, pen=pg.mkPen('b'))
-        minm=np.min(self.horCutData)
-        maxm=np.max(self.horCutData)
-        pos=np.where(self.horCutData>(maxm+minm)/2)
-        horCut = self.horCutData[pos]
-        self.cutPeakX = np.sum(horCut * self.xValues[pos]) / np.sum(horCut)
-        cutX = np.argwhere(horCut >= np.max(horCut) / 2.0)
-        self.cutWidthX = np.abs(self.xValues[cutX[0]] - self.xValues[cutX[-1]])
-        self.horCut.setTitle("Peak=%.4f, Wid=%.4f" % (1e3 * self.cutPeakX, 1e3 * self.cutWidthX))
+        self.horCut.setTitle(self.cutTitle(self.cutPeakX, self.cutWidthX, self.cutSigmaX, self.cutFitX))
+
+    def cutTitle(self, peak, width, sigma, quality):
+        if np.isnan(quality):
+            return "Peak=%.4f, Wid=%.4f" % (1e3 * peak, 1e3 * width)
+        return "Peak=%.4f, Wid=%.4f, Sig=%.4f, R2=%.3f" % (1e3 * peak, 1e3 * width, 1e3 * sigma, quality)
+
+    def openMonitorPVs(self):
+        if self.startUpdate:
+            QtGui.QMessageBox.warning(self,"Warning","Please Stop the updating of the image first",QtGui.QMessageBox.Ok)
+            return
+        fname=QtGui.QFileDialog.getOpenFileName(self,'Open Monitor PV File',self.dataDir,'Monitor PV Files (*.txt)')[0]
+        if fname!='':
+            self.loadMonitorPVs(fname)
+
+    def loadMonitorPVs(self, fname):
+        """
+        Loads the PVs saved in the time series from a file with one 'name<TAB>PV' pair per line. The default PVs
+        are used if the file does not exist.
+        """
+        try:
+            pvs=readPVFile(fname)
+        except (IOError, OSError):
+            pvs=None
+            fname=''
+        try:
+            self.pvCache.setPVs(pvs)
+        except AttributeError:
+            self.pvCache=PVCache(pvs)
+        self.settings.setValue('MonitorPVFile/'+self.detPV, fname)
+        self.monitorPVsPushButton.setToolTip('\n'.join(self.pvCache.names))
 
     def getSaveTimeSeriesFile(self):
+        fileFormat=str(self.saveFormatComboBox.currentText())
         self.saveFile = QtGui.QFileDialog.getSaveFileName(self, "Please provide the file for saving the time-"
-                                                                "series for the horizontal peak profiles ")[0]
+                                                                "series for the horizontal peak profiles ",
+                                                          filter='%s files (*%s)'%(fileFormat, fileFormats[fileFormat]))[0]
         if self.saveFile!='':
-            self.fh = open(self.saveFile, 'w')
+            if os.path.splitext(self.saveFile)[1]=='':
+                self.saveFile+=fileFormats[fileFormat]
             self.saveStartTime = time.time()
-            self.fh.write('#File saved on %s'%time.asctime())
-            self.fh.write('#Exposure_time=%.4f\n'%self.expTime)
-            self.fh.write('#col_names=[\'time\',\'m1\',\'m2\',\'m3\',\'m4\',\'m5\',\'m6\',\'monB\',\'horPeakPos(mm)\','
-                          '\'horPeakWid(mm)\','
-                          '\'verPeakPos('
-                          'mm)\','
-                          '\'verPeakWid(mm)\']\n')
-            #self.fh.write('#File created on ' + self.time.asctime() + '\n')
-            self.fh.write('#time m1 m2 m3 m4 m5 m6 monB horPeakPos(mm) horPeakWid(mm) verPeakPos(mm) verPeakWid(mm) '
-                          '\n')
+            self.saveAges=self.savePVAgeCheckBox.isChecked()
+            self.saveROINames=self.roiStats.names
+            colNames, header, rowFormat = timeSeriesLayout(self.pvCache.names, self.expTime, self.saveAges,
+                                                           fitModel=self.peakFitter.model,
+                                                           roiNames=self.saveROINames)
+            self.tsWriter=TimeSeriesWriter(self.saveFile, colNames, fileFormat=fileFormat, header=header,
+                                           rowFormat=rowFormat)
         else:
             self.saveFile=None
             self.autoSaveCheckBox.setCheckState(0)
 
+    def saveFormatChanged(self, fileFormat):
+        self.settings.setValue('SaveFormat', fileFormat)
+
+    def recordFormatChanged(self, fileFormat):
+        self.settings.setValue('RecordFormat', fileFormat)
+
+    def recordChanged(self):
+        if self.recordCheckBox.isChecked():
+            if self.recorder is None:
+                self.startRecording()
+        else:
+            self.stopRecording()
+
+    def setRecordOptions(self, recording):
+        self.recordCheckBox.blockSignals(True)
+        self.recordCheckBox.setChecked(recording)
+        self.recordCheckBox.blockSignals(False)
+        self.recordFormatComboBox.setEnabled(not recording)
+        self.recordFramesSpinBox.setEnabled(not recording)
+
+    def startRecording(self):
+        """
+        Records every frame stored by the reader to a file until the recording is stopped or full
+        """
+        fileFormat=str(self.recordFormatComboBox.currentText())
+        fname=QtGui.QFileDialog.getSaveFileName(self, 'Please provide the file for recording the frames',
+                                                filter='%s files (*%s)'%(fileFormat, recordFormats[fileFormat]))[0]
+        if fname=='':
+            self.setRecordOptions(False)
+            return
+        if os.path.splitext(fname)[1]=='':
+            fname+=recordFormats[fileFormat]
+        header='Detector: %s\nColor mode: %s\nOrientation: %s\nPixel size (m): %g\nDark/flat corrected: %s\n'%(
+            self.detPV, self.colorMode, self.orientation.name, self.pixelSize, self.adReader.correction.enabled)
+        try:
+            self.recorder=FrameRecorder(fname, fileFormat=fileFormat, maxFrames=self.recordFramesSpinBox.value(),
+                                        header=header, stats=self.stats)
+        except (IOError, OSError, ValueError) as error:
+            QtGui.QMessageBox.warning(self,'File Error','Cannot record the frames to %s:\n%s'%(fname, error),
+                                      QtGui.QMessageBox.Ok)
+            self.setRecordOptions(False)
+            return
+        self.setRecordOptions(True)
+        self.adReader.recorder=self.recorder
+
+    def stopRecording(self):
+        """
+        Writes the queued frames and closes the file of the recording
+        """
+        recorder=self.recorder
+        if recorder is None:
+            return
+        self.adReader.recorder=None
+        self.recorder=None
+        recorder.close()
+        self.setRecordOptions(False)
+        self.updateFrameStats()
+        if recorder.droppedFrames>0 or recorder.rejectedFrames>0 or recorder.error is not None:
+            QtGui.QMessageBox.warning(self,'Recording Incomplete','Frames recorded in %s:\n%d written, %d dropped, '
+                                      '%d rejected\nError: %s'%(recorder.fname, recorder.writtenFrames,
+                                      recorder.droppedFrames, recorder.rejectedFrames, recorder.error),
+                                      QtGui.QMessageBox.Ok)
+
+    def closeTimeSeriesFile(self):
+        """
+        Writes the remaining rows of the autosaved time series and closes the file
+        """
+        self.saveFile=None
+        if self.tsWriter is not None:
+            self.tsWriter.close()
+            if self.tsWriter.droppedRows>0 or self.tsWriter.error is not None:
+                QtGui.QMessageBox.warning(self,'Time Series Incomplete','Time series saved in %s:\n%d rows written, '
+                                          '%d rows dropped\nError: %s'%(self.tsWriter.fname, self.tsWriter.writtenRows,
+                                          self.tsWriter.droppedRows, self.tsWriter.error), QtGui.QMessageBox.Ok)
+            self.tsWriter=None
+
     def getMonoValues(self):
-        self.m1=epics.caget(BYTES2STR("15IDA:m1.REP"))
-        self.m2=epics.caget(BYTES2STR("15IDA:m2.REP"))
-        self.m3=epics.caget(BYTES2STR("15IDA:m3.REP"))
-        self.m4=epics.caget(BYTES2STR("15IDA:m4.REP"))
-        self.m5=epics.caget(BYTES2STR("15IDA:m5.REP"))
-        self.m6=epics.caget(BYTES2STR("15IDA:m6.REP"))
-        self.monB=epics.caget(BYTES2STR("15IDB:scaler1.S2"))
+        """
+        Returns the latest cached values of the monitor PVs followed by their ages if they are saved
+        """
+        values, ages = self.pvCache.getValues()
+        if self.saveAges:
+            return values+ages
+        return values
 
     def updatePlots(self):
+        self.analyzeFrame()
+        self.drawVerCut()
+        self.drawHorCut()
+        self.drawROIStats()
+        if self.plotPosCheckBox.isChecked():
+            self.posTimeSeriesReady.emit()
+        if self.plotWidCheckBox.isChecked():
+            self.widTimeSeriesReady.emit()
+
+    def analyzeFrame(self):
+        """
+        Calculates the cuts, peak positions and widths of the current frame and stores them in the time series
+        and in the autosave file. Nothing is redrawn here.
+        """
 #        self.updateSums()
-        self.updateVerCut()
-        self.updateHorCut()
+        start=time.perf_counter()
+        self.calcCuts()
+        self.stats.add('cuts', time.perf_counter()-start)
         if self.autoSaveCheckBox.isChecked():
             if self.saveFile is not None:
+                start=time.perf_counter()
                 t=time.time()
-                self.getMonoValues()
-                self.fh.write('%.6f %.d %d %d %d %d %d %d %.6f %.6f %.6f %.6f\n'%(t-self.saveStartTime,
-                                                                                             self.m1,self.m2,self.m3,
-                                                                                             self.m4,self.m5,self.m6,
-                                                                                             self.monB,
-                                                                                             1e3*self.cutPeakX,
-                                                                                             1e3*self.cutWidthX,
-                                                                                             1e3*self.cutPeakY,
-                                                                                             1e3*self.cutWidthY))
+                peakX=(self.cutPeakX, self.cutWidthX, self.cutSigmaX, self.cutFitX)
+                peakY=(self.cutPeakY, self.cutWidthY, self.cutSigmaY, self.cutFitY)
+                # The ROI columns are nan for frames analyzed before the ROIs of the file were set
+                self.tsWriter.write([t-self.saveStartTime]+self.getMonoValues()+
+                                    analysisColumns(peakX, peakY, self.roiValues, self.peakFitter.model,
+                                                    self.pixelSize, len(self.saveROINames)))
+                self.stats.add('autosave', time.perf_counter()-start)
             else:
-                self.imageUpdated.disconnect(self.updatePlots)
+                self.imageUpdated.disconnect(self.analyzeFrame)
                 self.getSaveTimeSeriesFile()
-                self.imageUpdated.connect(self.updatePlots)
-        else:
-            try:
-                self.saveFile=None
-                self.fh.close()
-            except:
-                pass
+                self.imageUpdated.connect(self.analyzeFrame)
+        elif self.saveFile is not None:
+            self.closeTimeSeriesFile()
 
-        if self.plotPosCheckBox.isChecked():
-            t = time.time() - self.startTime
-            self.posTimeData.append([t, self.cutPeakX, self.cutPeakY])
-            if len(self.posTimeData)>100:
-                self.posTimeData.pop(0)
-            self.posTimeSeriesReady.emit()
-        if self.plotWidCheckBox.isChecked():
-            t = time.time() - self.startTime
-            self.widTimeData.append([t, self.cutWidthX, self.cutWidthY])
-            if len(self.widTimeData)>100:
-                self.widTimeData.pop(0)
-            self.widTimeSeriesReady.emit()
-        QtGui.QApplication.processEvents()
+        t = time.time() - self.startTime
+        self.timeSeries.append((t, self.cutPeakX, self.cutPeakY, self.cutWidthX, self.cutWidthY))
+
+    def onSeriesLengthChanged(self):
+        """
+        Reallocates the position and width time series with the new length. The recorded points are discarded.
+        """
+        length=self.seriesLengthSpinBox.value()
+        if length!=self.timeSeries.length:
+            self.timeSeries=TimeSeriesBuffer(length, self.timeSeries.colNames)
+            self.settings.setValue('SeriesLength', length)
 
     def updatePosSeriesPlot(self):
-        posData=np.array(self.posTimeData)
-        x = posData[:,0] - posData[0, 0]
+        data=self.timeSeries.getData()
+        columns=self.timeSeries.columns
+        x = data[0] - data[0, 0]
+        posX = data[columns['horPeakPos']]
+        posY = data[columns['verPeakPos']]
         if self.cutSeriesExists:
-            self.peakCutXPlot.setData(x, posData[:, 1])
-            self.peakCutYPlot.setData(x, posData[:, 2])
+            self.peakCutXPlot.setData(x, posX)
+            self.peakCutYPlot.setData(x, posY)
         else:
             self.peakCutPlot=pg.plot(title = 'Peak-Poistion Plot')
             self.peakCutPlot.closeEvent=self.peakCutPlotCloseEvent
             self.peakCutPlot.setLabel('left','X, Y Positions', units='m')
             self.peakCutPlot.setLabel('bottom','time',units='seconds')
-            self.peakCutXPlot=pg.PlotCurveItem(x, posData[:, 1],name='cut X',
+            self.peakCutXPlot=pg.PlotCurveItem(x, posX,name='cut X',
                                                       pen=pg.mkPen('b'), title='X-Cut Plot')
-            self.peakCutYPlot=pg.PlotCurveItem(x, posData[:, 2], name='cut Y',
+            self.peakCutYPlot=pg.PlotCurveItem(x, posY, name='cut Y',
                                                       pen=pg.mkPen('y'), title='Y-Cut Plot')
             self.peakCutPlot.addItem(self.peakCutXPlot)
             self.peakCutPlot.addItem(self.peakCutYPlot)
@@ -860,19 +1333,22 @@ class DynamicAD_Viewer(QtGui.QWidget):
 
 
     def updateWidSeriesPlot(self):
-        widData = np.array(self.widTimeData)
-        x = widData[:, 0] - widData[0, 0]
+        data = self.timeSeries.getData()
+        columns = self.timeSeries.columns
+        x = data[0] - data[0, 0]
+        widX = data[columns['horPeakWid']]
+        widY = data[columns['verPeakWid']]
         if self.widSeriesExists:
-            self.widthCutXPlot.setData(x, widData[:, 1])
-            self.widthCutYPlot.setData(x, widData[:, 2])
+            self.widthCutXPlot.setData(x, widX)
+            self.widthCutYPlot.setData(x, widY)
             # self.widthCutYPlot.setData(x, widData[:, 4])
         else:
             self.widthCutPlot = pg.plot(title='Peak-Width Plot')
             self.widthCutPlot.closeEvent=self.widthCutPlotCloseEvent
             self.widthCutPlot.setLabel('left','X, Y Widths',units='m')
             self.widthCutPlot.setLabel('bottom','time',units='seconds')
-            self.widthCutXPlot=pg.PlotCurveItem(x, widData[:, 1], name='wid X', pen=pg.mkPen('b'),)
-            self.widthCutYPlot=pg.PlotCurveItem(x, widData[:, 2], name='wid Y', pen=pg.mkPen('y'))
+            self.widthCutXPlot=pg.PlotCurveItem(x, widX, name='wid X', pen=pg.mkPen('b'),)
+            self.widthCutYPlot=pg.PlotCurveItem(x, widY, name='wid Y', pen=pg.mkPen('y'))
             self.widthCutPlot.addItem(self.widthCutXPlot)
             self.widthCutPlot.addItem(self.widthCutYPlot)
             self.widSeriesExists=True
@@ -907,9 +1383,112 @@ class DynamicAD_Viewer(QtGui.QWidget):
 
 
 ## Start Qt event loop unless running in interactive mode.
+class MultiAD_Viewer(QtGui.QWidget):
+    def __init__(self, detPVs, parent=None):
+        """
+        Several detectors viewed in tabs of a single process. The detectors share the CA context and the analysis
+        pool and each keeps its own ROI, settings and time series. The Comparison tab plots the beam positions of
+        all the detectors on a common time base.
+
+        :param detPVs: list of Detector PVs, one is asked for in a dialog if empty
+        :param parent:
+        """
+        QtGui.QWidget.__init__(self, parent=parent)
+        self.startTime=time.time()
+        self.viewers=[]
+        self.curves={}
+        self.colors=cycle(['r', 'g', 'b', 'c', 'm', 'y', 'w'])
+        layout=QtGui.QVBoxLayout(self)
+        self.tabWidget=QtGui.QTabWidget(self)
+        self.tabWidget.setTabsClosable(True)
+        self.tabWidget.tabCloseRequested.connect(self.removeDetector)
+        self.addDetectorPushButton=QtGui.QPushButton('Add Detector')
+        self.addDetectorPushButton.clicked.connect(lambda: self.addDetector())
+        self.tabWidget.setCornerWidget(self.addDetectorPushButton)
+        layout.addWidget(self.tabWidget)
+        self.comparisonWidget=pg.GraphicsLayoutWidget()
+        self.horPosPlot=self.comparisonWidget.addPlot(title='Horizontal Peak Position')
+        self.horPosPlot.setLabel('left', 'X', units='m')
+        self.horPosPlot.addLegend()
+        self.comparisonWidget.nextRow()
+        self.verPosPlot=self.comparisonWidget.addPlot(title='Vertical Peak Position')
+        self.verPosPlot.setLabel('left', 'Y', units='m')
+        self.verPosPlot.setLabel('bottom', 'time', units='seconds')
+        self.verPosPlot.setXLink(self.horPosPlot)
+        self.tabWidget.addTab(self.comparisonWidget, 'Comparison')
+        self.tabWidget.tabBar().setTabButton(0, QtGui.QTabBar.RightSide, None)
+        self.comparisonTimer=QtCore.QTimer(self)
+        self.comparisonTimer.timeout.connect(self.updateComparison)
+        self.comparisonTimer.start(500)
+        if len(detPVs)==0:
+            self.addDetector()
+        for detPV in detPVs:
+            self.addDetector(detPV)
+        self.tabWidget.setCurrentIndex(0)
+
+    def addDetector(self, detPV=None):
+        if detPV is None:
+            detPV, okPressed = QtGui.QInputDialog.getText(self, "Get Detector PV", "Detector PV",
+                                                          QtGui.QLineEdit.Normal, "15IDPS1:")
+            if not okPressed:
+                return
+        viewer=DynamicAD_Viewer(parent=self.tabWidget, detPV=detPV)
+        self.viewers.append(viewer)
+        self.tabWidget.insertTab(self.tabWidget.count()-1, viewer, detPV)
+        self.tabWidget.setCurrentWidget(viewer)
+        color=next(self.colors)
+        self.curves[viewer]=(self.horPosPlot.plot(pen=pg.mkPen(color), name=detPV),
+                             self.verPosPlot.plot(pen=pg.mkPen(color), name=detPV))
+
+    def removeDetector(self, index):
+        viewer=self.tabWidget.widget(index)
+        if viewer not in self.viewers:
+            return
+        viewer.shutdown()
+        self.tabWidget.removeTab(index)
+        self.viewers.remove(viewer)
+        horCurve, verCurve = self.curves.pop(viewer)
+        self.horPosPlot.removeItem(horCurve)
+        self.verPosPlot.removeItem(verCurve)
+        viewer.deleteLater()
+
+    def updateComparison(self):
+        """
+        Redraws the peak positions of all the detectors against the time since the start of the application
+        """
+        if self.tabWidget.currentWidget() is not self.comparisonWidget:
+            return
+        for viewer in self.viewers:
+            if len(viewer.timeSeries)==0:
+                continue
+            data=viewer.timeSeries.getData()
+            columns=viewer.timeSeries.columns
+            t=data[0]+viewer.startTime-self.startTime
+            horCurve, verCurve = self.curves[viewer]
+            horCurve.setData(t, data[columns['horPeakPos']])
+            verCurve.setData(t, data[columns['verPeakPos']])
+
+    def closeEvent(self, evt):
+        for viewer in self.viewers:
+            viewer.shutdown()
+        sys.exit()
+
+
 if __name__ == '__main__':
+    if '--headless' in sys.argv:
+        from beam_monitor import main
+        sys.exit(main(sys.argv[1:]))
+    if '--batch' in sys.argv:
+        from batch_analysis import main
+        sys.exit(main(sys.argv[1:]))
+    # Every --pv opens a detector, several detectors or --multi open them in tabs of a single window
+    detPVs=[sys.argv[i+1] for i in range(len(sys.argv)-1) if sys.argv[i]=='--pv']
     app = QtGui.QApplication(sys.argv)
-    w = DynamicAD_Viewer()
+    if len(detPVs)>1 or '--multi' in sys.argv:
+        w = MultiAD_Viewer(detPVs)
+        w.show()
+    else:
+        w = DynamicAD_Viewer(detPV=detPVs[0] if len(detPVs)==1 else None)
     w.setWindowTitle('Dynamic Area Detector Viewer')
     w.resize(1200,800)
     #w.show()
@@ -0,0 +1,366 @@
+from pyqtgraph.Qt import QtCore
+import numpy as np
+import time
+import threading
+from collections import deque
+from frame_sources import frameSource
+from beam_analysis import analysisPool, warmUp
+from frame_correction import FrameCorrection, correctFrame
+from frame_average import FrameAverager
+
+
+def releaseFrame(frame):
+    """
+    Hands the slot of a frame of AD_Reader.frameQueue back to the reader once the analysis of the frame is done.
+    Every frame taken from the queue has to be released when it is not used anymore.
+    """
+    frameBuffer=frame.pop('buffer', None)
+    if frameBuffer is None:
+        return
+    index=frame['index']
+    analysis=frame.get('analysis')
+    if analysis is None:
+        frameBuffer.release(index)
+    else:
+        analysis.add_done_callback(lambda future: frameBuffer.release(index))
+
+
+class FrameQueue(object):
+    def __init__(self, maxlen=1):
+        """
+        Bounded thread-safe queue of frames where the latest frame always wins. Frames pushed out of a full queue
+        or skipped by the reader are counted as dropped and released.
+
+        :param maxlen: Maximum number of frames kept in the queue
+        """
+        self.lock=threading.Lock()
+        self.frames=deque(maxlen=maxlen)
+        self.dropped=0
+
+    def put(self, frame):
+        with self.lock:
+            if len(self.frames)==self.frames.maxlen:
+                self.dropped+=1
+                releaseFrame(self.frames.popleft())
+            self.frames.append(frame)
+
+    def getLatest(self):
+        """
+        Returns the latest frame and discards the older ones. Returns None if the queue is empty
+        """
+        with self.lock:
+            if len(self.frames)==0:
+                return None
+            frame=self.frames.pop()
+            self.dropped+=len(self.frames)
+            for older in self.frames:
+                releaseFrame(older)
+            self.frames.clear()
+            return frame
+
+    def getAll(self):
+        """
+        Returns all the queued frames, oldest first, and empties the queue
+        """
+        with self.lock:
+            frames=list(self.frames)
+            self.frames.clear()
+            return frames
+
+    def full(self):
+        return len(self.frames)==self.frames.maxlen
+
+    def clear(self):
+        with self.lock:
+            for frame in self.frames:
+                releaseFrame(frame)
+            self.frames.clear()
+            self.dropped=0
+
+
+class FrameBuffer(object):
+    def __init__(self, length, shape, dtype):
+        """
+        Ring buffer of the last frames preallocated in the native dtype of the detector. New frames are copied
+        straight into the next slot and the display and the analysis work on views of the slots. The slots of the
+        frames handed over are held until they are released, the reader does not write into a held slot.
+
+        :param length: Number of frames kept in the buffer
+        :param shape: Shape of a frame, i.e. (sizeY, sizeX) or (sizeY, sizeX, 3)
+        :param dtype: Data type of the frames
+        """
+        self.length=length
+        self.shape=tuple(shape)
+        self.dtype=np.dtype(dtype)
+        self.data=np.empty((length,)+self.shape,dtype=self.dtype)
+        self.counters=np.zeros(length,dtype=np.int64)
+        self.timestamps=np.zeros(length)
+        self.holds=np.zeros(length,dtype=np.int64)
+        self.holdLock=threading.Lock()
+        self.index=-1
+        self.count=0
+
+    def matches(self, length, shape, dtype):
+        return self.length==length and self.shape==tuple(shape) and self.dtype==np.dtype(dtype)
+
+    def write(self, data, counter, timestamp, maps=None):
+        """
+        Copies the flat array data into the next slot and returns the index of the slot
+
+        :param maps: flat (dark, gain) maps of FrameCorrection, the frame is then corrected while it is copied
+        into the float32 slot
+        """
+        index=(self.index+1)%self.length
+        if maps is None:
+            self.data[index].reshape(-1)[...]=data
+        else:
+            correctFrame(data.reshape(-1), maps[0], maps[1], self.data[index].reshape(-1))
+        self.counters[index]=counter
+        self.timestamps[index]=timestamp
+        self.index=index
+        self.count=min(self.count+1,self.length)
+        return index
+
+    def hold(self, index):
+        with self.holdLock:
+            self.holds[index]+=1
+
+    def release(self, index):
+        with self.holdLock:
+            self.holds[index]-=1
+
+    def nextSlotFree(self):
+        """
+        True if the slot written next is not held
+        """
+        return self.holds[(self.index+1)%self.length]==0
+
+    def slotIndex(self, age=0):
+        """
+        Returns the slot index of the frame which is age frames older than the latest one
+        """
+        if not 0<=age<self.count:
+            raise IndexError('Only %d frames are available in the buffer'%self.count)
+        return (self.index-age)%self.length
+
+    def clear(self):
+        # The index is kept, the slot of a frame still held from before is then the last one written again
+        self.count=0
+
+
+class AD_Reader(QtCore.QThread):
+    imageSizeXChanged=QtCore.pyqtSignal(int)
+    imageSizeYChanged=QtCore.pyqtSignal(int)
+    frameReady=QtCore.pyqtSignal()
+    # Emitted once a dark requested with correction.startDarkCapture is set
+    darkCaptured=QtCore.pyqtSignal()
+    # Emitted once a replay delivered its last frame
+    sourceFinished=QtCore.pyqtSignal()
+
+    def __init__(self, detPV, parent=None, source=None):
+        """
+        Reads the frames from the areaDetector in a separate thread. Every new frame is fetched and stored in the
+        frame buffer in the thread and then handed to the GUI through frameQueue.
+
+        :detPV: Detector PV (example: 15PS1:), or a simulated or replayed source, see frame_sources.frameSource
+        :param parent:
+        :param source: FrameSource used instead of the one given by detPV
+        """
+        QtCore.QThread.__init__(self, parent=parent)
+        self.detPV=detPV
+        self.colorMode='Greyscale'
+        self.acquisitionMode='Monitor'
+        self.frameQueue=FrameQueue(maxlen=1)
+        self.newFrame=threading.Event()
+        self.acquiring=False
+        self.handling=False
+        self.lastCounter=None
+        self.receivedFrames=0
+        self.skippedFrames=0
+        self.overrunFrames=0
+        self.bufferLength=32
+        self.frameBuffer=None
+        # PipelineStats the times taken to fetch and store the frames are added to
+        self.stats=None
+        # Function of the frame data and the frame counter run in the shared analysis pool for every frame, the
+        # future of its result is handed over with the frame as 'analysis'
+        self.analyze=None
+        self.correction=FrameCorrection()
+        self.averager=FrameAverager()
+        # FrameRecorder every stored frame is queued to with its ArrayCounter and IOC timestamp. Queuing only copies
+        # the frame, the recorder writes it in its own thread.
+        self.recorder=None
+        self.source=frameSource(detPV) if source is None else source
+        self.source.sizeChanged=self.onSizeChanged
+        self.acquisitionStart=None
+        # Time in seconds from startAcquisition until the first frame was queued, None until then
+        self.firstFrameTime=None
+        # The analysis kernels are loaded while the PVs connect
+        warmUp()
+        t=time.perf_counter()
+        self.connected=self.source.connect()
+        # Time in seconds the source took to connect
+        self.connectTime=time.perf_counter()-t
+
+    @property
+    def sizeX(self):
+        return self.source.sizeX
+
+    @property
+    def sizeY(self):
+        return self.source.sizeY
+
+    def onSizeChanged(self):
+        if self.sizeX is not None and self.sizeY is not None:
+            self.imageSizeXChanged.emit(self.sizeX)
+            self.imageSizeYChanged.emit(self.sizeY)
+
+    def startAcquisition(self):
+        """
+        Starts reading the frames in the thread. For areaDetectors the frames are, depending on acquisitionMode,
+        either
+
+        'Monitor': delivered by a monitor on ArrayData limited to SizeX*SizeY*channels elements
+        'Counter': fetched by a get of ArrayData every time ArrayCounter_RBV changes
+        """
+        # Frames left in the queue by the last acquisition give their slots back. The queue holds up to
+        # bufferLength-2 frames, which keeps slots free for the next frames while the queued ones are analyzed.
+        self.frameQueue.clear()
+        self.frameQueue=FrameQueue(maxlen=max(1,self.bufferLength-2))
+        self.newFrame.clear()
+        self.lastCounter=None
+        self.receivedFrames=0
+        self.skippedFrames=0
+        self.overrunFrames=0
+        if self.frameBuffer is not None:
+            self.frameBuffer.clear()
+        self.averager.reset()
+        self.source.readerBusy=self.readerBusy
+        self.acquisitionStart=time.perf_counter()
+        self.firstFrameTime=None
+        self.source.start(self.newFrame.set, colorMode=self.colorMode, acquisitionMode=self.acquisitionMode)
+        self.acquiring=True
+        self.start()
+
+    def stopAcquisition(self):
+        self.acquiring=False
+        self.newFrame.set()
+        self.wait()
+        self.source.stop()
+
+    @property
+    def droppedFrames(self):
+        return self.skippedFrames+self.overrunFrames+self.frameQueue.dropped
+
+    def readerBusy(self):
+        """
+        True while the last fetched frame is not queued yet, the frame queue has no room for another frame, the
+        slot of the next frame is still held or the recorder has no buffer left for the next frame. Sources
+        replaying frames as fast as possible wait meanwhile, so that every frame is analyzed and recorded.
+        """
+        frameBuffer=self.frameBuffer
+        recorder=self.recorder
+        return self.handling or self.frameQueue.full() or \
+            (frameBuffer is not None and not frameBuffer.nextSlotFree()) or \
+            (recorder is not None and recorder.queueFull())
+
+    def run(self):
+        finished=False
+        while self.acquiring:
+            self.handling=False
+            if not self.newFrame.wait(0.1):
+                if self.source.finished and not finished:
+                    finished=True
+                    self.sourceFinished.emit()
+                continue
+            self.newFrame.clear()
+            if not self.acquiring:
+                break
+            t=time.perf_counter()
+            self.handling=True
+            data, counter = self.source.fetchData()
+            if data is None:
+                continue
+            fetched=time.perf_counter()
+            if self.lastCounter is not None and counter>self.lastCounter+1:
+                self.skippedFrames+=counter-self.lastCounter-1
+            self.lastCounter=counter
+            self.receivedFrames+=1
+            try:
+                index=self.storeFrame(data, counter)
+            except ValueError:
+                # The image size changed in between and the array does not match sizeX and sizeY
+                continue
+            if index is None:
+                # The frames handed over still use the slot, they are not overwritten
+                self.overrunFrames+=1
+                continue
+            stored=time.perf_counter()
+            if self.averager.active:
+                self.averager.add(self.frameBuffer, index)
+            if self.stats is not None:
+                self.stats.add('fetch', fetched-t)
+                self.stats.add('store', stored-fetched)
+                if self.averager.active:
+                    self.stats.add('average', time.perf_counter()-stored)
+            recorder=self.recorder
+            if recorder is not None:
+                recorder.add(self.frameBuffer.data[index], counter, self.source.timestamp,
+                             self.frameBuffer.timestamps[index])
+            frame=self.getFrame(index)
+            # The slot is held until the consumer of the queue releases the frame with releaseFrame
+            self.frameBuffer.hold(index)
+            frame['buffer']=self.frameBuffer
+            if self.analyze is not None:
+                frame['analysis']=analysisPool().submit(self.analyze, frame['greyData'], frame['counter'])
+            self.frameQueue.put(frame)
+            if self.firstFrameTime is None:
+                self.firstFrameTime=time.perf_counter()-self.acquisitionStart
+                if self.stats is not None:
+                    self.stats.add('firstFrame', self.firstFrameTime)
+            self.frameReady.emit()
+
+    def storeFrame(self, data, counter):
+        """
+        Writes the flat array data into the next slot of the frame buffer. While the correction is enabled the
+        frames are stored dark and flat-field corrected as float32, see FrameCorrection. The buffer is
+        (re)allocated whenever the image size, the color mode or the data type changes.
+        :return: index of the slot, None if the slot is still held by a frame handed over
+        """
+        if self.colorMode == 'Greyscale':
+            shape = (self.sizeY, self.sizeX)
+        else:
+            shape = (self.sizeY, self.sizeX, 3)
+        if data.size!=np.prod(shape):
+            raise ValueError('Array size %d does not match the image shape %s'%(data.size, shape))
+        if self.correction.capturing and self.correction.addDarkFrame(data, shape):
+            self.darkCaptured.emit()
+        maps=self.correction.activeMaps(shape)
+        dtype=data.dtype if maps is None else np.float32
+        # At least two slots, one held by the consumer and one for the next frame
+        length=max(2, self.bufferLength)
+        if self.frameBuffer is None or not self.frameBuffer.matches(length, shape, dtype):
+            self.frameBuffer=FrameBuffer(length, shape, dtype)
+        if not self.frameBuffer.nextSlotFree():
+            return None
+        return self.frameBuffer.write(data, counter, time.time(), maps)
+
+    def getFrame(self, index):
+        """
+        Returns the frame stored at slot index of the frame buffer, or the running average of the stored frames if
+        the averager is on, see FrameAverager.
+        The frame is kept C-ordered as delivered by the detector, the orientation is applied by the viewer.
+        :return: dictionary with views of the slot, imgData for displaying and greyData for analysis. RGB frames
+        are analyzed channel by channel so both are the same.
+        """
+        imgData=self.averager.getFrame(index)
+        if imgData is None:
+            imgData=self.frameBuffer.data[index]
+        return {'imgData':imgData, 'greyData':imgData, 'index':index, 'counter':self.frameBuffer.counters[index],
+                'time':self.frameBuffer.timestamps[index]}
+
+    def getHistoryFrame(self, age):
+        """
+        Returns the frame which is age frames older than the latest frame in the buffer
+        """
+        return self.getFrame(self.frameBuffer.slotIndex(age))
@@ -0,0 +1,319 @@
+"""
+Offline batch analysis of saved frames with the cuts, peak positions and widths of the DynamicAD_Viewer
+
+Usage: python DynamicAD_Viewer.py --batch FILE_OR_DIRECTORY [...] -o timeSeries.txt [options]
+       python batch_analysis.py FILE_OR_DIRECTORY [...] -o timeSeries.txt [options]
+
+The frames of the files are analyzed in a pool of processes and written to a single time series with the columns
+of the time series saved by the viewer, one row per frame in the order of the files.
+"""
+import argparse
+import glob
+import multiprocessing
+import os
+import sys
+import time
+import numpy as np
+from beam_analysis import Orientation, PeakFitter, fitModels, channelWeights, roiBands, analyzeFrame, analysisColumns
+from time_series import TimeSeriesWriter, fileFormats, timeSeriesLayout
+from roi_stats import ROIStatistics, readROIFile
+from frame_stacks import openStack, stackExtensions
+
+
+def listFiles(paths):
+    """
+    Returns the files of the frames given as files, directories or glob patterns. The stacks in a directory and the
+    matches of a pattern are sorted alphabetically, the paths are kept in the given order.
+    """
+    files=[]
+    for path in paths:
+        if os.path.isdir(path):
+            files+=sorted(os.path.join(path, name) for name in os.listdir(path)
+                          if os.path.splitext(name)[1].lower() in stackExtensions)
+        elif os.path.exists(path):
+            files.append(path)
+        else:
+            files+=sorted(glob.glob(path))
+    return files
+
+
+def frameCount(fname):
+    """
+    Returns the number of frames of a file without reading them
+    """
+    extension=os.path.splitext(fname)[1].lower()
+    if extension=='.npy':
+        array=np.load(fname, mmap_mode='r')
+        return 1 if array.ndim==2 else array.shape[0]
+    elif extension in ('.tif', '.tiff'):
+        import tifffile
+        with tifffile.TiffFile(fname) as tif:
+            return len(tif.pages)
+    elif extension in ('.h5', '.hdf5'):
+        stack=openStack(glob.escape(fname))
+        stack.close()
+        return len(stack)
+    return 1
+
+
+def frameTasks(files, chunkFrames):
+    """
+    Splits the frames of the files into tasks of about chunkFrames frames. Single-frame files are grouped and
+    stacks are split, so that the tasks cost about the same whatever the files. The files which cannot be read are
+    reported and skipped.
+
+    :return: list of tasks, every task a list of (file name, first frame, frame after the last one)
+    """
+    tasks=[]
+    task=[]
+    size=0
+    for fname in files:
+        try:
+            nFrames=frameCount(fname)
+        except (IOError, OSError, ValueError) as error:
+            print('Could not read %s: %s'%(fname, error), file=sys.stderr)
+            continue
+        start=0
+        while start<nFrames:
+            stop=min(nFrames, start+chunkFrames-size)
+            task.append((fname, start, stop))
+            size+=stop-start
+            start=stop
+            if size>=chunkFrames:
+                tasks.append(task)
+                task=[]
+                size=0
+    if len(task)>0:
+        tasks.append(task)
+    return tasks
+
+
+def frameTimes(fname, stack, start, stop):
+    """
+    Returns the times of the frames start:stop of a file: the IOC timestamps, or the times they were received, of
+    the frames recorded by frame_recorder.FrameRecorder, else the modification time of the file
+    """
+    table=None
+    extension=os.path.splitext(fname)[1].lower()
+    try:
+        if extension in ('.h5', '.hdf5'):
+            table={name: stack.fh[name][start:stop] for name in ('timestamp', 'receiveTime')}
+        elif extension=='.npy':
+            table=np.load(os.path.splitext(fname)[0]+'_frames.npy', mmap_mode='r')[start:stop]
+    except (KeyError, IOError, OSError, AttributeError):
+        table=None
+    if table is None:
+        return np.full(stop-start, os.path.getmtime(fname))
+    timestamp=np.asarray(table['timestamp'], dtype=float)
+    return np.where(np.isfinite(timestamp), timestamp, np.asarray(table['receiveTime'], dtype=float))
+
+
+class FrameAnalyzer(object):
+    def __init__(self, roiCenter=None, roiWidth=(10, 10), pixelSize=2.2e-6, orientation='Normal',
+                 channel='Luminance', fitModel='Centroid', rois=()):
+        """
+        Peak positions, widths and ROI statistics of frames read from files, computed as by
+        beam_monitor.BeamMonitor. The ROI bands follow the shape of the frames.
+
+        :param roiCenter: (x, y) center of the ROI bands in pixels of the displayed image, the center of the image
+        if None
+        :param roiWidth: (horizontal, vertical) widths of the ROI bands in pixels
+        :param pixelSize: pixel size in m
+        :param orientation: name of the orientation of the displayed image
+        :param channel: channel analyzed in RGB frames
+        :param fitModel: one of beam_analysis.fitModels
+        :param rois: list of (name, (x0, y0, x1, y1)) ROIs in pixels of the displayed image
+        """
+        self.roiCenter=roiCenter
+        self.roiWidth=roiWidth
+        self.pixelSize=pixelSize
+        self.orientation=Orientation(orientation)
+        self.channelWeights=channelWeights[channel]
+        self.peakFitter=PeakFitter(fitModel)
+        self.roiStats=ROIStatistics(rois)
+        self.shape=None
+
+    def setROI(self, shape):
+        self.shape=shape
+        imageSizeX, imageSizeY = self.orientation.displayShape(shape)
+        self.left, self.right, self.up, self.down = roiBands(imageSizeX, imageSizeY, self.roiCenter, self.roiWidth)
+        self.xValues=self.pixelSize*np.arange(imageSizeX)
+        self.yValues=self.pixelSize*np.arange(imageSizeY)
+
+    def analyzeFrame(self, greyData):
+        """
+        Returns the peak and ROI columns of the time series for a frame
+        """
+        if greyData.shape!=self.shape:
+            self.setROI(greyData.shape)
+        verCutData, horCutData, peakX, peakY, rois = analyzeFrame(greyData, self.orientation, self.left, self.right,
+                                                                  self.up, self.down, self.xValues, self.yValues,
+                                                                  self.peakFitter, self.roiStats,
+                                                                  weights=self.channelWeights)
+        return analysisColumns(peakX, peakY, rois, self.peakFitter.model, self.pixelSize, len(self.roiStats))
+
+    def analyzeTask(self, task):
+        """
+        Analyzes the frames of a task of frameTasks
+
+        :return: list of rows with the time of the frame first, list of (file name, error) of the files which
+        cannot be read
+        """
+        rows=[]
+        errors=[]
+        # The Gaussian fits are warm-started within a task only, so that the rows do not depend on the workers
+        self.peakFitter.reset()
+        for fname, start, stop in task:
+            try:
+                stack=openStack(glob.escape(fname))
+            except (IOError, OSError, ValueError) as error:
+                errors.append((fname, error))
+                continue
+            try:
+                times=frameTimes(fname, stack, start, stop)
+                for i in range(start, stop):
+                    rows.append([times[i-start]]+self.analyzeFrame(stack.readFrame(i)))
+            except (IOError, OSError, ValueError) as error:
+                errors.append((fname, error))
+            finally:
+                stack.close()
+        return rows, errors
+
+
+# Analyzer of the worker processes, created once per process by initWorker
+workerAnalyzer=None
+
+
+def initWorker(settings):
+    global workerAnalyzer
+    workerAnalyzer=FrameAnalyzer(**settings)
+
+
+def analyzeTask(task):
+    return workerAnalyzer.analyzeTask(task)
+
+
+def parseArguments(argv):
+    parser=argparse.ArgumentParser(prog='DynamicAD_Viewer.py --batch',
+                                   description='Batch analysis of saved frames in parallel processes')
+    parser.add_argument('--batch', action='store_true', help='run the batch analysis')
+    parser.add_argument('paths', nargs='+',
+                        help='image files, stacks (.tif, .h5, .npy), directories or glob patterns')
+    parser.add_argument('-o', '--output', default='-', help='file of the time series, stdout by default')
+    parser.add_argument('--format', default=None, choices=list(fileFormats.keys()),
+                        help='file format, guessed from the extension of the output file by default')
+    parser.add_argument('--roi', type=int, nargs=2, default=None, metavar=('X', 'Y'),
+                        help='center of the ROI bands in pixels, the center of the image by default')
+    parser.add_argument('--roi-width', type=int, nargs=2, default=(10, 10), metavar=('WX', 'WY'),
+                        help='widths of the horizontal and vertical ROI bands in pixels')
+    parser.add_argument('--pixel-size', type=float, default=2.2, help='pixel size in microns')
+    parser.add_argument('--fit', default='Centroid', choices=fitModels,
+                        help='centroid or Gaussian fit of the cuts for the peak positions and widths')
+    parser.add_argument('--rois', default=None,
+                        help='file of ROIs whose sum, mean, centroid and size are saved, name x0 y0 x1 y1 per line')
+    parser.add_argument('--orientation', default='Normal', choices=list(Orientation.orientations.keys()),
+                        help='orientation of the displayed image')
+    parser.add_argument('--channel', default='Luminance', choices=list(channelWeights.keys()),
+                        help='channel analyzed in RGB frames')
+    parser.add_argument('--monitor-pvs', default=None,
+                        help='monitor PV file with name<TAB>PV lines whose columns are written as nan, the one used '
+                             'by the viewer for the detector given by --pv by default')
+    parser.add_argument('--pv', default=None, help='detector PV the frames were recorded from')
+    parser.add_argument('--save-ages', action='store_true', help='adds the columns of the ages of the monitor PVs')
+    parser.add_argument('--exposure-time', type=float, default=0.0, help='exposure time written in the header')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                        help='number of processes, one per core by default')
+    parser.add_argument('--chunk', type=int, default=64, help='number of frames analyzed per task of a process')
+    args=parser.parse_args(argv)
+    if args.format is None:
+        extensions={extension: fileFormat for fileFormat, extension in fileFormats.items()}
+        args.format=extensions.get(os.path.splitext(args.output)[1], 'Text')
+    if args.output=='-' and args.format!='Text':
+        parser.error('Only the Text format can be written to stdout')
+    args.workers=max(1, args.workers)
+    args.chunk=max(1, args.chunk)
+    return args
+
+
+def monitorPVNames(fname=None, detPV=None):
+    """
+    Returns the names of the monitor PVs saved by the viewer, read from the monitor PV file or the one of the viewer
+    for detPV if None, the default PVs if there is none. The frames carry no PV values, their columns are kept so that the
+    time series has the layout of the ones of the viewer.
+    """
+    from pv_cache import readPVFile, defaultPVs
+    if fname is None:
+        from pyqtgraph.Qt import QtCore
+        settings=QtCore.QSettings('DynamicAD_Viewer','DynamicAD_Viewer')
+        fname=settings.value('MonitorPVFile', '')
+        if detPV is not None:
+            fname=settings.value('MonitorPVFile/'+detPV, fname)
+    pvs=defaultPVs
+    if fname!='':
+        try:
+            pvs=readPVFile(fname)
+        except (IOError, OSError) as error:
+            print('Could not read the monitor PV file %s: %s'%(fname, error), file=sys.stderr)
+    return [name for name, pvname in pvs]
+
+
+def main(argv):
+    args=parseArguments(argv)
+    files=listFiles(args.paths)
+    if len(files)==0:
+        print('No files found in %s'%' '.join(args.paths), file=sys.stderr)
+        return 1
+    startTime=time.time()
+    tasks=frameTasks(files, args.chunk)
+    if len(tasks)==0:
+        print('No frames found in %s'%' '.join(args.paths), file=sys.stderr)
+        return 1
+    nFrames=sum(stop-start for task in tasks for fname, start, stop in task)
+    rois=() if args.rois is None else readROIFile(args.rois)
+    settings={'roiCenter': args.roi, 'roiWidth': args.roi_width, 'pixelSize': args.pixel_size*1e-6,
+              'orientation': args.orientation, 'channel': args.channel, 'fitModel': args.fit, 'rois': rois}
+    pvNames=monitorPVNames(args.monitor_pvs, args.pv)
+    colNames, header, rowFormat = timeSeriesLayout(pvNames, args.exposure_time, args.save_ages, fitModel=args.fit,
+                                                   roiNames=[name for name, rect in rois])
+    pvValues=[np.nan]*(2*len(pvNames) if args.save_ages else len(pvNames))
+    # Unbounded queue, the rows of the workers arrive faster than they are written
+    tsWriter=TimeSeriesWriter(args.output, colNames, fileFormat=args.format, header=header, rowFormat=rowFormat,
+                              maxRows=0)
+    workers=min(args.workers, len(tasks))
+    if workers==1:
+        initWorker(settings)
+        results=map(analyzeTask, tasks)
+        pool=None
+    else:
+        # Spawned workers do not inherit the threads of the writer
+        pool=multiprocessing.get_context('spawn').Pool(workers, initializer=initWorker, initargs=(settings,))
+        results=pool.imap(analyzeTask, tasks)
+    firstTime=None
+    analyzedFrames=0
+    failed=0
+    try:
+        for rows, errors in results:
+            for fname, error in errors:
+                print('Could not analyze %s: %s'%(fname, error), file=sys.stderr)
+            failed+=len(errors)
+            for row in rows:
+                if firstTime is None:
+                    firstTime=row[0]
+                tsWriter.write([row[0]-firstTime]+pvValues+row[1:])
+            analyzedFrames+=len(rows)
+        if pool is not None:
+            pool.close()
+            pool.join()
+    finally:
+        if pool is not None:
+            pool.terminate()
+        tsWriter.close()
+    elapsed=time.time()-startTime
+    print('Files: %d, Frames: %d, Analyzed: %d, Failed files: %d, Workers: %d, Time: %.1f s, %.1f FPS'%(
+        len(files), nFrames, analyzedFrames, failed, workers, elapsed, analyzedFrames/max(elapsed, 1e-6)),
+        file=sys.stderr)
+    return 0 if failed==0 and tsWriter.error is None else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
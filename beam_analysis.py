@@ -0,0 +1,677 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from numba import jit
+
+# Weights of the red, green and blue channels used for the analysis of RGB frames
+channelWeights={'Luminance': np.array([0.299, 0.587, 0.114]),
+                'Red': np.array([1.0, 0.0, 0.0]),
+                'Green': np.array([0.0, 1.0, 0.0]),
+                'Blue': np.array([0.0, 0.0, 1.0])}
+
+_analysisPool=None
+_analysisPoolLock=threading.Lock()
+
+
+def analysisPool():
+    """
+    Returns the thread pool shared by all the detectors of the process for the analysis of the frames. The numba
+    kernels release the GIL, so the frames of different detectors are analyzed in parallel.
+    """
+    global _analysisPool
+    with _analysisPoolLock:
+        if _analysisPool is None:
+            _analysisPool=ThreadPoolExecutor(max_workers=os.cpu_count() or 1, thread_name_prefix='analysis')
+    return _analysisPool
+
+
+class ProjectionCache(object):
+    def __init__(self, data=None):
+        """
+        Projections of ROI bands of a frame along the two axes of the frame. The first projection of a band is
+        summed directly from the frame. As soon as a different band of the same frame is asked for, i.e. while the
+        ROI is being dragged or resized, a cumulative sum along that axis is built once and every further band
+        projection is the difference of two of its rows, which costs O(image edge) and does not touch the frame.
+
+        :param data: 2D (or 3D for RGB) frame
+        """
+        self.setData(data)
+
+    def setData(self, data):
+        """
+        Sets a new frame and drops the cumulative sums of the previous one
+        """
+        self.data=data
+        self.prefix=[None, None]
+        self.lastBand=[None, None]
+        if data is not None and np.issubdtype(data.dtype, np.integer):
+            self.accType=np.int64
+        else:
+            self.accType=np.float64
+
+    def bandSum(self, axis, start, stop):
+        """
+        Returns the sum of the frame over the band start:stop along axis, i.e. np.sum(data[start:stop],axis=0)
+        for axis=0 and np.sum(data[:,start:stop],axis=1) for axis=1
+
+        :param axis: 0 or 1
+        :param start: first index of the band
+        :param stop: index after the last index of the band
+        """
+        size=self.data.shape[axis]
+        start=min(max(int(start),0),size)
+        stop=min(max(int(stop),start),size)
+        prefix=self.prefix[axis]
+        if prefix is None:
+            if self.lastBand[axis] is None or self.lastBand[axis]==(start,stop):
+                self.lastBand[axis]=(start,stop)
+                band=self.data[start:stop] if axis==0 else self.data[:,start:stop]
+                return np.sum(band,axis=axis,dtype=self.accType)
+            prefix=self.buildPrefix(axis)
+        if axis==0:
+            return prefix[stop]-prefix[start]
+        else:
+            return prefix[:,stop]-prefix[:,start]
+
+    def buildPrefix(self, axis):
+        """
+        Builds the cumulative sum along axis with a leading row (or column) of zeros
+        """
+        shape=list(self.data.shape)
+        shape[axis]+=1
+        prefix=np.zeros(shape,dtype=self.accType)
+        if axis==0:
+            np.cumsum(self.data,axis=0,dtype=self.accType,out=prefix[1:])
+        else:
+            np.cumsum(self.data,axis=1,dtype=self.accType,out=prefix[:,1:])
+        self.prefix[axis]=prefix
+        return prefix
+
+
+@jit(nopython=True, cache=True, nogil=True)
+def peakPosWidth(profile, values):
+    """
+    Peak position and width of a cut in two passes over the cut without temporaries. The peak position is the
+    centroid of the points above (max+min)/2 and the width is the span of those points which are at least max/2.
+
+    :param profile: 1D cut
+    :param values: positions of the points of the cut
+    :return: peak position, width (nan if the cut is flat)
+    """
+    n=profile.shape[0]
+    if n==0:
+        return np.nan, np.nan
+    minm=profile[0]
+    maxm=profile[0]
+    for i in range(1,n):
+        if profile[i]<minm:
+            minm=profile[i]
+        elif profile[i]>maxm:
+            maxm=profile[i]
+    threshold=(maxm+minm)/2.0
+    halfMax=maxm/2.0
+    wsum=0.0
+    total=0.0
+    count=0
+    first=-1
+    last=-1
+    for i in range(n):
+        value=profile[i]
+        if value>threshold:
+            wsum+=value*values[i]
+            total+=value
+            if value>=halfMax:
+                # Same as the NumPy implementation, the width is taken over the indices of the selected points
+                if first<0:
+                    first=count
+                last=count
+            count+=1
+    if count==0:
+        return np.nan, np.nan
+    return wsum/total, abs(values[first]-values[last])
+
+
+@jit(nopython=True, cache=True, nogil=True, fastmath=True)
+def bandCuts(data, left, right, up, down):
+    """
+    Vertical and horizontal cuts of a 2D frame in a single pass over the two ROI bands. The pixels where the bands
+    cross are read twice but they are still in the cache.
+
+    :param data: 2D frame with the x-axis along axis 0 and the y-axis along axis 1
+    :param left, right: band along x summed for the vertical cut
+    :param up, down: band along y summed for the horizontal cut
+    :return: vertical cut (along y), horizontal cut (along x)
+    """
+    nx, ny = data.shape
+    left=min(max(left,0),nx)
+    right=min(max(right,left),nx)
+    up=min(max(up,0),ny)
+    down=min(max(down,up),ny)
+    verCut=np.zeros(ny)
+    horCut=np.zeros(nx)
+    if abs(data.strides[1])<=abs(data.strides[0]):
+        # Inner loop along y which is the contiguous axis
+        for i in range(nx):
+            acc=0.0
+            if left<=i<right:
+                for j in range(ny):
+                    verCut[j]+=data[i,j]
+            for j in range(up,down):
+                acc+=data[i,j]
+            horCut[i]=acc
+    else:
+        # Inner loop along x which is the contiguous axis
+        for j in range(ny):
+            acc=0.0
+            if up<=j<down:
+                for i in range(nx):
+                    horCut[i]+=data[i,j]
+            for i in range(left,right):
+                acc+=data[i,j]
+            verCut[j]=acc
+    return verCut, horCut
+
+
+@jit(nopython=True, cache=True, nogil=True, fastmath=True)
+def bandCutsRGB(data, left, right, up, down, weights):
+    """
+    Same as bandCuts for RGB frames. Every channel is projected over the ROI bands only and the weights of the
+    channels are applied to the 1D projections, so the frame is never converted to greyscale as a whole.
+
+    :param data: 3D frame with the x-axis along axis 0, the y-axis along axis 1 and the channels along axis 2
+    :param weights: weights of the channels, e.g. channelWeights['Luminance']
+    :return: vertical cut (along y), horizontal cut (along x)
+    """
+    nx, ny, nc = data.shape
+    left=min(max(left,0),nx)
+    right=min(max(right,left),nx)
+    up=min(max(up,0),ny)
+    down=min(max(down,up),ny)
+    verProj=np.zeros((ny,nc))
+    horProj=np.zeros((nx,nc))
+    for i in range(nx):
+        if left<=i<right:
+            for j in range(ny):
+                for k in range(nc):
+                    verProj[j,k]+=data[i,j,k]
+        for j in range(up,down):
+            for k in range(nc):
+                horProj[i,k]+=data[i,j,k]
+    verCut=np.zeros(ny)
+    horCut=np.zeros(nx)
+    for k in range(nc):
+        for j in range(ny):
+            verCut[j]+=weights[k]*verProj[j,k]
+        for i in range(nx):
+            horCut[i]+=weights[k]*horProj[i,k]
+    return verCut, horCut
+
+
+@jit(nopython=True, cache=True, nogil=True)
+def analyzeCuts(data, left, right, up, down, xValues, yValues):
+    """
+    Cuts, peak positions and widths of a 2D frame in one call
+
+    :return: vertical cut, horizontal cut, peak X, width X, peak Y, width Y
+    """
+    verCut, horCut = bandCuts(data, left, right, up, down)
+    peakY, widthY = peakPosWidth(verCut, yValues)
+    peakX, widthX = peakPosWidth(horCut, xValues)
+    return verCut, horCut, peakX, widthX, peakY, widthY
+
+
+# Models of the peaks of the cuts. 'Centroid' is the thresholded centroid of peakPosWidth, the others are fitted with
+# gaussianFit.
+fitModels=['Centroid', 'Gaussian', 'Gaussian+Background']
+
+# Ratio of the full width at half maximum and the standard deviation of a Gaussian
+fwhmFactor=2.0*np.sqrt(2.0*np.log(2.0))
+
+
+@jit(nopython=True, cache=True, nogil=True)
+def solveLinear(a, b):
+    """
+    Solves the small linear system a.x=b by Gaussian elimination with partial pivoting. a and b are overwritten.
+
+    :return: x, or None if a is singular
+    """
+    n=b.shape[0]
+    for k in range(n):
+        pivot=k
+        for i in range(k+1,n):
+            if abs(a[i,k])>abs(a[pivot,k]):
+                pivot=i
+        if a[pivot,k]==0.0:
+            return None
+        if pivot!=k:
+            for j in range(n):
+                a[k,j], a[pivot,j] = a[pivot,j], a[k,j]
+            b[k], b[pivot] = b[pivot], b[k]
+        for i in range(k+1,n):
+            factor=a[i,k]/a[k,k]
+            for j in range(k,n):
+                a[i,j]-=factor*a[k,j]
+            b[i]-=factor*b[k]
+    x=np.zeros(n)
+    for k in range(n-1,-1,-1):
+        acc=b[k]
+        for j in range(k+1,n):
+            acc-=a[k,j]*x[j]
+        x[k]=acc/a[k,k]
+    return x
+
+
+@jit(nopython=True, cache=True, nogil=True, fastmath=True)
+def gaussianChi2(profile, amplitude, center, sigma, offset):
+    """
+    Sum of the squared residuals of a Gaussian over the indices of the profile
+    """
+    chi2=0.0
+    for i in range(profile.shape[0]):
+        z=(i-center)/sigma
+        r=profile[i]-amplitude*np.exp(-0.5*z*z)-offset
+        chi2+=r*r
+    return chi2
+
+
+@jit(nopython=True, cache=True, nogil=True, fastmath=True)
+def gaussianFit(profile, params, background=True, maxIter=10, tol=1e-6):
+    """
+    Levenberg-Marquardt fit of amplitude*exp(-((i-center)/sigma)**2/2)+offset to a 1D profile over its indices i.
+    The fit starts from params, so that the parameters of the previous frame converge in a couple of iterations.
+    The analytical Jacobian is accumulated into the normal equations in the same pass as the residuals, so an
+    iteration costs one or two passes over the profile without any temporary array.
+
+    :param profile: 1D cut as float64
+    :param params: (amplitude, center, sigma, offset) in pixels, updated in place
+    :param background: fits the offset, otherwise it is kept at params[3]
+    :param maxIter: maximum number of iterations
+    :param tol: stops once an iteration decreases the sum of the squared residuals by less than this fraction
+    :return: coefficient of determination R^2 of the fit (nan if the fit failed), number of iterations
+    """
+    n=profile.shape[0]
+    npar=4 if background else 3
+    mean=0.0
+    for i in range(n):
+        mean+=profile[i]
+    mean/=n
+    total=0.0
+    for i in range(n):
+        total+=(profile[i]-mean)**2
+    if total==0.0 or params[2]<=0.0:
+        return np.nan, 0
+    jtj=np.zeros((npar,npar))
+    jtr=np.zeros(npar)
+    chi2=0.0
+    damping=1e-3
+    newJacobian=True
+    iterations=0
+    for iterations in range(1,maxIter+1):
+        amplitude, center, sigma, offset = params[0], params[1], params[2], params[3]
+        if newJacobian:
+            # The 10 distinct terms of the symmetric J^T.J and the 4 terms of J^T.r
+            s00=s01=s02=s03=s11=s12=s13=s22=s23=s33=0.0
+            r0=r1=r2=r3=0.0
+            chi2=0.0
+            for i in range(n):
+                z=(i-center)/sigma
+                e=np.exp(-0.5*z*z)
+                r=profile[i]-amplitude*e-offset
+                g1=amplitude*e*z/sigma
+                g2=g1*z
+                s00+=e*e
+                s01+=e*g1
+                s02+=e*g2
+                s03+=e
+                s11+=g1*g1
+                s12+=g1*g2
+                s13+=g1
+                s22+=g2*g2
+                s23+=g2
+                s33+=1.0
+                r0+=e*r
+                r1+=g1*r
+                r2+=g2*r
+                r3+=r
+                chi2+=r*r
+            jtj[0,0], jtj[0,1], jtj[0,2] = s00, s01, s02
+            jtj[1,1], jtj[1,2], jtj[2,2] = s11, s12, s22
+            jtr[0], jtr[1], jtr[2] = r0, r1, r2
+            if background:
+                jtj[0,3], jtj[1,3], jtj[2,3], jtj[3,3] = s03, s13, s23, s33
+                jtr[3]=r3
+            for k in range(npar):
+                for l in range(k):
+                    jtj[k,l]=jtj[l,k]
+        a=jtj.copy()
+        for k in range(npar):
+            a[k,k]+=damping*jtj[k,k]
+        step=solveLinear(a, jtr.copy())
+        if step is None:
+            break
+        newSigma=sigma+step[2]
+        newOffset=offset+step[3] if background else offset
+        newChi2=np.inf
+        if newSigma>0.0:
+            newChi2=gaussianChi2(profile, amplitude+step[0], center+step[1], newSigma, newOffset)
+        if newChi2<chi2:
+            params[0]=amplitude+step[0]
+            params[1]=center+step[1]
+            params[2]=newSigma
+            params[3]=newOffset
+            converged=chi2-newChi2<=tol*chi2
+            chi2=newChi2
+            damping=max(damping*0.3, 1e-9)
+            newJacobian=True
+            if converged:
+                break
+        else:
+            damping*=10.0
+            newJacobian=False
+            if damping>1e9:
+                break
+    if not (0.0<=params[1]<=n-1) or not np.isfinite(chi2):
+        return np.nan, iterations
+    return 1.0-chi2/total, iterations
+
+
+class PeakFitter(object):
+    def __init__(self, model='Gaussian', maxIter=10, tol=1e-6, minQuality=0.9):
+        """
+        Peak positions and widths of the cuts either as thresholded centroids (peakPosWidth) or from Gaussian fits.
+        Every fit is warm-started from the parameters fitted on the previous cut along the same axis, hence the
+        fitter is meant for the cuts of consecutive frames. A warm fit worse than minQuality is fitted again from the
+        centroid and the better of the two fits is kept.
+
+        The cuts are fitted from several threads of the analysis pool at once. Given the counters of the frames, a
+        fit only starts from the fit of an earlier frame and never replaces the one of a later frame, otherwise the
+        latest fit is used whatever its frame.
+
+        :param model: one of fitModels
+        :param maxIter: maximum number of iterations of a fit
+        :param tol: relative tolerance on the sum of the squared residuals, see gaussianFit
+        :param minQuality: R^2 below which a warm-started fit is fitted again from the centroid
+        """
+        if model not in fitModels:
+            raise ValueError('Unknown fit model %s'%model)
+        self.model=model
+        self.maxIter=maxIter
+        self.tol=tol
+        self.minQuality=minQuality
+        self.lock=threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """
+        Forgets the previous fits, the next fits start from the centroids
+        """
+        with self.lock:
+            self.params={}
+
+    def peakPosWidth(self, profile, values, axis, counter=None):
+        """
+        Peak position, width, standard deviation and fit quality of a cut. The width of a fitted peak is its full
+        width at half maximum. The centroid has no standard deviation nor quality (nan).
+
+        :param profile: 1D cut
+        :param values: positions of the points of the cut, equally spaced
+        :param axis: 'x' or 'y', the axis the previous fit is taken from
+        :param counter: counter of the frame of the cut, None if the cuts are fitted in order
+        :return: peak position, width, standard deviation, R^2 of the fit
+        """
+        peak, width = peakPosWidth(profile, values)
+        n=profile.shape[0]
+        if self.model=='Centroid' or n<5 or not np.isfinite(peak):
+            return peak, width, np.nan, np.nan
+        background=self.model=='Gaussian+Background'
+        profile=np.asarray(profile, dtype=np.float64)
+        step=values[1]-values[0]
+        centroid=(peak-values[0])/step
+        quality=np.nan
+        with self.lock:
+            previous=self.params.get(axis)
+        if previous is not None and previous[1]==n and (counter is None or previous[0] is None or
+                                                        previous[0]<counter):
+            params=previous[2].copy()
+            quality, iterations = gaussianFit(profile, params, background, self.maxIter, self.tol)
+            if abs(params[1]-centroid)>fwhmFactor*params[2]:
+                # The beam moved by more than its width since the previous frame
+                quality=np.nan
+        if not quality>=self.minQuality:
+            warm=(quality, params) if np.isfinite(quality) else None
+            offset=profile.min() if background else 0.0
+            params=np.array([profile.max()-offset, centroid, max(abs(width/step)/fwhmFactor, 0.5), offset])
+            quality, iterations = gaussianFit(profile, params, background, self.maxIter, self.tol)
+            if warm is not None and not quality>warm[0]:
+                quality, params = warm
+        with self.lock:
+            previous=self.params.get(axis)
+            latest=counter is None or previous is None or previous[0] is None or previous[0]<counter
+            if not np.isfinite(quality):
+                if latest:
+                    self.params.pop(axis, None)
+                return np.nan, np.nan, np.nan, np.nan
+            if latest:
+                self.params[axis]=(counter, n, params)
+        sigma=abs(params[2]*step)
+        return values[0]+params[1]*step, fwhmFactor*sigma, sigma, quality
+
+
+class Orientation(object):
+    # (transpose, flipX, flipY) of the detector frame for every orientation of the image on the screen. The frame
+    # is stored row by row from the top of the image, whereas the y-axis of the plots points upwards, hence the
+    # 'Normal' orientation flips the rows.
+    orientations={'Normal': (False, False, True),
+                  'Flip Horizontal': (False, True, True),
+                  'Flip Vertical': (False, False, False),
+                  'Rotate 180': (False, True, False),
+                  'Rotate 90': (True, True, True),
+                  'Rotate 270': (True, False, False),
+                  'Transpose': (True, False, True),
+                  'Anti-transpose': (True, True, False)}
+
+    def __init__(self, name='Normal'):
+        """
+        Orientation of the detector frames on the screen. The frames are never rotated. Instead the ROI bands are
+        mapped onto the axes of the C-ordered detector frame and only the 1D cuts are reversed if needed.
+
+        :param name: one of the keys of Orientation.orientations
+        """
+        self.name=name
+        self.transpose, self.flipX, self.flipY = self.orientations[name]
+
+    def displayShape(self, shape):
+        """
+        Returns the number of pixels along x and y of the displayed image for a frame of the given shape
+        """
+        if self.transpose:
+            return shape[0], shape[1]
+        else:
+            return shape[1], shape[0]
+
+    def transformMatrix(self, shape, pixelSize):
+        """
+        Affine transform (m11, m12, m21, m22, dx, dy) in the convention of QTransform which places the pixel in
+        column x and row y of the detector frame, displayed as a row-major image, on its position in the plot
+        """
+        sizeX, sizeY = self.displayShape(shape)
+        sx = -pixelSize if self.flipX else pixelSize
+        sy = -pixelSize if self.flipY else pixelSize
+        dx = pixelSize*sizeX if self.flipX else 0.0
+        dy = pixelSize*sizeY if self.flipY else 0.0
+        if self.transpose:
+            return 0.0, sy, sx, 0.0, dx, dy
+        return sx, 0.0, 0.0, sy, dx, dy
+
+    def rawBand(self, start, stop, size, flip):
+        start=min(max(int(start),0),size)
+        stop=min(max(int(stop),start),size)
+        if flip:
+            return size-stop, size-start
+        return start, stop
+
+    def rawBands(self, shape, left, right, up, down):
+        """
+        Maps the ROI bands along x (left:right) and y (up:down) of the displayed image to bands along the rows and
+        the columns of the detector frame
+        :return: (row start, row stop), (column start, column stop)
+        """
+        sizeX, sizeY = self.displayShape(shape)
+        xBand=self.rawBand(left, right, sizeX, self.flipX)
+        yBand=self.rawBand(up, down, sizeY, self.flipY)
+        if self.transpose:
+            return xBand, yBand
+        return yBand, xBand
+
+    def orientCuts(self, colCut, rowCut):
+        """
+        Converts the cut along the columns and the cut along the rows of the detector frame to the vertical and
+        the horizontal cuts of the displayed image
+        """
+        if self.transpose:
+            verCut, horCut = colCut, rowCut
+        else:
+            verCut, horCut = rowCut, colCut
+        if self.flipY:
+            verCut=verCut[::-1]
+        if self.flipX:
+            horCut=horCut[::-1]
+        return verCut, horCut
+
+    def cuts(self, data, left, right, up, down, weights=None):
+        """
+        Vertical and horizontal cuts of the displayed image computed from the detector frame with bandCuts or
+        bandCutsRGB
+
+        :param weights: weights of the channels of RGB frames, luminance by default
+        """
+        rowBand, colBand = self.rawBands(data.shape, left, right, up, down)
+        if data.ndim==3:
+            if weights is None:
+                weights=channelWeights['Luminance']
+            colCut, rowCut = bandCutsRGB(data, rowBand[0], rowBand[1], colBand[0], colBand[1], weights)
+        else:
+            colCut, rowCut = bandCuts(data, rowBand[0], rowBand[1], colBand[0], colBand[1])
+        return self.orientCuts(colCut, rowCut)
+
+    def analyzeCuts(self, data, left, right, up, down, xValues, yValues, weights=None):
+        """
+        Same as analyzeCuts but for the detector frame shown in this orientation
+        :return: vertical cut, horizontal cut, peak X, width X, peak Y, width Y
+        """
+        verCut, horCut = self.cuts(data, left, right, up, down, weights=weights)
+        peakY, widthY = peakPosWidth(verCut, yValues)
+        peakX, widthX = peakPosWidth(horCut, xValues)
+        return verCut, horCut, peakX, widthX, peakY, widthY
+
+    def verCut(self, projections, left, right, weights=None):
+        """
+        Vertical cut of the displayed image, i.e. the sum over the band left:right along x, from a ProjectionCache
+        of the detector frame. The channel projections of RGB frames are combined with weights.
+        """
+        rowBand, colBand = self.rawBands(projections.data.shape, left, right, 0, 0)
+        if self.transpose:
+            cut=projections.bandSum(0, rowBand[0], rowBand[1])
+        else:
+            cut=projections.bandSum(1, colBand[0], colBand[1])
+        if cut.ndim==2:
+            cut=np.dot(cut, channelWeights['Luminance'] if weights is None else weights)
+        return cut[::-1] if self.flipY else cut
+
+    def horCut(self, projections, up, down, weights=None):
+        """
+        Horizontal cut of the displayed image, i.e. the sum over the band up:down along y, from a ProjectionCache
+        of the detector frame. The channel projections of RGB frames are combined with weights.
+        """
+        rowBand, colBand = self.rawBands(projections.data.shape, 0, 0, up, down)
+        if self.transpose:
+            cut=projections.bandSum(1, colBand[0], colBand[1])
+        else:
+            cut=projections.bandSum(0, rowBand[0], rowBand[1])
+        if cut.ndim==2:
+            cut=np.dot(cut, channelWeights['Luminance'] if weights is None else weights)
+        return cut[::-1] if self.flipX else cut
+
+
+def roiBands(imageSizeX, imageSizeY, roiCenter=None, roiWidth=(10, 10)):
+    """
+    ROI bands of the cuts of the headless and the batch analysis, kept within the displayed image
+
+    :param imageSizeX, imageSizeY: size of the displayed image, see Orientation.displayShape
+    :param roiCenter: (x, y) center of the bands in pixels of the displayed image, the center of the image if None
+    :param roiWidth: (horizontal, vertical) widths of the bands in pixels
+    :return: left, right, up, down
+    """
+    if roiCenter is None:
+        x, y = imageSizeX//2, imageSizeY//2
+    else:
+        x, y = roiCenter
+    left=int(np.clip(x-roiWidth[0]//2, 0, imageSizeX-1))
+    right=int(np.clip(x+roiWidth[0]//2, left+1, imageSizeX))
+    up=int(np.clip(y-roiWidth[1]//2, 0, imageSizeY-1))
+    down=int(np.clip(y+roiWidth[1]//2, up+1, imageSizeY))
+    return left, right, up, down
+
+
+def analyzeFrame(greyData, orientation, left, right, up, down, xValues, yValues, peakFitter, roiStats, weights=None,
+                 stats=None, counter=None):
+    """
+    Cuts of a frame along the ROI bands with the peak position, width, standard deviation and fit quality of the
+    horizontal and the vertical cut, see PeakFitter.peakPosWidth, and the statistics of the ROIs, see
+    roi_stats.ROIStatistics.compute. Also runs in the threads of the analysis pool.
+
+    :param weights: weights of the channels of RGB frames, luminance by default
+    :param stats: PipelineStats the durations of the stages are added to
+    :param counter: counter of the frame, see PeakFitter.peakPosWidth
+    :return: vertical cut, horizontal cut, peak X, peak Y, ROI statistics
+    """
+    start=time.perf_counter()
+    verCut, horCut = orientation.cuts(greyData, left, right, up, down, weights=weights)
+    cutsDone=time.perf_counter()
+    peakX=peakFitter.peakPosWidth(horCut, xValues, 'x', counter)
+    peakY=peakFitter.peakPosWidth(verCut, yValues, 'y', counter)
+    peaksDone=time.perf_counter()
+    rois=roiStats.compute(greyData, orientation, weights=weights)
+    if stats is not None:
+        stats.add('kernel', cutsDone-start)
+        stats.add('peaks', peaksDone-cutsDone)
+        if len(rois)>0:
+            stats.add('rois', time.perf_counter()-peaksDone)
+    return verCut, horCut, peakX, peakY, rois
+
+
+def analysisColumns(peakX, peakY, rois, fitModel, pixelSize, nROIs):
+    """
+    Values of the peak, fit and ROI columns of a row of the time series, see time_series.timeSeriesLayout, in mm
+
+    :param peakX, peakY, rois: as returned by analyzeFrame
+    :param nROIs: number of ROIs of the time series, their columns are nan if the frame was analyzed with others
+    """
+    from roi_stats import roiValues, roiQuantities
+    values=[1e3*peakX[0], 1e3*peakX[1], 1e3*peakY[0], 1e3*peakY[1]]
+    if fitModel!='Centroid':
+        values+=[1e3*peakX[2], peakX[3], 1e3*peakY[2], peakY[3]]
+    if len(rois)==nROIs:
+        values+=roiValues(rois, pixelSize)
+    else:
+        values+=[np.nan]*len(roiQuantities)*nROIs
+    return values
+
+
+def warmUp(dtypes=(np.uint8, np.uint16), colorMode='Greyscale'):
+    """
+    Loads the compiled kernels of the cuts, peak positions and widths for frames of the given dtypes in the analysis
+    pool. Loading them from the numba cache takes a few hundred ms on the first call, started while the detector
+    connects it no longer delays the first frame.
+
+    :return: future of the warm-up
+    """
+    def run():
+        orientation=Orientation()
+        values=np.arange(4.0)
+        for dtype in dtypes:
+            data=np.zeros((4, 4) if colorMode=='Greyscale' else (4, 4, 3), dtype=dtype)
+            orientation.analyzeCuts(data, 0, 2, 0, 2, values, values)
+    return analysisPool().submit(run)
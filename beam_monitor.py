@@ -0,0 +1,390 @@
+"""
+Headless beam monitor running the acquisition and the analysis of the DynamicAD_Viewer without any widgets
+
+Usage: python DynamicAD_Viewer.py --headless --pv 15IDPS1: [-o timeSeries.txt] [options]
+"""
+from pyqtgraph.Qt import QtCore
+import numpy as np
+import sys
+import os
+import time
+import signal
+import argparse
+from ad_reader import AD_Reader, releaseFrame
+from pv_cache import PVCache, readPVFile
+from beam_analysis import Orientation, PeakFitter, fitModels, channelWeights, roiBands, analyzeFrame, analysisColumns
+from time_series import TimeSeriesWriter, fileFormats, timeSeriesLayout
+from pipeline_stats import PipelineStats
+from frame_correction import loadMap
+from frame_average import averageModes
+from roi_stats import ROIStatistics, readROIFile
+from frame_recorder import FrameRecorder, recordFormats
+
+
+class BeamMonitor(QtCore.QObject):
+    def __init__(self, detPV, output='-', fileFormat='Text', roiCenter=None, roiWidth=(10, 10), pixelSize=2.2e-6,
+                 orientation=None, colorMode='Greyscale', channel='Luminance', acquisitionMode='Monitor',
+                 monitorPVFile=None, monitorPVs=None, saveAges=False, acquire=True, maxFrames=0, statusInterval=10.0,
+                 source=None, bufferLength=32, metricsFile=None, metricsInterval=1.0, fitModel='Centroid',
+                 darkFile=None, flatFile=None, averageMode='Off', averageLength=10, rois=(), recordFile=None,
+                 recordFormat='HDF5', recordFrames=10000, parent=None):
+        """
+        Analyzes every frame of the detector and streams the peak positions and widths along with the monitor PVs
+        to a file or to stdout
+
+        :param detPV: Detector PV (example: 15PS1:), or a simulated or replayed source, see frame_sources.frameSource
+        :param output: file of the time series, '-' for stdout
+        :param fileFormat: one of the time_series.fileFormats
+        :param roiCenter: (x, y) center of the ROI bands in pixels of the displayed image, the center of the image
+        if None
+        :param roiWidth: (horizontal, vertical) widths of the ROI bands in pixels
+        :param pixelSize: pixel size in m
+        :param orientation: name of the orientation, the one saved by the viewer for the detector if None
+        :param colorMode: 'Greyscale' or 'RGB'
+        :param channel: channel analyzed in RGB frames
+        :param acquisitionMode: 'Monitor' or 'Counter', see AD_Reader.startAcquisition
+        :param monitorPVFile: monitor PV file, the one used by the viewer for the detector if None
+        :param monitorPVs: list of (name, PV) tuples of the monitor PVs used instead of the monitor PV file
+        :param saveAges: saves the ages of the monitor PV values
+        :param acquire: starts and stops the acquisition of the detector
+        :param maxFrames: stops after analyzing that many frames, runs forever if 0
+        :param statusInterval: interval in seconds of the status lines written to stderr, none if 0
+        :param source: FrameSource used instead of the one given by detPV
+        :param bufferLength: number of frames kept by the reader
+        :param metricsFile: file the frame counters and the stage timings are written to, see
+        PipelineStats.writeMetrics
+        :param metricsInterval: interval in seconds between the writes of the metrics file
+        :param fitModel: one of beam_analysis.fitModels used for the peak positions and widths
+        :param darkFile: dark frame subtracted from the frames, see frame_correction.loadMap
+        :param flatFile: flat-field the frames are corrected with, see frame_correction.loadMap
+        :param averageMode: one of frame_average.averageModes, the frames are analyzed after averaging
+        :param averageLength: number of averaged frames. The frame buffer is lengthened for the rolling average.
+        :param rois: list of (name, (x0, y0, x1, y1)) ROIs in pixels of the displayed image whose statistics are
+        saved after the peaks, see roi_stats.ROIStatistics
+        :param recordFile: file every frame is recorded to, see frame_recorder.FrameRecorder
+        :param recordFormat: one of frame_recorder.recordFormats
+        :param recordFrames: maximum number of recorded frames
+        """
+        QtCore.QObject.__init__(self, parent=parent)
+        self.detPV=detPV
+        self.output=output
+        self.fileFormat=fileFormat
+        self.roiCenter=roiCenter
+        self.roiWidth=roiWidth
+        self.pixelSize=pixelSize
+        self.settings=QtCore.QSettings('DynamicAD_Viewer','DynamicAD_Viewer')
+        if orientation is None:
+            orientation=self.settings.value('Orientation/'+detPV, 'Normal')
+        self.orientation=Orientation(orientation)
+        self.colorMode=colorMode
+        self.channelWeights=channelWeights[channel]
+        self.acquisitionMode=acquisitionMode
+        if monitorPVs is None:
+            if monitorPVFile is None:
+                monitorPVFile=self.settings.value('MonitorPVFile/'+detPV, self.settings.value('MonitorPVFile', ''))
+            if monitorPVFile!='':
+                monitorPVs=readPVFile(monitorPVFile)
+        self.pvCache=PVCache(monitorPVs)
+        self.saveAges=saveAges
+        self.acquire=acquire
+        self.maxFrames=maxFrames
+        self.statusInterval=statusInterval
+        self.source=source
+        self.bufferLength=bufferLength
+        self.metricsFile=metricsFile
+        self.metricsInterval=metricsInterval
+        self.peakFitter=PeakFitter(fitModel)
+        self.darkFile=darkFile
+        self.flatFile=flatFile
+        self.averageMode=averageMode
+        self.averageLength=averageLength
+        self.roiStats=ROIStatistics(rois)
+        self.recordFile=recordFile
+        self.recordFormat=recordFormat
+        self.recordFrames=recordFrames
+        self.recorder=None
+        self.stats=PipelineStats()
+        self.analyzedFrames=0
+        self.tsWriter=None
+        self.adReader=None
+
+    def start(self):
+        """
+        Connects to the detector and starts the acquisition. Returns False if the detector is not connected.
+        """
+        startTime=time.perf_counter()
+        self.adReader=AD_Reader(detPV=self.detPV, parent=self, source=self.source)
+        if not self.adReader.connected:
+            print('PV Error: Please check the PV %s is valid and the Detector IOC is running.'%self.detPV,
+                  file=sys.stderr)
+            return False
+        self.adReader.colorMode=self.colorMode
+        self.adReader.acquisitionMode=self.acquisitionMode
+        self.adReader.bufferLength=self.bufferLength
+        if self.averageMode=='Rolling':
+            self.adReader.bufferLength=max(self.bufferLength, self.averageLength+1)
+        self.adReader.averager.setMode(self.averageMode, self.averageLength)
+        self.adReader.stats=self.stats
+        self.stats.add('connect', self.adReader.connectTime)
+        if not self.setCorrection():
+            return False
+        self.setROI(self.adReader.sizeX, self.adReader.sizeY)
+        colNames, header, rowFormat = timeSeriesLayout(self.pvCache.names, self.adReader.source.getExposureTime(),
+                                                       self.saveAges, fitModel=self.peakFitter.model,
+                                                       roiNames=self.roiStats.names)
+        self.tsWriter=TimeSeriesWriter(self.output, colNames, fileFormat=self.fileFormat, header=header,
+                                       rowFormat=rowFormat, flushInterval=0.2 if self.output=='-' else 1.0)
+        if self.recordFile is not None:
+            try:
+                self.recorder=FrameRecorder(self.recordFile, fileFormat=self.recordFormat,
+                                            maxFrames=self.recordFrames, header=header, stats=self.stats)
+            except (IOError, OSError, ValueError) as error:
+                print('Could not record the frames to %s: %s'%(self.recordFile, error), file=sys.stderr)
+                self.tsWriter.close()
+                return False
+            self.adReader.recorder=self.recorder
+        if self.acquire:
+            self.adReader.source.setAcquire(True)
+        self.adReader.frameReady.connect(self.analyzeFrames)
+        self.adReader.sourceFinished.connect(self.onSourceFinished)
+        self.startTime=time.time()
+        self.statusTime=self.startTime
+        self.statusCount=0
+        self.metricsTime=self.startTime
+        self.adReader.startAcquisition()
+        self.startupTime=time.perf_counter()-startTime
+        return True
+
+    def setCorrection(self):
+        """
+        Loads the dark frame and the flat-field into the correction of the reader. Returns False if they cannot be
+        read or do not match the frames.
+        """
+        if self.darkFile is None and self.flatFile is None:
+            return True
+        if self.colorMode=='Greyscale':
+            shape=(self.adReader.sizeY, self.adReader.sizeX)
+        else:
+            shape=(self.adReader.sizeY, self.adReader.sizeX, 3)
+        correction=self.adReader.correction
+        for fname, setMap in ((self.darkFile, correction.setDark), (self.flatFile, correction.setFlat)):
+            if fname is None:
+                continue
+            try:
+                data=loadMap(fname)
+            except (IOError, OSError, ValueError) as error:
+                print('Could not load %s: %s'%(fname, error), file=sys.stderr)
+                return False
+            if data.shape!=shape:
+                print('%s has the shape %s instead of %s'%(fname, data.shape, shape), file=sys.stderr)
+                return False
+            setMap(data)
+        correction.enabled=True
+        return True
+
+    def stop(self):
+        if self.adReader is None or not self.adReader.acquiring:
+            return
+        self.adReader.stopAcquisition()
+        self.adReader.frameReady.disconnect(self.analyzeFrames)
+        self.adReader.sourceFinished.disconnect(self.onSourceFinished)
+        # Frames queued before stopping are still analyzed and saved, up to maxFrames
+        self.analyzeFrames()
+        if self.acquire:
+            self.adReader.source.setAcquire(False)
+        self.tsWriter.close()
+        if self.recorder is not None:
+            self.adReader.recorder=None
+            self.recorder.close()
+        self.pvCache.close()
+        self.writeMetrics()
+        print('Frames: %d, Analyzed: %d, Dropped: %d, Rows written: %d, Rows dropped: %d'%(
+            self.adReader.receivedFrames, self.analyzedFrames, self.adReader.droppedFrames, self.tsWriter.writtenRows,
+            self.tsWriter.droppedRows), file=sys.stderr)
+        firstFrame=self.adReader.firstFrameTime
+        print('Startup: %.3f s, Connect: %.3f s, First frame after start: %s'%(
+            self.startupTime, self.adReader.connectTime, 'none' if firstFrame is None else '%.3f s'%firstFrame),
+            file=sys.stderr)
+        if self.recorder is not None:
+            print('Frames recorded: %d, Not recorded: %d, Rejected: %d, Max queued: %d, Error: %s'%(
+                self.recorder.writtenFrames, self.recorder.droppedFrames, self.recorder.rejectedFrames,
+                self.recorder.maxQueued, self.recorder.error), file=sys.stderr)
+
+    def setROI(self, sizeX, sizeY):
+        """
+        Sets the ROI bands and the pixel positions for frames of sizeX x sizeY pixels as delivered by the detector
+        """
+        if self.colorMode=='Greyscale':
+            shape=(sizeY, sizeX)
+        else:
+            shape=(sizeY, sizeX, 3)
+        self.imageSizeX, self.imageSizeY = self.orientation.displayShape(shape)
+        self.left, self.right, self.up, self.down = roiBands(self.imageSizeX, self.imageSizeY, self.roiCenter,
+                                                             self.roiWidth)
+        self.xValues=self.pixelSize*np.arange(self.imageSizeX)
+        self.yValues=self.pixelSize*np.arange(self.imageSizeY)
+
+    def analyzeFrames(self):
+        """
+        Analyzes all the queued frames and queues their rows for the writer. The frames after the first maxFrames
+        ones are discarded.
+        """
+        for frame in self.adReader.frameQueue.getAll():
+            if self.maxFrames==0 or self.analyzedFrames<self.maxFrames:
+                self.analyzeFrame(frame)
+                if self.analyzedFrames==self.maxFrames:
+                    QtCore.QCoreApplication.quit()
+            releaseFrame(frame)
+        t=time.time()
+        if self.statusInterval>0 and t-self.statusTime>=self.statusInterval:
+            status='%s Analysis: %.1f FPS, Frames: %d, Dropped: %d'%(time.strftime('%H:%M:%S'),
+                   self.statusCount/(t-self.statusTime), self.adReader.receivedFrames, self.adReader.droppedFrames)
+            if self.recorder is not None:
+                status+=', Recorded: %d, Not recorded: %d'%(self.recorder.writtenFrames, self.recorder.droppedFrames)
+            print(status, file=sys.stderr)
+            self.statusTime=t
+            self.statusCount=0
+        if self.metricsFile is not None and t-self.metricsTime>=self.metricsInterval:
+            self.writeMetrics()
+            self.metricsTime=t
+
+    def onSourceFinished(self):
+        """
+        Stops once a replay delivered its last frame, after analyzing the queued frames
+        """
+        self.analyzeFrames()
+        QtCore.QCoreApplication.quit()
+
+    def writeMetrics(self):
+        if self.metricsFile is None:
+            return
+        self.stats.setCount('received', self.adReader.receivedFrames)
+        self.stats.setCount('processed', self.analyzedFrames)
+        self.stats.setCount('dropped', self.adReader.droppedFrames)
+        self.stats.setCount('written', self.tsWriter.writtenRows)
+        if self.recorder is not None:
+            self.stats.setCount('recorded', self.recorder.writtenFrames)
+            self.stats.setCount('unrecorded', self.recorder.droppedFrames)
+        try:
+            self.stats.writeMetrics(self.metricsFile, detector=self.detPV)
+        except OSError as error:
+            print('Could not write the metrics file %s: %s'%(self.metricsFile, error), file=sys.stderr)
+
+    def analyzeFrame(self, frame):
+        """
+        Calculates the peak positions and widths of a frame of the reader and queues its row for the writer
+        """
+        start=time.perf_counter()
+        self.stats.add('queue', time.time()-frame['time'])
+        greyData=frame['greyData']
+        if self.orientation.displayShape(greyData.shape)!=(self.imageSizeX, self.imageSizeY):
+            self.setROI(greyData.shape[1], greyData.shape[0])
+        verCutData, horCutData, peakX, peakY, rois = analyzeFrame(greyData, self.orientation, self.left, self.right,
+                                                                  self.up, self.down, self.xValues, self.yValues,
+                                                                  self.peakFitter, self.roiStats,
+                                                                  weights=self.channelWeights, stats=self.stats,
+                                                                  counter=frame['counter'])
+        analyzed=time.perf_counter()
+        values, ages = self.pvCache.getValues()
+        if self.saveAges:
+            values=values+ages
+        self.tsWriter.write([frame['time']-self.startTime]+values+
+                            analysisColumns(peakX, peakY, rois, self.peakFitter.model, self.pixelSize,
+                                            len(self.roiStats)))
+        self.stats.add('cuts', analyzed-start)
+        self.stats.add('autosave', time.perf_counter()-analyzed)
+        self.analyzedFrames+=1
+        self.statusCount+=1
+
+
+def parseArguments(argv):
+    parser=argparse.ArgumentParser(prog='DynamicAD_Viewer.py --headless',
+                                   description='Headless beam monitor of an areaDetector')
+    parser.add_argument('--headless', action='store_true', help='run without display')
+    parser.add_argument('--pv', required=True,
+                        help='detector PV, for example 15IDPS1:, or sim:[options] for a simulated beam or '
+                             'tiff:PATTERN[,rate=10] for the replay of TIFF files or replay:PATH[,rate=0] for the '
+                             'replay of a directory, TIFF, HDF5 or .npy stack, every frame as fast as possible by '
+                             'default')
+    parser.add_argument('-o', '--output', default='-', help='file of the time series, stdout by default')
+    parser.add_argument('--format', default=None, choices=list(fileFormats.keys()),
+                        help='file format, guessed from the extension of the output file by default')
+    parser.add_argument('--roi', type=int, nargs=2, default=None, metavar=('X', 'Y'),
+                        help='center of the ROI bands in pixels, the center of the image by default')
+    parser.add_argument('--roi-width', type=int, nargs=2, default=(10, 10), metavar=('WX', 'WY'),
+                        help='widths of the horizontal and vertical ROI bands in pixels')
+    parser.add_argument('--pixel-size', type=float, default=2.2, help='pixel size in microns')
+    parser.add_argument('--fit', default='Centroid', choices=fitModels,
+                        help='centroid or Gaussian fit of the cuts for the peak positions and widths')
+    parser.add_argument('--dark', default=None, help='dark frame subtracted from the frames (.tif or .npy)')
+    parser.add_argument('--flat', default=None, help='flat-field the frames are corrected with (.tif or .npy)')
+    parser.add_argument('--average', default='Off', choices=averageModes,
+                        help='rolling or exponential moving average of the frames before the analysis')
+    parser.add_argument('--average-length', type=int, default=10, help='number of averaged frames')
+    parser.add_argument('--rois', default=None,
+                        help='file of ROIs whose sum, mean, centroid and size are saved, name x0 y0 x1 y1 per line')
+    parser.add_argument('--record', default=None,
+                        help='file every frame is recorded to with its ArrayCounter and IOC timestamp (.h5 or .npy)')
+    parser.add_argument('--record-format', default=None, choices=list(recordFormats.keys()),
+                        help='format of the recorded frames, guessed from the extension of the file by default')
+    parser.add_argument('--record-frames', type=int, default=10000, help='maximum number of recorded frames')
+    parser.add_argument('--orientation', default=None, choices=list(Orientation.orientations.keys()),
+                        help='orientation of the image, the one saved by the viewer for the detector by default')
+    parser.add_argument('--color-mode', default='Greyscale', choices=['Greyscale', 'RGB'])
+    parser.add_argument('--channel', default='Luminance', choices=list(channelWeights.keys()),
+                        help='channel analyzed in RGB frames')
+    parser.add_argument('--acquisition-mode', default='Monitor', choices=['Monitor', 'Counter'])
+    parser.add_argument('--monitor-pvs', default=None, help='monitor PV file with name<TAB>PV lines')
+    parser.add_argument('--save-ages', action='store_true', help='save the ages of the monitor PV values')
+    parser.add_argument('--no-acquire', action='store_true',
+                        help='monitor the frames without starting and stopping the acquisition')
+    parser.add_argument('--buffer-length', type=int, default=32, help='number of frames kept by the reader')
+    parser.add_argument('--metrics', default=None,
+                        help='file the frame counters and the stage timings are written to every second')
+    parser.add_argument('--frames', type=int, default=0, help='number of frames to analyze, 0 runs forever')
+    parser.add_argument('--duration', type=float, default=0, help='duration in seconds, 0 runs forever')
+    parser.add_argument('--status-interval', type=float, default=10.0,
+                        help='interval in seconds of the status lines written to stderr, 0 disables them')
+    args=parser.parse_args(argv)
+    if args.format is None:
+        extensions={extension: fileFormat for fileFormat, extension in fileFormats.items()}
+        args.format=extensions.get(os.path.splitext(args.output)[1], 'Text')
+    if args.output=='-' and args.format!='Text':
+        parser.error('Only the Text format can be written to stdout')
+    if args.record is not None and args.record_format is None:
+        extensions={extension: fileFormat for fileFormat, extension in recordFormats.items()}
+        args.record_format=extensions.get(os.path.splitext(args.record)[1], 'NPY')
+    return args
+
+
+def main(argv):
+    args=parseArguments(argv)
+    app=QtCore.QCoreApplication.instance()
+    if app is None:
+        app=QtCore.QCoreApplication(sys.argv[:1])
+    monitor=BeamMonitor(args.pv, output=args.output, fileFormat=args.format, roiCenter=args.roi,
+                        roiWidth=args.roi_width, pixelSize=args.pixel_size*1e-6, orientation=args.orientation,
+                        colorMode=args.color_mode, channel=args.channel, acquisitionMode=args.acquisition_mode,
+                        monitorPVFile=args.monitor_pvs, saveAges=args.save_ages, acquire=not args.no_acquire,
+                        maxFrames=args.frames, statusInterval=args.status_interval, bufferLength=args.buffer_length,
+                        metricsFile=args.metrics, fitModel=args.fit, darkFile=args.dark,
+                        flatFile=args.flat, averageMode=args.average, averageLength=args.average_length,
+                        rois=() if args.rois is None else readROIFile(args.rois), recordFile=args.record,
+                        recordFormat=args.record_format, recordFrames=args.record_frames)
+    if not monitor.start():
+        return 1
+    signal.signal(signal.SIGINT, lambda *args: app.quit())
+    signal.signal(signal.SIGTERM, lambda *args: app.quit())
+    # Lets the interpreter handle the signals while the event loop is running
+    signalTimer=QtCore.QTimer()
+    signalTimer.timeout.connect(lambda: None)
+    signalTimer.start(200)
+    if args.duration>0:
+        QtCore.QTimer.singleShot(int(1e3*args.duration), app.quit)
+    app.exec_()
+    monitor.stop()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
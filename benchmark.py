@@ -0,0 +1,257 @@
+"""
+Benchmarks of the DynamicAD_Viewer
+
+Usage: python benchmark.py
+           compares the NumPy and numba cuts on the bundled 2dimage*.tif files
+       python benchmark.py --pipeline [--sizes 1360x1024 4096x4096] [--output results.json] [--compare old.json]
+           measures the frame rate, latency and memory of the headless pipeline (frame ingest, cuts, peak positions
+           and widths, autosave) for every combination of image size, dtype, color mode and ROI width
+"""
+import argparse
+import glob
+import json
+import multiprocessing
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+from imageio import imread
+from beam_analysis import analyzeCuts
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+def numpyCuts(greyData, left, right, up, down, xValues, yValues):
+    """
+    The NumPy implementation of the cuts, peak positions and widths used by the viewer before the numba kernel
+    """
+    verCutData=np.sum(greyData[left:right,:],axis=0)
+    minm=np.min(verCutData)
+    maxm=np.max(verCutData)
+    pos=np.where(verCutData>(maxm+minm)/2)
+    verCut = verCutData[pos]
+    cutPeakY = np.sum(verCut * yValues[pos]) / np.sum(verCut)
+    cutY = np.argwhere(verCut >= np.max(verCut) / 2.0)
+    cutWidthY = np.abs(yValues[cutY[0]] - yValues[cutY[-1]])[0]
+
+    horCutData=np.sum(greyData[:,up:down],axis=1)
+    minm=np.min(horCutData)
+    maxm=np.max(horCutData)
+    pos=np.where(horCutData>(maxm+minm)/2)
+    horCut = horCutData[pos]
+    cutPeakX = np.sum(horCut * xValues[pos]) / np.sum(horCut)
+    cutX = np.argwhere(horCut >= np.max(horCut) / 2.0)
+    cutWidthX = np.abs(xValues[cutX[0]] - xValues[cutX[-1]])[0]
+    return verCutData, horCutData, cutPeakX, cutWidthX, cutPeakY, cutWidthY
+
+
+def timeit(func, args, repeat=50):
+    """
+    Returns the median time per call in seconds
+    """
+    func(*args)
+    times=[]
+    for i in range(repeat):
+        t=time.perf_counter()
+        func(*args)
+        times.append(time.perf_counter()-t)
+    return np.median(times)
+
+
+def benchmarkCuts(files, roiWidths=(10, 50, 200), pixelSize=1e-6):
+    """
+    Compares the NumPy implementation of the cuts with the numba kernel for every file and ROI width
+    """
+    print('%-16s %6s %12s %12s %8s %6s'%('File', 'ROI', 'NumPy (ms)', 'numba (ms)', 'Speedup', 'Same'))
+    for fname in files:
+        data=imread(fname)
+        greyData=np.rot90(data, k=-1, axes=(0, 1))
+        xValues=pixelSize*np.arange(greyData.shape[0])
+        yValues=pixelSize*np.arange(greyData.shape[1])
+        for roi in roiWidths:
+            left,right=greyData.shape[0]//2-roi//2,greyData.shape[0]//2+roi//2
+            up,down=greyData.shape[1]//2-roi//2,greyData.shape[1]//2+roi//2
+            args=(greyData, left, right, up, down, xValues, yValues)
+            ref=numpyCuts(*args)
+            res=analyzeCuts(*args)
+            same=all(np.allclose(a, b) for a, b in zip(ref, res))
+            tNumpy=timeit(numpyCuts, args)
+            tNumba=timeit(analyzeCuts, args)
+            print('%-16s %6d %12.3f %12.3f %8.1f %6s'%(fname, roi, 1e3*tNumpy, 1e3*tNumba, tNumpy/tNumba, same))
+
+
+def runPipeline(case):
+    """
+    Runs the headless pipeline on the frames of a simulated or replayed source and returns its statistics. Frames
+    are produced faster than they can be analyzed so that the throughput of the pipeline is measured. The latency
+    of a frame is the time from its storage by the reader to the queuing of its row for the writer.
+
+    :param case: dictionary of the parameters of the case, see pipelineCases
+    """
+    from pyqtgraph.Qt import QtCore
+    from beam_monitor import BeamMonitor
+    from frame_sources import SyntheticSource, StackReplaySource
+
+    class PipelineBenchmark(BeamMonitor):
+        def __init__(self, *args, **kwargs):
+            BeamMonitor.__init__(self, *args, **kwargs)
+            self.latencies=[]
+            self.analysisTimes=[]
+            self.analysisEnds=[]
+
+        def analyzeFrame(self, frame):
+            t=time.perf_counter()
+            BeamMonitor.analyzeFrame(self, frame)
+            self.analysisTimes.append(time.perf_counter()-t)
+            self.analysisEnds.append(time.time())
+            self.latencies.append(self.analysisEnds[-1]-frame['time'])
+
+    app=QtCore.QCoreApplication.instance()
+    if app is None:
+        app=QtCore.QCoreApplication(sys.argv[:1])
+    if case['source']=='sim':
+        source=SyntheticSource(case['sizeX'], case['sizeY'], dtype=case['dtype'], rate=case['rate'], cache=2)
+    else:
+        source=StackReplaySource(case['source'], rate=case['rate'])
+    outputDir=tempfile.mkdtemp()
+    output=os.path.join(outputDir, 'timeSeries'+case['extension'])
+    monitor=PipelineBenchmark(case['name'], output=output, fileFormat=case['format'], roiWidth=(case['roi'], case['roi']),
+                              orientation='Normal', colorMode=case['colorMode'], monitorPVs=[], acquire=False,
+                              maxFrames=case['frames']+case['warmup'], statusInterval=0, source=source,
+                              bufferLength=case['bufferLength'])
+    # Loads the numba kernels before starting
+    analyzeCuts(np.zeros((4, 4), dtype=np.uint8), 0, 2, 0, 2, np.arange(4.0), np.arange(4.0))
+    if not monitor.start():
+        raise RuntimeError('The source of %s is not available'%case['name'])
+    QtCore.QTimer.singleShot(int(1e3*case['timeout']), app.quit)
+    app.exec_()
+    monitor.stop()
+    writtenRows=monitor.tsWriter.writtenRows
+    os.remove(output)
+    os.rmdir(outputDir)
+    warmup=min(case['warmup'], max(len(monitor.latencies)-2, 0))
+    latencies=1e3*np.array(monitor.latencies[warmup:])
+    analysisTimes=1e3*np.array(monitor.analysisTimes[warmup:])
+    ends=np.array(monitor.analysisEnds[warmup:])
+    result=dict(case)
+    result.update({'analyzedFrames': len(latencies),
+                   'fps': (len(ends)-1)/(ends[-1]-ends[0]) if len(ends)>1 else np.nan,
+                   'latencyP50': float(np.percentile(latencies, 50)) if len(latencies)>0 else np.nan,
+                   'latencyP99': float(np.percentile(latencies, 99)) if len(latencies)>0 else np.nan,
+                   'analysisMean': float(np.mean(analysisTimes)) if len(analysisTimes)>0 else np.nan,
+                   'receivedFrames': monitor.adReader.receivedFrames,
+                   'droppedFrames': monitor.adReader.droppedFrames,
+                   'writtenRows': writtenRows,
+                   # ru_maxrss is given in kB on Linux and in bytes on macOS
+                   'peakMemoryMB': np.nan if resource is None else
+                   resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/(2**20 if sys.platform=='darwin' else 2**10)})
+    return result
+
+
+def pipelineCases(sizes, dtypes, colorModes, roiWidths, tiffs, frames=200, warmup=10, rate=0.0, fileFormat='Text',
+                  bufferLength=8, timeout=120.0):
+    """
+    Returns the list of the cases of the pipeline benchmark, one for every bundled TIFF file and every
+    combination of size, dtype and color mode of the simulated source, each with every ROI width
+    """
+    from time_series import fileFormats
+    common={'frames': frames, 'warmup': warmup, 'rate': rate, 'format': fileFormat,
+            'extension': fileFormats[fileFormat], 'bufferLength': bufferLength, 'timeout': timeout}
+    cases=[]
+    for roi in roiWidths:
+        for fname in tiffs:
+            shape=imread(fname).shape
+            case={'name': 'tiff:%s roi=%d'%(os.path.basename(fname), roi), 'source': fname, 'sizeX': shape[1],
+                  'sizeY': shape[0], 'dtype': str(imread(fname).dtype), 'colorMode': 'Greyscale' if len(shape)==2
+                  else 'RGB', 'roi': roi}
+            case.update(common)
+            cases.append(case)
+        for size in sizes:
+            sizeX, sizeY = [int(value) for value in size.lower().split('x')]
+            for dtype in dtypes:
+                for colorMode in colorModes:
+                    case={'name': 'sim:%dx%d %s %s roi=%d'%(sizeX, sizeY, dtype, colorMode, roi), 'source': 'sim',
+                          'sizeX': sizeX, 'sizeY': sizeY, 'dtype': dtype, 'colorMode': colorMode, 'roi': roi}
+                    case.update(common)
+                    cases.append(case)
+    return cases
+
+
+def metadata():
+    """
+    Returns the versions and the machine the benchmark was run with
+    """
+    import numba
+    try:
+        commit=subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit=''
+    return {'date': time.strftime('%Y-%m-%d %H:%M:%S'), 'commit': commit, 'python': platform.python_version(),
+            'numpy': np.__version__, 'numba': numba.__version__, 'platform': platform.platform(),
+            'processor': platform.processor(), 'cpus': os.cpu_count()}
+
+
+def benchmarkPipeline(cases, output=None, compare=None):
+    """
+    Runs every case in a new process, so that the peak memory is the one of the case, prints the results and
+    saves them as JSON in output. The frame rates and latencies are compared to the ones of the JSON file compare.
+    """
+    previous={}
+    if compare is not None:
+        with open(compare, 'r') as fh:
+            previous={result['name']: result for result in json.load(fh)['results']}
+    context=multiprocessing.get_context('spawn')
+    results=[]
+    print('%-40s %9s %10s %10s %10s %8s %10s %s'%('Case', 'FPS', 'p50 (ms)', 'p99 (ms)', 'Ana. (ms)', 'Dropped',
+                                                  'Peak (MB)', 'vs. previous' if compare else ''))
+    for case in cases:
+        with context.Pool(1, maxtasksperchild=1) as pool:
+            result=pool.apply(runPipeline, (case,))
+        results.append(result)
+        line='%-40s %9.1f %10.2f %10.2f %10.2f %8d %10.0f'%(result['name'], result['fps'], result['latencyP50'],
+                                                          result['latencyP99'], result['analysisMean'],
+                                                          result['droppedFrames'], result['peakMemoryMB'])
+        if result['name'] in previous:
+            old=previous[result['name']]
+            line+=' FPS x%.2f, p99 x%.2f'%(result['fps']/old['fps'], result['latencyP99']/old['latencyP99'])
+        print(line, flush=True)
+    if output is not None:
+        with open(output, 'w') as fh:
+            json.dump({'metadata': metadata(), 'results': results}, fh, indent=1)
+    return results
+
+
+if __name__ == '__main__':
+    parser=argparse.ArgumentParser(description='Benchmarks of the DynamicAD_Viewer')
+    parser.add_argument('--pipeline', action='store_true', help='benchmark the headless pipeline')
+    parser.add_argument('--sizes', nargs='+', default=['1360x1024', '2048x2048', '4096x4096'],
+                        help='sizes WIDTHxHEIGHT of the simulated frames')
+    parser.add_argument('--dtypes', nargs='+', default=['uint8', 'uint16'])
+    parser.add_argument('--color-modes', nargs='+', default=['Greyscale', 'RGB'])
+    parser.add_argument('--roi-widths', type=int, nargs='+', default=[10, 200])
+    parser.add_argument('--tiffs', nargs='*', default=None, help='TIFF files replayed, 2dimage*.tif by default')
+    parser.add_argument('--frames', type=int, default=200, help='frames analyzed per case after the warm-up')
+    parser.add_argument('--rate', type=float, default=0.0,
+                        help='frame rate of the sources for latency under load, 0 delivers the frames as fast as '
+                             'the reader takes them')
+    parser.add_argument('--format', default='Text', help='format of the autosaved time series')
+    parser.add_argument('--buffer-length', type=int, default=8, help='number of frames kept by the reader')
+    parser.add_argument('-o', '--output', default=None, help='JSON file of the results')
+    parser.add_argument('--compare', default=None, help='JSON file of previous results to compare with')
+    args=parser.parse_args()
+    if args.pipeline:
+        tiffs=sorted(glob.glob('2dimage*.tif')) if args.tiffs is None else args.tiffs
+        benchmarkPipeline(pipelineCases(args.sizes, args.dtypes, args.color_modes, args.roi_widths, tiffs,
+                                        frames=args.frames, rate=args.rate, fileFormat=args.format,
+                                        bufferLength=args.buffer_length), output=args.output, compare=args.compare)
+    else:
+        t=time.perf_counter()
+        analyzeCuts(np.zeros((4, 4), dtype=np.uint8), 0, 2, 0, 2, np.arange(4.0), np.arange(4.0))
+        print('numba kernel loaded/compiled in %.3f s'%(time.perf_counter()-t))
+        benchmarkCuts(sorted(glob.glob('2dimage*.tif')))
@@ -0,0 +1,237 @@
+import time
+import math
+from pyqtgraph.Qt import QtGui, QtCore
+import pyqtgraph as pg
+from PyQt5.Qt import Qt
+
+# Columns of the crosshair table, also the keys of the crosshair dictionaries and of the .chr files
+crosshairKeys=['Name', 'Pos-X (mm)', 'Pos-Y (mm)', 'Angle (deg)', 'Linewidth (pix)', 'Color', 'Show']
+
+
+def newCrosshair(name, x, y, angle=0.0, width=1.0, color='r', show=True):
+    """
+    Returns the dictionary of a crosshair at (x, y) in mm
+    """
+    return {'Name':name, 'Pos-X (mm)':float(x), 'Pos-Y (mm)':float(y), 'Angle (deg)':float(angle),
+            'Linewidth (pix)':float(width), 'Color':pg.mkColor(color), 'Show':bool(show)}
+
+
+def readCrosshairFile(fname):
+    """
+    Reads the crosshairs from a .chr file: tab separated values with the keys on the second line after a #.
+    Colors are read as pyqtgraph color strings, i.e. single letters or hex codes.
+
+    :return: list of crosshair dictionaries
+    """
+    crosshairs=[]
+    with open(fname, 'r') as fh:
+        lines=fh.readlines()
+    keys=lines[1].strip()[1:].split('\t')
+    for line in lines:
+        if line[0]=='#' or line.strip()=='':
+            continue
+        values=dict(zip(keys, line.rstrip('\r\n').split('\t')))
+        try:
+            color=pg.mkColor(values.get('Color', 'r'))
+        except Exception:
+            color=pg.mkColor('r')
+        show=values.get('Show', 'True').strip()
+        crosshairs.append(newCrosshair(values.get('Name', 'ch_%d'%len(crosshairs)),
+                                       float(values.get('Pos-X (mm)', 0.0)), float(values.get('Pos-Y (mm)', 0.0)),
+                                       angle=float(values.get('Angle (deg)', 0.0)),
+                                       width=float(values.get('Linewidth (pix)', 1.0)), color=color,
+                                       show=show not in ('False', '0', '0.0')))
+    return crosshairs
+
+
+def writeCrosshairFile(fname, crosshairs):
+    lines=['# Crosshair file saved on %s\n'%time.ctime(), '#'+'\t'.join(crosshairKeys)+'\t\n']
+    for ch in crosshairs:
+        values=[ch['Name']]+['%.10g'%ch[key] for key in crosshairKeys[1:5]]
+        values+=[ch['Color'].name(), str(ch['Show'])]
+        lines.append('\t'.join(values)+'\t\n')
+    with open(fname, 'w') as fh:
+        fh.writelines(lines)
+
+
+class CrosshairModel(QtCore.QAbstractTableModel):
+    def __init__(self, parent=None):
+        """
+        Table model holding the crosshairs as a list of dictionaries with the crosshairKeys. Edits of the views
+        change only the edited crosshair and emit dataChanged for its cell, adding, removing or loading crosshairs
+        emit a single insert, remove or reset, so that thousands of crosshairs stay interactive. The colors are
+        shown as the background of the Color cells and changed with setColor.
+        """
+        QtCore.QAbstractTableModel.__init__(self, parent)
+        self.crosshairs=[]
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        return 0 if parent.isValid() else len(self.crosshairs)
+
+    def columnCount(self, parent=QtCore.QModelIndex()):
+        return 0 if parent.isValid() else len(crosshairKeys)
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role==Qt.DisplayRole:
+            if orientation==Qt.Horizontal:
+                return crosshairKeys[section]
+            return str(section+1)
+        return None
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        ch=self.crosshairs[index.row()]
+        key=crosshairKeys[index.column()]
+        if key=='Color':
+            if role==Qt.BackgroundRole:
+                return QtGui.QBrush(ch['Color'])
+            if role==Qt.ToolTipRole:
+                return 'Double click to change the color'
+        elif key=='Show':
+            if role==Qt.CheckStateRole:
+                return Qt.Checked if ch['Show'] else Qt.Unchecked
+        elif role==Qt.DisplayRole:
+            return ch[key] if key=='Name' else '%.6g'%ch[key]
+        elif role==Qt.EditRole:
+            return ch[key]
+        return None
+
+    def flags(self, index):
+        flags=Qt.ItemIsEnabled | Qt.ItemIsSelectable
+        key=crosshairKeys[index.column()]
+        if key=='Show':
+            flags|=Qt.ItemIsUserCheckable
+        elif key!='Color':
+            flags|=Qt.ItemIsEditable
+        return flags
+
+    def setData(self, index, value, role=Qt.EditRole):
+        if not index.isValid():
+            return False
+        ch=self.crosshairs[index.row()]
+        key=crosshairKeys[index.column()]
+        if key=='Show':
+            if role!=Qt.CheckStateRole:
+                return False
+            ch['Show']=value==Qt.Checked
+        elif key=='Color':
+            ch['Color']=pg.mkColor(value)
+        elif role!=Qt.EditRole:
+            return False
+        elif key=='Name':
+            ch['Name']=str(value)
+        else:
+            try:
+                ch[key]=float(value)
+            except ValueError:
+                return False
+        self.dataChanged.emit(index, index, [role])
+        return True
+
+    def setColor(self, row, color):
+        self.setData(self.index(row, crosshairKeys.index('Color')), color)
+
+    def addCrosshair(self, ch):
+        row=len(self.crosshairs)
+        self.beginInsertRows(QtCore.QModelIndex(), row, row)
+        self.crosshairs.append(ch)
+        self.endInsertRows()
+
+    def removeCrosshairs(self, rows):
+        """
+        Removes the crosshairs of the given rows, each run of consecutive rows at once
+        """
+        rows=sorted(set(rows), reverse=True)
+        while len(rows)>0:
+            last=first=rows.pop(0)
+            while len(rows)>0 and rows[0]==first-1:
+                first=rows.pop(0)
+            self.beginRemoveRows(QtCore.QModelIndex(), first, last)
+            del self.crosshairs[first:last+1]
+            self.endRemoveRows()
+
+    def setCrosshairs(self, crosshairs):
+        self.beginResetModel()
+        self.crosshairs=list(crosshairs)
+        self.endResetModel()
+
+
+class CrosshairItem(pg.GraphicsObject):
+    def __init__(self, model, length=1.0, maxLabels=100):
+        """
+        Draws all the shown crosshairs of a CrosshairModel as one graphics item. The two lines of every crosshair
+        are batched into one QPainterPath per color and line width, rebuilt only after the model changed, so
+        that the scene holds a single item whatever the number of crosshairs. The lines are cosmetic, i.e. their
+        width is in pixels of the screen.
+
+        :param model: CrosshairModel with the positions in mm
+        :param length: half length of the lines in the coordinates of the plot (m), the image diagonal spans it
+        :param maxLabels: the names are drawn only if at most maxLabels crosshairs are shown
+        """
+        pg.GraphicsObject.__init__(self)
+        self.model=model
+        self.length=length
+        self.maxLabels=maxLabels
+        self.paths=None
+        self.labels=[]
+        self.bounds=QtCore.QRectF()
+        self.model.dataChanged.connect(self.modelChanged)
+        self.model.rowsInserted.connect(self.modelChanged)
+        self.model.rowsRemoved.connect(self.modelChanged)
+        self.model.modelReset.connect(self.modelChanged)
+
+    def setLength(self, length):
+        if length!=self.length:
+            self.length=length
+            self.modelChanged()
+
+    def modelChanged(self, *args):
+        self.prepareGeometryChange()
+        self.paths=None
+        self.update()
+
+    def buildPaths(self):
+        groups={}
+        shown=[ch for ch in self.model.crosshairs if ch['Show']]
+        for ch in shown:
+            key=(ch['Color'].rgba(), ch['Linewidth (pix)'])
+            if key not in groups:
+                groups[key]=QtGui.QPainterPath()
+            path=groups[key]
+            x, y = ch['Pos-X (mm)']*1e-3, ch['Pos-Y (mm)']*1e-3
+            angle=math.radians(ch['Angle (deg)'])
+            dx, dy = self.length*math.cos(angle), self.length*math.sin(angle)
+            path.moveTo(x-dx, y-dy)
+            path.lineTo(x+dx, y+dy)
+            path.moveTo(x+dy, y-dx)
+            path.lineTo(x-dy, y+dx)
+        self.paths=[]
+        self.bounds=QtCore.QRectF()
+        for (rgba, width), path in groups.items():
+            self.paths.append((pg.mkPen(QtGui.QColor.fromRgba(rgba), width=width), path))
+            self.bounds=self.bounds.united(path.boundingRect())
+        if len(shown)<=self.maxLabels:
+            self.labels=[(QtCore.QPointF(ch['Pos-X (mm)']*1e-3, ch['Pos-Y (mm)']*1e-3), ch['Name'], ch['Color'])
+                         for ch in shown]
+        else:
+            self.labels=[]
+
+    def boundingRect(self):
+        if self.paths is None:
+            self.buildPaths()
+        return self.bounds
+
+    def paint(self, p, *args):
+        if self.paths is None:
+            self.buildPaths()
+        for pen, path in self.paths:
+            p.setPen(pen)
+            p.drawPath(path)
+        if len(self.labels)>0:
+            # The names are drawn in pixels of the screen, unscaled by the mm coordinates of the plot
+            transform=p.transform()
+            p.resetTransform()
+            for pos, name, color in self.labels:
+                p.setPen(color)
+                p.drawText(transform.map(pos)+QtCore.QPointF(4, -4), name)
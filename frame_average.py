@@ -0,0 +1,124 @@
+import numpy as np
+from numba import jit
+
+# Averaging modes of FrameAverager
+averageModes=['Off', 'Rolling', 'EMA']
+
+
+@jit(nopython=True, cache=True, nogil=True, fastmath=True)
+def rollingAverage(new, old, total, count, out):
+    """
+    Adds the flat frame new to the running sum total, subtracts the flat frame old leaving the window and writes
+    the average of the count frames of the window into out, all in a single pass
+
+    :param old: frame leaving the window, or an empty array while the window is filling up
+    """
+    scale=1.0/count
+    if old.shape[0]==0:
+        for i in range(new.shape[0]):
+            acc=total[i]+new[i]
+            total[i]=acc
+            out[i]=acc*scale
+    else:
+        for i in range(new.shape[0]):
+            acc=total[i]+new[i]-old[i]
+            total[i]=acc
+            out[i]=acc*scale
+
+
+@jit(nopython=True, cache=True, nogil=True, fastmath=True)
+def expAverage(new, average, alpha, out):
+    """
+    Updates the exponential moving average with the flat frame new and copies it into out in a single pass
+    """
+    for i in range(new.shape[0]):
+        acc=average[i]+alpha*(new[i]-average[i])
+        average[i]=acc
+        out[i]=acc
+
+
+class FrameAverager(object):
+    def __init__(self, mode='Off', length=10):
+        """
+        Running average of the frames stored in the FrameBuffer of the reader. The 'Rolling' average of the last
+        length frames keeps their running sum and takes the frame leaving the window from the frame buffer, so that
+        every frame costs one addition and one subtraction whatever the length. The window is therefore limited
+        to the length of the frame buffer minus one. The 'EMA' mode is an exponential moving average with a time
+        constant of length frames. The averaged frames are float32 and stored in a ring with the same slots as the
+        frame buffer.
+
+        :param mode: one of averageModes
+        :param length: number of averaged frames
+        """
+        self.mode=mode
+        self.length=length
+        self.pending=None
+        self.frameBuffer=None
+        self.output=None
+        self.valid=None
+        self.reset()
+
+    def setMode(self, mode, length):
+        """
+        Changes the mode and the length from any thread. They are applied, and the average started again, with the
+        next frame.
+        """
+        if mode not in averageModes:
+            raise ValueError('Unknown averaging mode %s'%mode)
+        self.pending=(mode, max(int(length), 1))
+
+    @property
+    def active(self):
+        mode=self.mode if self.pending is None else self.pending[0]
+        return mode!='Off'
+
+    def reset(self):
+        self.total=None
+        self.average=None
+        self.count=0
+        if self.valid is not None:
+            self.valid[:]=False
+
+    def add(self, frameBuffer, index):
+        """
+        Adds the frame stored at slot index of frameBuffer to the average
+        :return: averaged frame, None if the averaging is off
+        """
+        if self.pending is not None:
+            self.mode, self.length = self.pending
+            self.pending=None
+            self.reset()
+        if self.mode=='Off':
+            return None
+        if frameBuffer is not self.frameBuffer:
+            # The frame buffer was (re)allocated
+            self.frameBuffer=frameBuffer
+            self.output=np.empty((frameBuffer.length,)+frameBuffer.shape, dtype=np.float32)
+            self.valid=np.zeros(frameBuffer.length, dtype=bool)
+            self.reset()
+        new=frameBuffer.data[index].reshape(-1)
+        out=self.output[index].reshape(-1)
+        if self.mode=='Rolling':
+            window=min(self.length, frameBuffer.length-1)
+            if self.total is None:
+                self.total=np.zeros(new.size)
+            if self.count<window:
+                self.count+=1
+                old=new[:0]
+            else:
+                old=frameBuffer.data[frameBuffer.slotIndex(window)].reshape(-1)
+            rollingAverage(new, old, self.total, self.count, out)
+        else:
+            if self.average is None:
+                self.average=new.astype(np.float32)
+            expAverage(new, self.average, 1.0/self.length, out)
+        self.valid[index]=True
+        return self.output[index]
+
+    def getFrame(self, index):
+        """
+        Returns the averaged frame at slot index, None if there is none
+        """
+        if self.mode=='Off' or self.valid is None or not self.valid[index]:
+            return None
+        return self.output[index]
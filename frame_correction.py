@@ -0,0 +1,153 @@
+import threading
+import os
+import numpy as np
+from numba import jit
+
+
+@jit(nopython=True, cache=True, nogil=True, fastmath=True)
+def correctFrame(raw, dark, gain, out):
+    """
+    Writes (raw-dark)*gain into out in a single pass over the flat arrays. An empty dark or gain is skipped.
+
+    :param raw: flat frame in the native dtype of the detector
+    :param dark: flat dark map (float32) or an empty array
+    :param gain: flat gain map (float32) or an empty array
+    :param out: flat float32 array receiving the corrected frame
+    """
+    n=raw.shape[0]
+    if dark.shape[0]==0:
+        for i in range(n):
+            out[i]=raw[i]*gain[i]
+    elif gain.shape[0]==0:
+        for i in range(n):
+            out[i]=raw[i]-dark[i]
+    else:
+        for i in range(n):
+            out[i]=(raw[i]-dark[i])*gain[i]
+
+
+def loadMap(fname):
+    """
+    Reads a dark or flat-field map from a .npy file or an image file. The pages of multi-page images are averaged.
+    The map has to be in the layout of the frames of the detector, as saved by the viewer.
+
+    :return: float32 array
+    """
+    if os.path.splitext(fname)[1].lower()=='.npy':
+        return np.load(fname).astype(np.float32)
+    from imageio import mimread
+    pages=mimread(fname, memtest=False)
+    data=np.zeros(pages[0].shape)
+    for page in pages:
+        data+=page
+    return (data/len(pages)).astype(np.float32)
+
+
+class FrameCorrection(object):
+    def __init__(self):
+        """
+        Dark-frame and flat-field correction of the frames, (raw-dark)*gain with gain=mean(flat-dark)/(flat-dark).
+        The maps are kept flat in the layout of the detector frames and the gain is precomputed whenever a map
+        changes, so correcting a frame is a single pass fused with its copy into the frame buffer, see
+        AD_Reader.storeFrame. The frames are only corrected if enabled is set and the maps have their shape.
+        """
+        self.enabled=False
+        self.dark=None
+        self.flat=None
+        self.maps=None
+        self.lock=threading.Lock()
+        self.darkSum=None
+        self.darkCount=0
+        self.darkFrames=0
+
+    @property
+    def shape(self):
+        """
+        Shape of the frames matching the maps, None without maps
+        """
+        maps=self.maps
+        return None if maps is None else maps[0]
+
+    def setDark(self, dark):
+        """
+        Sets the dark map, None removes it
+        """
+        self.dark=None if dark is None else np.asarray(dark, dtype=np.float32)
+        self.updateMaps()
+
+    def setFlat(self, flat):
+        """
+        Sets the flat-field map, None removes it
+        """
+        self.flat=None if flat is None else np.asarray(flat, dtype=np.float32)
+        self.updateMaps()
+
+    def updateMaps(self):
+        """
+        Precomputes the flat dark and gain maps used by correctFrame. A flat-field with another shape than the dark
+        map is ignored. Pixels without any signal in the flat-field get a gain of 0.
+        """
+        dark, flat = self.dark, self.flat
+        if flat is not None and dark is not None and flat.shape!=dark.shape:
+            flat=None
+        if dark is None and flat is None:
+            self.maps=None
+            return
+        shape=dark.shape if flat is None else flat.shape
+        empty=np.empty(0, dtype=np.float32)
+        if flat is None:
+            gain=empty
+        else:
+            signal=flat if dark is None else flat-dark
+            gain=np.zeros(signal.shape, dtype=np.float32)
+            valid=signal>0
+            if np.any(valid):
+                gain[valid]=np.mean(signal[valid])/signal[valid]
+            gain=gain.reshape(-1)
+        self.maps=(shape, empty if dark is None else dark.reshape(-1), gain)
+
+    def activeMaps(self, shape):
+        """
+        Returns the flat (dark, gain) maps for frames of the given shape, None if the frames are not corrected.
+        The maps are taken at once so that they are consistent even if they are changed from another thread.
+        """
+        maps=self.maps
+        if not self.enabled or maps is None or maps[0]!=tuple(shape):
+            return None
+        return maps[1], maps[2]
+
+    def startDarkCapture(self, nFrames):
+        """
+        Averages the next nFrames frames given to addDarkFrame into the dark map
+        """
+        with self.lock:
+            self.darkSum=None
+            self.darkCount=0
+            self.darkFrames=nFrames
+
+    @property
+    def capturing(self):
+        return self.darkFrames>0
+
+    def addDarkFrame(self, data, shape):
+        """
+        Adds the flat raw frame data of the given shape to the dark being captured. The capture starts again if
+        the shape changes.
+
+        :return: True once the dark map is set
+        """
+        with self.lock:
+            if self.darkFrames==0:
+                return False
+            if self.darkSum is None or self.darkSum.size!=data.size:
+                self.darkSum=np.zeros(data.size)
+                self.darkCount=0
+            np.add(self.darkSum, data.reshape(-1), out=self.darkSum)
+            self.darkCount+=1
+            if self.darkCount<self.darkFrames:
+                return False
+            dark=(self.darkSum/self.darkCount).astype(np.float32).reshape(shape)
+            self.darkSum=None
+            self.darkFrames=0
+        self.setDark(dark)
+        return True
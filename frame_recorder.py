@@ -0,0 +1,229 @@
+import threading
+import queue
+import time
+import os
+import shutil
+import importlib.util
+import numpy as np
+from time_series import npyHeader
+
+# Formats supported by FrameRecorder with the extensions of their files
+recordFormats={'NPY': '.npy'}
+# h5py is imported when a recording to HDF5 starts, not with the viewer
+if importlib.util.find_spec('h5py') is not None:
+    recordFormats['HDF5']='.h5'
+
+# Fields of the frame table saved along with the frames
+frameFields=[('arrayCounter', '<i8'), ('timestamp', '<f8'), ('receiveTime', '<f8')]
+
+
+class FrameRecorder(threading.Thread):
+    def __init__(self, fname, fileFormat='HDF5', maxFrames=10000, queueDepth=32, batchSize=16, compression=None,
+                 header='', stats=None):
+        """
+        Records the frames handed to add() to a file in a background thread. add() copies the frame into one of
+        queueDepth preallocated buffers and returns at once, the writer thread writes the buffers in batches of up
+        to batchSize frames and hands them back. When all the buffers are waiting to be written the frame is
+        dropped and counted instead of blocking, so that recording at the detector rate never stalls the reader,
+        the display or the analysis. The shape and the dtype of the frames are taken from the first frame, frames
+        with another shape or dtype are rejected and counted.
+
+        Every frame is saved with its ArrayCounter, the IOC timestamp of its array and the time it was received:
+
+        'HDF5': chunked dataset 'frames' with one frame per chunk and the datasets 'arrayCounter', 'timestamp' and
+        'receiveTime'
+        'NPY': .npy file preallocated for maxFrames frames and written through a memory map, readable with
+        np.load(fname, mmap_mode='r'). It is truncated to the recorded frames when closed and the frame table is
+        saved as a structured array in <name>_frames.npy.
+
+        :param fname: name of the file
+        :param fileFormat: one of recordFormats
+        :param maxFrames: number of frames after which the recording is full and further frames are ignored
+        :param queueDepth: number of frames waiting to be written at most
+        :param batchSize: number of frames written at once at most
+        :param compression: compression of the HDF5 dataset, e.g. 'lzf' or 'gzip'
+        :param header: text saved as attribute of the HDF5 datasets
+        :param stats: PipelineStats the copy ('record') and the write ('write') times per frame are added to
+        """
+        threading.Thread.__init__(self, daemon=True)
+        if fileFormat not in recordFormats:
+            raise ValueError('Unknown file format %s'%fileFormat)
+        self.fname=fname
+        self.fileFormat=fileFormat
+        self.maxFrames=maxFrames
+        self.queueDepth=queueDepth
+        self.batchSize=batchSize
+        self.compression=compression
+        self.header=header
+        self.stats=stats
+        self.shape=None
+        self.dtype=None
+        self.buffers=None
+        self.free=queue.LifoQueue()
+        self.pending=queue.Queue()
+        self.acceptedFrames=0
+        self.writtenFrames=0
+        self.droppedFrames=0
+        self.rejectedFrames=0
+        self.maxQueued=0
+        self.writtenBytes=0
+        self.full=False
+        self.closing=False
+        self.error=None
+        self.dataset=None
+        # The file is created at once so that a wrong file name is reported to the caller
+        if self.fileFormat=='HDF5':
+            import h5py
+            self.fh=h5py.File(self.fname, 'w')
+        else:
+            self.fh=open(self.fname, 'wb+')
+        self.startTime=time.time()
+        self.start()
+
+    @property
+    def queuedFrames(self):
+        return self.pending.qsize()
+
+    def queueFull(self):
+        """
+        True while all the buffers wait to be written, the next frame would be dropped
+        """
+        return self.buffers is not None and self.free.empty()
+
+    def add(self, data, counter, timestamp, receiveTime):
+        """
+        Queues a copy of the frame for writing without blocking, from a single thread
+
+        :param timestamp: IOC timestamp of the frame, nan if unknown
+        :param receiveTime: time the frame was received
+        :return: True if the frame is queued
+        """
+        if self.closing or self.full or self.error is not None:
+            return False
+        if self.shape is None:
+            self.shape=data.shape
+            self.dtype=data.dtype
+            self.buffers=np.empty((self.queueDepth,)+self.shape, dtype=self.dtype)
+            for i in range(self.queueDepth):
+                self.free.put(i)
+        elif data.shape!=self.shape or data.dtype!=self.dtype:
+            self.rejectedFrames+=1
+            return False
+        if self.acceptedFrames>=self.maxFrames:
+            self.full=True
+            return False
+        try:
+            slot=self.free.get_nowait()
+        except queue.Empty:
+            self.droppedFrames+=1
+            return False
+        t=time.perf_counter()
+        np.copyto(self.buffers[slot], data)
+        self.acceptedFrames+=1
+        self.pending.put((slot, counter, np.nan if timestamp is None else timestamp, receiveTime))
+        self.maxQueued=max(self.maxQueued, self.pending.qsize())
+        if self.stats is not None:
+            self.stats.add('record', time.perf_counter()-t)
+        return True
+
+    def close(self):
+        """
+        Writes the queued frames and closes the file
+        """
+        self.closing=True
+        self.pending.put(None)
+        self.join()
+
+    def run(self):
+        closing=False
+        while not closing:
+            item=self.pending.get()
+            if item is None:
+                break
+            batch=[item]
+            while len(batch)<self.batchSize:
+                try:
+                    item=self.pending.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    closing=True
+                    break
+                batch.append(item)
+            t=time.perf_counter()
+            if self.error is None:
+                try:
+                    self.writeFrames(batch)
+                    self.writtenFrames+=len(batch)
+                    self.writtenBytes+=len(batch)*self.buffers[0].nbytes
+                except Exception as error:
+                    self.error=error
+            for item in batch:
+                self.free.put(item[0])
+            if self.stats is not None:
+                self.stats.add('write', (time.perf_counter()-t)/len(batch))
+        try:
+            self.closeFile()
+        except Exception as error:
+            if self.error is None:
+                self.error=error
+
+    def createDatasets(self):
+        if self.fileFormat=='HDF5':
+            self.dataset=self.fh.create_dataset('frames', shape=(0,)+self.shape, maxshape=(self.maxFrames,)+self.shape,
+                                                dtype=self.dtype, chunks=(1,)+self.shape, compression=self.compression)
+            self.dataset.attrs['header']=self.header
+            self.frameTable={}
+            for name, dtype in frameFields:
+                self.frameTable[name]=self.fh.create_dataset(name, shape=(0,), maxshape=(self.maxFrames,), dtype=dtype,
+                                                             chunks=(min(self.maxFrames, 4096),))
+        else:
+            self.npyHeader=npyHeader(self.dtype, (self.maxFrames,)+self.shape)
+            size=len(self.npyHeader)+self.maxFrames*self.buffers[0].nbytes
+            # The file is sparse, writing the memory map on a full disk would crash the process
+            free=shutil.disk_usage(os.path.dirname(os.path.abspath(self.fname))).free
+            if size>free:
+                raise IOError('%d frames need %.1f GB, only %.1f GB are free'%(self.maxFrames, size/1e9, free/1e9))
+            self.fh.write(self.npyHeader)
+            self.fh.truncate(size)
+            self.fh.flush()
+            self.dataset=np.memmap(self.fh, dtype=self.dtype, mode='r+', offset=len(self.npyHeader),
+                                   shape=(self.maxFrames,)+self.shape)
+            self.frameTable=np.zeros(self.maxFrames, dtype=frameFields)
+
+    def writeFrames(self, batch):
+        if self.dataset is None:
+            self.createDatasets()
+        n=self.writtenFrames
+        if self.fileFormat=='HDF5':
+            self.dataset.resize(n+len(batch), axis=0)
+            for i, (slot, counter, timestamp, receiveTime) in enumerate(batch):
+                self.dataset[n+i]=self.buffers[slot]
+            for k, (name, dtype) in enumerate(frameFields):
+                self.frameTable[name].resize(n+len(batch), axis=0)
+                self.frameTable[name][n:]=[item[k+1] for item in batch]
+        else:
+            for i, (slot, counter, timestamp, receiveTime) in enumerate(batch):
+                self.dataset[n+i]=self.buffers[slot]
+                self.frameTable[n+i]=(counter, timestamp, receiveTime)
+
+    def closeFile(self):
+        if self.fileFormat=='HDF5':
+            if self.dataset is not None:
+                self.dataset.attrs['droppedFrames']=self.droppedFrames
+            self.fh.close()
+            return
+        if self.dataset is not None:
+            self.dataset.flush()
+            self.dataset=None
+            # The header is rewritten with the number of recorded frames and the unused frames cut off
+            header=npyHeader(self.dtype, (self.writtenFrames,)+self.shape, len(self.npyHeader)-10)
+            self.fh.seek(0)
+            self.fh.write(header)
+            self.fh.truncate(len(header)+self.writtenFrames*self.buffers[0].nbytes)
+            np.save(os.path.splitext(self.fname)[0]+'_frames.npy', self.frameTable[:self.writtenFrames])
+            self.fh.close()
+        else:
+            # Nothing was recorded, an empty file is not a valid .npy file
+            self.fh.close()
+            os.remove(self.fname)
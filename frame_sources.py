@@ -0,0 +1,503 @@
+import numpy as np
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import epics
+from epics.utils import BYTES2STR
+
+
+class FrameSource(object):
+    def __init__(self):
+        """
+        Base class of the sources of the frames read by AD_Reader. A source delivers flat arrays like the ArrayData
+        of an areaDetector. It calls notify() from its own thread or callback whenever a new frame is available and
+        AD_Reader then gets it with fetchData() in the reader thread. Sources pushing the frames keep only the
+        latest one with putData(). timestamp is the time stamp of the frame returned by the last fetchData(), the
+        IOC time stamp of the array for areaDetectors and the time it was produced otherwise. Replayed sources
+        set finished once they delivered their last frame.
+        """
+        self.sizeX=None
+        self.sizeY=None
+        self.connected=False
+        self.notify=None
+        self.sizeChanged=None
+        self.dataLock=threading.Lock()
+        self.arrayCounter=0
+        self.pendingData=None
+        self.pendingTimestamp=None
+        self.timestamp=None
+        self.finished=False
+        self.readerBusy=None
+
+    def connect(self):
+        """
+        Connects to the source and sets sizeX and sizeY. Returns True if the source is available
+        """
+        raise NotImplementedError
+
+    def start(self, notify, colorMode='Greyscale', acquisitionMode='Monitor'):
+        """
+        Starts delivering the frames
+
+        :param notify: function called whenever a new frame is available
+        :param colorMode: 'Greyscale' or 'RGB'
+        :param acquisitionMode: 'Monitor' or 'Counter', only used by EPICSSource
+        """
+        raise NotImplementedError
+
+    def stop(self):
+        raise NotImplementedError
+
+    def putData(self, data, timestamp=None):
+        with self.dataLock:
+            self.arrayCounter+=1
+            self.pendingData=data
+            self.pendingTimestamp=time.time() if timestamp is None else timestamp
+        if self.notify is not None:
+            self.notify()
+
+    def fetchData(self):
+        """
+        Returns the latest array data and its counter
+        """
+        with self.dataLock:
+            data, counter = self.pendingData, self.arrayCounter
+            self.pendingData=None
+            self.timestamp=self.pendingTimestamp
+        return data, counter
+
+    def getFrame(self):
+        """
+        Returns a single frame as a flat array outside of the acquisition, None if not available
+        """
+        return None
+
+    def setAcquire(self, acquire):
+        """
+        Starts or stops the acquisition of the detector
+        """
+        pass
+
+    def setColorMode(self, colorMode):
+        pass
+
+    def setExposureTime(self, expTime):
+        pass
+
+    def setAcquirePeriod(self, period):
+        pass
+
+    def getExposureTime(self):
+        return np.nan
+
+    def getAcquirePeriod(self):
+        return np.nan
+
+
+class EPICSSource(FrameSource):
+    def __init__(self, detPV, connectionTimeout=2.0):
+        """
+        Frames of an areaDetector IOC
+
+        :param detPV: Detector PV (example: 15PS1:)
+        :param connectionTimeout: time in seconds connect() waits for the PVs at most
+        """
+        FrameSource.__init__(self)
+        self.detPV=detPV
+        self.connectionTimeout=connectionTimeout
+        self.acquisitionMode='Monitor'
+
+    def connect(self):
+        """
+        Creates all the PVs at once, so that they connect concurrently, and waits only until the image size is
+        known or connectionTimeout passed
+        """
+        self.init_PVs()
+        deadline=time.time()+self.connectionTimeout
+        self.sizeX, self.sizeY = [pv.get(timeout=max(deadline-time.time(), 1e-3))
+                                  for pv in (self.sizeX_PV, self.sizeY_PV)]
+        self.connected = self.sizeX is not None and self.sizeY is not None
+        return self.connected
+
+    def init_PVs(self):
+        """
+        Initialize all the PVs
+        :return:
+        """
+        self.minX_PV = epics.PV(BYTES2STR(self.detPV+"cam1:MinX_RBV"), callback = self.onMinXChanged)
+        self.minY_PV = epics.PV(BYTES2STR(self.detPV+"cam1:MinY_RBV"), callback = self.onMinYChanged)
+        self.sizeX_PV = epics.PV(BYTES2STR(self.detPV+"cam1:SizeX_RBV"), callback = self.onSizeXChanged)
+        self.sizeY_PV = epics.PV(BYTES2STR(self.detPV+"cam1:SizeY_RBV"), callback = self.onSizeYChanged)
+        self.data_PV = epics.PV(BYTES2STR(self.detPV+"image1:ArrayData"))
+        self.colorMode_PV = epics.PV(BYTES2STR(self.detPV+"cam1:ColorMode_RBV"))
+        self.expTime_PV = epics.PV(BYTES2STR(self.detPV+"cam1:AcquireTime_RBV"))
+        # The PVs written with caput are created in the cache of pyepics as well, the caputs then need not connect
+        for name in ("cam1:Acquire", "cam1:ArrayCounter", "cam1:ColorMode", "cam1:BayerConvert", "cam1:AcquireTime",
+                     "cam1:AcquirePeriod"):
+            epics.get_pv(BYTES2STR(self.detPV+name))
+
+    def onMinXChanged(self, value, **kwargs):
+        self.minX=value
+
+    def onMinYChanged(self, value, **kwargs):
+        self.minY=value
+
+    def onSizeXChanged(self, value, **kwargs):
+        self.sizeX=value
+        if self.sizeChanged is not None:
+            self.sizeChanged()
+
+    def onSizeYChanged(self, value, **kwargs):
+        self.sizeY = value
+        if self.sizeChanged is not None:
+            self.sizeChanged()
+
+    def start(self, notify, colorMode='Greyscale', acquisitionMode='Monitor'):
+        """
+        Depending on acquisitionMode the frames are either
+
+        'Monitor': delivered by a monitor on ArrayData limited to SizeX*SizeY*channels elements
+        'Counter': fetched by a get of ArrayData every time ArrayCounter_RBV changes
+        """
+        self.notify=notify
+        self.acquisitionMode=acquisitionMode
+        self.arrayCounter=0
+        self.pendingData=None
+        if self.acquisitionMode=='Monitor':
+            channels = 1 if colorMode=='Greyscale' else 3
+            self.monitor_PV = epics.PV(BYTES2STR(self.detPV+"image1:ArrayData"), auto_monitor=True,
+                                       count=self.sizeX*self.sizeY*channels, callback=self.onArrayDataChanged)
+        else:
+            self.monitor_PV = epics.PV(BYTES2STR(self.detPV+"image1:ArrayCounter_RBV"),
+                                       callback=self.onArrayCounterChanged)
+
+    def stop(self):
+        try:
+            self.monitor_PV.clear_callbacks()
+            self.monitor_PV.disconnect()
+        except:
+            pass
+        self.pendingData=None
+
+    def onArrayCounterChanged(self, value, **kwargs):
+        # No CA calls are allowed within the callbacks, the frame is fetched in the reader thread
+        self.arrayCounter=value
+        self.notify()
+
+    def onArrayDataChanged(self, value, timestamp=None, **kwargs):
+        # The monitor already delivers the frame, only the latest one is kept for the reader thread
+        self.putData(value, timestamp)
+
+    def fetchData(self):
+        if self.acquisitionMode=='Monitor':
+            return FrameSource.fetchData(self)
+        data=self.data_PV.get()
+        self.timestamp=self.data_PV.timestamp
+        return data, self.arrayCounter
+
+    def getFrame(self):
+        return self.data_PV.get()
+
+    def setAcquire(self, acquire):
+        if acquire:
+            epics.caput(BYTES2STR(self.detPV + "cam1:ArrayCounter"), 0)
+            epics.caput(BYTES2STR(self.detPV + "cam1:Acquire"), 1)
+        else:
+            epics.caput(BYTES2STR(self.detPV + "cam1:Acquire"), 0)
+            epics.caput(BYTES2STR(self.detPV + "cam1:ArrayCounter"), 0)
+
+    def setColorMode(self, colorMode):
+        """
+        Switches the color mode of the detector and acquires a frame in the new mode. Nothing is done if the
+        detector is already in that mode.
+        """
+        mode=0 if colorMode=='Greyscale' else 2
+        if self.colorMode_PV.get(timeout=self.connectionTimeout)==mode:
+            return
+        if colorMode=='Greyscale':
+            epics.caput(self.detPV+'cam1:ColorMode', 0)
+            epics.caput(self.detPV+'cam1:BayerConvert', 0)
+        else:
+            epics.caput(self.detPV+'cam1:ColorMode', 2)
+            epics.caput(self.detPV + 'cam1:BayerConvert', 1)
+        self.setAcquire(True)
+        time.sleep(0.2)
+        self.setAcquire(False)
+
+    def setExposureTime(self, expTime):
+        epics.caput(self.detPV + 'cam1:AcquireTime', expTime)
+
+    def setAcquirePeriod(self, period):
+        epics.caput(self.detPV+'cam1:AcquirePeriod', period)
+
+    def getExposureTime(self):
+        expTime=self.expTime_PV.get(timeout=self.connectionTimeout)
+        return np.nan if expTime is None else expTime
+
+
+class TimedSource(FrameSource):
+    def __init__(self, rate=50.0):
+        """
+        Base class of the sources producing frames in a thread at a fixed rate, or as fast as the reader takes
+        them if the rate is 0. The next frame is then produced once the reader fetched the previous one and
+        readerBusy(), if set by the reader, returns False, so that no frame is dropped.
+
+        :param rate: frames per second
+        """
+        FrameSource.__init__(self)
+        self.rate=rate
+        self.colorMode='Greyscale'
+        self.running=False
+        self.thread=None
+
+    def start(self, notify, colorMode='Greyscale', acquisitionMode='Monitor'):
+        self.notify=notify
+        self.colorMode=colorMode
+        self.arrayCounter=0
+        self.pendingData=None
+        self.finished=False
+        self.running=True
+        self.thread=threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running=False
+        if self.thread is not None:
+            self.thread.join()
+            self.thread=None
+        self.pendingData=None
+
+    def run(self):
+        # The frames are scheduled on absolute times so that the rate does not drift with the generation time
+        nextTime=time.perf_counter()
+        while self.running:
+            data=self.generate(self.arrayCounter)
+            if data is None:
+                # End of a replay
+                self.finished=True
+                break
+            self.putData(data)
+            if self.rate<=0:
+                self.waitForReader()
+                continue
+            nextTime+=1.0/self.rate
+            wait=nextTime-time.perf_counter()
+            if wait>0:
+                time.sleep(wait)
+            else:
+                nextTime=time.perf_counter()
+
+    def waitForReader(self):
+        while self.running and (self.pendingData is not None or (self.readerBusy is not None and self.readerBusy())):
+            time.sleep(2e-4)
+
+    def generate(self, counter):
+        """
+        Returns the flat array of frame number counter, None after the last frame
+        """
+        raise NotImplementedError
+
+    def getFrame(self):
+        return self.generate(0)
+
+    def setRate(self, rate):
+        """
+        Sets the frames per second, 0 for as fast as the reader takes them
+        """
+        self.rate=max(rate, 0.0)
+
+    def setAcquirePeriod(self, period):
+        if period>0:
+            self.rate=1.0/period
+
+    def getAcquirePeriod(self):
+        return 1.0/self.rate if self.rate>0 else 0.0
+
+
+class SyntheticSource(TimedSource):
+    def __init__(self, sizeX=1360, sizeY=1024, dtype='uint16', rate=100.0, sigma=20.0, motion='jitter',
+                 amplitude=None, jitter=5.0, noise=0.02, cache=0):
+        """
+        Simulated detector with a Gaussian beam moving on a noisy background
+
+        :param sizeX, sizeY: size of the frames in pixels
+        :param dtype: data type of the frames
+        :param rate: frames per second
+        :param sigma: rms size of the beam in pixels
+        :param motion: 'jitter' (random displacements of jitter rms pixels), 'circle' (circle of radius sizeX/10
+        done in 10 s, or in 1000 frames if the rate is 0) or 'none'
+        :param amplitude: peak value of the beam, 80% of the dtype range for integer types and 1000 otherwise
+        :param jitter: rms displacement in pixels of the 'jitter' motion
+        :param noise: rms of the background noise relative to the amplitude
+        :param cache: number of frames generated at the start and then cycled, so that the rate is not limited
+        by the generation of the frames. Every frame is generated if 0.
+        """
+        TimedSource.__init__(self, rate=rate)
+        self.sizeX=int(sizeX)
+        self.sizeY=int(sizeY)
+        self.dtype=np.dtype(dtype)
+        self.sigma=sigma
+        self.motion=motion
+        if amplitude is None:
+            amplitude=0.8*np.iinfo(self.dtype).max if self.dtype.kind in 'iu' else 1000.0
+        self.amplitude=amplitude
+        self.jitter=jitter
+        self.noise=noise
+        self.cache=int(cache)
+        self.frames=None
+        self.x=np.arange(self.sizeX, dtype=np.float32)
+        self.y=np.arange(self.sizeY, dtype=np.float32)
+        self.random=np.random.default_rng(0)
+        # A few noise frames are cycled instead of drawing new random numbers for every frame
+        background=self.random.standard_normal((4, self.sizeY, self.sizeX), dtype=np.float32)
+        background+=1
+        background*=self.amplitude*self.noise
+        self.background=np.clip(background, 0, None, out=background)
+
+    def connect(self):
+        self.connected=True
+        return True
+
+    def start(self, notify, colorMode='Greyscale', acquisitionMode='Monitor'):
+        if self.cache>0 and (self.frames is None or colorMode!=self.colorMode):
+            self.frames=None
+            self.colorMode=colorMode
+            self.frames=[self.generate(i) for i in range(self.cache)]
+        TimedSource.start(self, notify, colorMode=colorMode, acquisitionMode=acquisitionMode)
+
+    def beamPosition(self, counter):
+        t=counter/(self.rate if self.rate>0 else 100.0)
+        x, y = self.sizeX/2, self.sizeY/2
+        if self.motion=='jitter':
+            dx, dy = self.jitter*self.random.standard_normal(2)
+            return x+dx, y+dy
+        elif self.motion=='circle':
+            radius=self.sizeX/10
+            return x+radius*np.cos(0.2*np.pi*t), y+radius*np.sin(0.2*np.pi*t)
+        return x, y
+
+    def generate(self, counter):
+        if self.frames is not None:
+            return self.frames[counter%len(self.frames)]
+        x, y = self.beamPosition(counter)
+        # The Gaussian is separable, the frame is the outer product of its horizontal and vertical profiles
+        profileX=np.exp(-(self.x-np.float32(x))**2/np.float32(2*self.sigma**2))
+        profileY=np.float32(self.amplitude)*np.exp(-(self.y-np.float32(y))**2/np.float32(2*self.sigma**2))
+        frame=np.multiply.outer(profileY, profileX)
+        frame+=self.background[counter%len(self.background)]
+        if self.dtype.kind in 'iu':
+            np.clip(frame, 0, np.iinfo(self.dtype).max, out=frame)
+        frame=frame.astype(self.dtype)
+        if self.colorMode!='Greyscale':
+            frame=np.repeat(frame[:, :, np.newaxis], 3, axis=2)
+        return frame.reshape(-1)
+
+
+class StackReplaySource(TimedSource):
+    def __init__(self, path, rate=10.0, loop=True, prefetch=8, dataset=None):
+        """
+        Replays a stack of frames through the pipeline, e.g. frames recorded by FrameRecorder. The stack is opened
+        lazily, see frame_stacks.openStack: memory-mappable files are mapped instead of loaded and the next
+        prefetch frames are read ahead in a background thread, so that a replay as fast as possible is limited by
+        the disk rather than by the reading of the files.
+
+        :param path: directory or glob pattern of image files, multi-page TIFF, HDF5 or .npy file
+        :param rate: frames per second, 0 replays every frame as fast as the reader takes it
+        :param loop: starts again with the first frame after the last one, otherwise the replay stops and
+        finished is set
+        :param prefetch: number of frames read ahead
+        :param dataset: HDF5 dataset of the frames
+        """
+        TimedSource.__init__(self, rate=rate)
+        self.path=path
+        self.loop=loop
+        self.prefetch=int(prefetch)
+        self.dataset=dataset
+        self.stack=None
+        self.prefetched={}
+        self.readPool=None
+
+    def connect(self):
+        from frame_stacks import openStack
+        try:
+            self.stack=openStack(self.path, self.dataset)
+        except (IOError, OSError, ValueError, KeyError):
+            return False
+        self.nFrames=len(self.stack)
+        self.sizeY, self.sizeX = self.stack.shape[:2]
+        self.connected=True
+        return True
+
+    def start(self, notify, colorMode='Greyscale', acquisitionMode='Monitor'):
+        self.prefetched={}
+        self.readPool=ThreadPoolExecutor(max_workers=1)
+        TimedSource.start(self, notify, colorMode=colorMode, acquisitionMode=acquisitionMode)
+
+    def stop(self):
+        TimedSource.stop(self)
+        for future in self.prefetched.values():
+            future.cancel()
+        self.prefetched={}
+        if self.readPool is not None:
+            self.readPool.shutdown(wait=True)
+            self.readPool=None
+
+    def generate(self, counter):
+        if counter>=self.nFrames and not self.loop:
+            return None
+        index=counter%self.nFrames
+        future=self.prefetched.pop(index, None)
+        if future is None:
+            future=self.readPool.submit(self.stack.readFrame, index)
+        for i in range(counter+1, counter+1+self.prefetch):
+            if i>=self.nFrames and not self.loop:
+                break
+            if i%self.nFrames not in self.prefetched:
+                self.prefetched[i%self.nFrames]=self.readPool.submit(self.stack.readFrame, i%self.nFrames)
+        return np.ascontiguousarray(future.result()).reshape(-1)
+
+    def getFrame(self):
+        return self.stack.readFrame(0).reshape(-1)
+
+
+def parseOptions(options):
+    """
+    Parses 'key=value,key=value' options of a source into a dictionary of numbers and strings. A size option
+    'WIDTHxHEIGHT' is split into sizeX and sizeY.
+    """
+    kwargs={}
+    for option in options.split(','):
+        if option.strip()=='':
+            continue
+        key, value = option.split('=', 1)
+        key, value = key.strip(), value.strip()
+        if key=='size':
+            kwargs['sizeX'], kwargs['sizeY'] = [int(v) for v in value.lower().split('x')]
+            continue
+        try:
+            value=float(value)
+        except ValueError:
+            if value.lower() in ('true', 'false'):
+                value=value.lower()=='true'
+        kwargs[key]=value
+    return kwargs
+
+
+def frameSource(detPV):
+    """
+    Returns the frame source for a detector PV. Besides areaDetector PVs two prefixes select the other sources:
+
+    sim:[size=WIDTHxHEIGHT,dtype=uint16,rate=100,sigma=20,motion=jitter,...]  simulated Gaussian beam
+    tiff:PATTERN[,rate=10,loop=true]  replay of TIFF files
+    replay:PATH[,rate=0,loop=false,prefetch=8,dataset=frames]  replay of a stack, every frame as fast as possible
+    by default, see StackReplaySource
+    """
+    if detPV.startswith('sim:'):
+        return SyntheticSource(**parseOptions(detPV[4:]))
+    elif detPV.startswith('tiff:') or detPV.startswith('replay:'):
+        prefix, values = detPV.split(':', 1)
+        values=values.split(',', 1)
+        options={'rate': 0.0, 'loop': False} if prefix=='replay' else {}
+        options.update(parseOptions(values[1] if len(values)>1 else ''))
+        return StackReplaySource(values[0], **options)
+    return EPICSSource(detPV)
@@ -0,0 +1,167 @@
+import os
+import glob
+import numpy as np
+
+# Extensions of the files opened as stacks, directories are searched for TIFF files
+stackExtensions=['.tif', '.tiff', '.h5', '.hdf5', '.npy']
+
+
+class FrameStack(object):
+    def __init__(self, nFrames, shape, dtype):
+        """
+        Base class of the stacks of frames read lazily, one frame at a time with readFrame()
+
+        :param nFrames: number of frames
+        :param shape: shape of a frame, (sizeY, sizeX) or (sizeY, sizeX, 3)
+        :param dtype: data type of the frames
+        """
+        self.nFrames=nFrames
+        self.shape=tuple(shape)
+        self.dtype=np.dtype(dtype)
+
+    def __len__(self):
+        return self.nFrames
+
+    def readFrame(self, index):
+        """
+        Returns frame number index as an array owning its data
+        """
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class ArrayStack(FrameStack):
+    def __init__(self, array):
+        """
+        Stack of the frames along the first axis of a memory-mapped array. Reading a frame copies its pages from
+        the file.
+        """
+        FrameStack.__init__(self, array.shape[0], array.shape[1:], array.dtype)
+        self.array=array
+
+    def readFrame(self, index):
+        return np.array(self.array[index])
+
+    def close(self):
+        self.array=None
+
+
+class HDF5Stack(FrameStack):
+    def __init__(self, fname, dataset=None):
+        """
+        Stack of the frames of an HDF5 dataset, by default the dataset 'frames' written by FrameRecorder or else
+        the first dataset with at least three dimensions
+        """
+        try:
+            import h5py
+        except ImportError:
+            raise IOError('h5py is needed to read %s'%fname)
+        self.fh=h5py.File(fname, 'r')
+        if dataset is None:
+            if 'frames' in self.fh:
+                dataset='frames'
+            else:
+                names=[]
+                self.fh.visititems(lambda name, item: names.append(name)
+                                   if isinstance(item, h5py.Dataset) and item.ndim>=3 else None)
+                if len(names)==0:
+                    self.fh.close()
+                    raise ValueError('%s has no stack of frames'%fname)
+                dataset=names[0]
+        self.dataset=self.fh[dataset]
+        FrameStack.__init__(self, self.dataset.shape[0], self.dataset.shape[1:], self.dataset.dtype)
+
+    def readFrame(self, index):
+        frame=np.empty(self.shape, dtype=self.dtype)
+        self.dataset.read_direct(frame, np.s_[index])
+        return frame
+
+    def close(self):
+        self.fh.close()
+
+
+class TIFFPageStack(FrameStack):
+    def __init__(self, tif):
+        """
+        Stack of the pages of a multi-page TIFF file which cannot be memory mapped, e.g. compressed pages
+        """
+        page=tif.pages[0]
+        FrameStack.__init__(self, len(tif.pages), page.shape, page.dtype)
+        self.tif=tif
+
+    def readFrame(self, index):
+        return self.tif.pages[index].asarray()
+
+    def close(self):
+        self.tif.close()
+
+
+class FileStack(FrameStack):
+    def __init__(self, files):
+        """
+        Stack of single-frame image files read one by one
+        """
+        self.files=files
+        frame=self.readFrame(0)
+        FrameStack.__init__(self, len(files), frame.shape, frame.dtype)
+
+    def readFrame(self, index):
+        fname=self.files[index]
+        if os.path.splitext(fname)[1].lower() in ('.tif', '.tiff'):
+            import tifffile
+            return tifffile.imread(fname)
+        from imageio import imread
+        return np.asarray(imread(fname))
+
+
+def openTIFF(fname):
+    """
+    Opens a TIFF file as a stack of its pages, memory mapped if its pages are stored contiguously and uncompressed
+    """
+    import tifffile
+    tif=tifffile.TiffFile(fname)
+    pageShape=tif.pages[0].shape
+    nPages=len(tif.pages)
+    try:
+        array=tifffile.memmap(fname, mode='r')
+    except ValueError:
+        array=None
+    if array is None or array.size!=nPages*np.prod(pageShape):
+        return TIFFPageStack(tif)
+    tif.close()
+    return ArrayStack(array.reshape((nPages,)+pageShape))
+
+
+def openStack(path, dataset=None):
+    """
+    Opens a stack of frames without loading it:
+
+    directory: its TIFF files in alphabetical order
+    glob pattern: the matching files in alphabetical order
+    multi-page TIFF file: its pages, memory mapped if possible
+    HDF5 file: the frames of a dataset, see HDF5Stack
+    .npy file: the frames along its first axis, memory mapped
+
+    :param dataset: name of the HDF5 dataset
+    :return: FrameStack
+    """
+    if os.path.isdir(path):
+        files=sorted(glob.glob(os.path.join(path, '*.tif'))+glob.glob(os.path.join(path, '*.tiff')))
+    else:
+        files=sorted(glob.glob(path))
+    if len(files)==0:
+        raise IOError('No frames found in %s'%path)
+    if len(files)>1:
+        return FileStack(files)
+    fname=files[0]
+    extension=os.path.splitext(fname)[1].lower()
+    if extension=='.npy':
+        array=np.load(fname, mmap_mode='r')
+        return ArrayStack(array[np.newaxis] if array.ndim==2 else array)
+    elif extension in ('.h5', '.hdf5'):
+        return HDF5Stack(fname, dataset)
+    elif extension in ('.tif', '.tiff'):
+        return openTIFF(fname)
+    return FileStack(files)
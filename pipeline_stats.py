@@ -0,0 +1,102 @@
+import threading
+import time
+import os
+from collections import deque, OrderedDict
+import numpy as np
+
+
+class PipelineStats(object):
+    def __init__(self, window=500):
+        """
+        Rolling timings of the stages of the pipeline and frame counters. The timings are added from any thread,
+        typically as
+            t=time.perf_counter()
+            ...
+            stats.add('stage', time.perf_counter()-t)
+
+        :param window: number of the latest timings kept for every stage
+        """
+        self.window=window
+        self.lock=threading.Lock()
+        self.timings=OrderedDict()
+        self.counters=OrderedDict()
+        self.startTime=time.time()
+
+    def add(self, stage, duration):
+        """
+        Adds the duration in seconds of a stage
+        """
+        try:
+            self.timings[stage].append(duration)
+        except KeyError:
+            with self.lock:
+                self.timings.setdefault(stage, deque(maxlen=self.window)).append(duration)
+
+    def count(self, name, n=1):
+        with self.lock:
+            self.counters[name]=self.counters.get(name, 0)+n
+
+    def setCount(self, name, value):
+        with self.lock:
+            self.counters[name]=value
+
+    def clear(self):
+        with self.lock:
+            self.timings.clear()
+            self.counters.clear()
+            self.startTime=time.time()
+
+    def summary(self):
+        """
+        Returns a dictionary with the number of timings, their mean, median, 99th percentile and maximum in seconds
+        for every stage
+        """
+        with self.lock:
+            timings=[(stage, np.array(list(values))) for stage, values in self.timings.items()]
+        summary=OrderedDict()
+        for stage, values in timings:
+            if len(values)==0:
+                continue
+            summary[stage]={'count': len(values), 'mean': values.mean(), 'p50': np.percentile(values, 50),
+                            'p99': np.percentile(values, 99), 'max': values.max()}
+        return summary
+
+    def formatText(self):
+        """
+        Returns the counters and the timings in ms as lines of text for the performance overlay
+        """
+        with self.lock:
+            counters=list(self.counters.items())
+        lines=[', '.join(['%s: %d'%(name.capitalize(), value) for name, value in counters])]
+        lines.append('%-10s %7s %7s %7s'%('Stage', 'mean', 'p99', 'max'))
+        for stage, values in self.summary().items():
+            lines.append('%-10s %7.2f %7.2f %7.2f'%(stage, 1e3*values['mean'], 1e3*values['p99'], 1e3*values['max']))
+        return '\n'.join(lines)
+
+    def writeMetrics(self, fname, prefix='dynamicad', detector=None):
+        """
+        Writes the counters and the timings to fname in the Prometheus text format, as read by the textfile
+        collector of the node exporter. The file is replaced atomically.
+
+        :param detector: detector PV added as label to every metric, so that the metrics of several detectors can
+        be told apart
+        """
+        summary=self.summary()
+        with self.lock:
+            counters=list(self.counters.items())
+        label='' if detector is None else 'detector="%s",'%detector
+        lines=['# TYPE %s_frames_total counter'%prefix]
+        for name, value in counters:
+            lines.append('%s_frames_total{%skind="%s"} %d'%(prefix, label, name, value))
+        lines.append('# TYPE %s_stage_seconds summary'%prefix)
+        for stage, values in summary.items():
+            for quantile, key in (('0.5', 'p50'), ('0.99', 'p99'), ('1', 'max')):
+                lines.append('%s_stage_seconds{%sstage="%s",quantile="%s"} %.9g'%(prefix, label, stage, quantile,
+                                                                                  values[key]))
+            lines.append('%s_stage_seconds_mean{%sstage="%s"} %.9g'%(prefix, label, stage, values['mean']))
+        lines.append('%s_uptime_seconds%s %.3f'%(prefix, '' if detector is None else '{%s}'%label[:-1],
+                                                 time.time()-self.startTime))
+        tmpName=fname+'.tmp'
+        with open(tmpName, 'w') as fh:
+            fh.write('\n'.join(lines)+'\n')
+        os.replace(tmpName, fname)
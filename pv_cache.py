@@ -0,0 +1,96 @@
+import threading
+import time
+import numpy as np
+import epics
+from epics.utils import BYTES2STR
+
+# Readbacks saved along with the time series unless a monitor PV file is loaded
+defaultPVs=[('m1', '15IDA:m1.REP'),
+            ('m2', '15IDA:m2.REP'),
+            ('m3', '15IDA:m3.REP'),
+            ('m4', '15IDA:m4.REP'),
+            ('m5', '15IDA:m5.REP'),
+            ('m6', '15IDA:m6.REP'),
+            ('monB', '15IDB:scaler1.S2')]
+
+
+def readPVFile(fname):
+    """
+    Reads a monitor PV file with one 'name<TAB>PV' pair per line. Lines starting with # are ignored.
+    :return: list of (name, PV) tuples
+    """
+    pvs=[]
+    with open(fname, 'r') as fh:
+        for line in fh.readlines():
+            line=line.strip()
+            if line=='' or line[0]=='#':
+                continue
+            values=line.split()
+            if len(values)==1:
+                pvs.append((values[0], values[0]))
+            else:
+                pvs.append((values[0], values[1]))
+    return pvs
+
+
+class PVCache(object):
+    def __init__(self, pvs=None):
+        """
+        Latest values of a list of PVs kept up to date by monitors, so that reading them never blocks
+
+        :param pvs: list of (name, PV) tuples, defaultPVs if None
+        """
+        self.lock=threading.Lock()
+        self.pvs=[]
+        self.setPVs(pvs)
+
+    def setPVs(self, pvs):
+        """
+        Replaces the monitored PVs, defaultPVs if pvs is None. The connections are made in the background.
+        """
+        if pvs is None:
+            pvs=defaultPVs
+        self.close()
+        with self.lock:
+            self.names=[name for name, pvname in pvs]
+            self.values={name: np.nan for name in self.names}
+            self.updateTimes={name: np.nan for name in self.names}
+            self.pvnames={}
+            for name, pvname in pvs:
+                self.pvnames[BYTES2STR(pvname)]=name
+        self.pvs=[epics.PV(BYTES2STR(pvname), auto_monitor=True, callback=self.onValueChanged,
+                           connection_callback=self.onConnectionChanged) for name, pvname in pvs]
+
+    def onValueChanged(self, pvname=None, value=None, **kwargs):
+        name=self.pvnames.get(pvname)
+        if name is None or value is None:
+            return
+        with self.lock:
+            self.values[name]=value
+            self.updateTimes[name]=time.time()
+
+    def onConnectionChanged(self, pvname=None, conn=None, **kwargs):
+        name=self.pvnames.get(pvname)
+        if not conn and name is not None:
+            with self.lock:
+                self.values[name]=np.nan
+                self.updateTimes[name]=np.nan
+
+    def getValues(self):
+        """
+        Returns the latest values of all the PVs and their ages in seconds. Disconnected PVs give nan.
+        """
+        t=time.time()
+        with self.lock:
+            values=[self.values[name] for name in self.names]
+            ages=[t-self.updateTimes[name] for name in self.names]
+        return values, ages
+
+    def close(self):
+        for pv in self.pvs:
+            try:
+                pv.clear_callbacks()
+                pv.disconnect()
+            except:
+                pass
+        self.pvs=[]
@@ -24,9 +24,10 @@ class PVText(QLabel):
             self.pv.remove_callback(self.cb_index)
 
         self.pv = epics.PV(BYTES2STR(pvname))
-        self.setText(self.pv.get(as_string=True))
-        self.cb_index = self.pv.add_callback(self.onPVChange)
+        self.setText('')
+        # The text is set by the first monitor update instead of waiting here for the PV to connect
         self.pvChanging.connect(self.updatePV)
+        self.cb_index = self.pv.add_callback(self.onPVChange, run_now=self.pv.connected)
 
     def onPVChange(self, pvname=None, value=None, char_value=None, **kws):
         self.pvChanging.emit(char_value, value)
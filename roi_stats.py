@@ -0,0 +1,285 @@
+import threading
+import time
+import numpy as np
+from numba import jit
+from beam_analysis import channelWeights
+
+# Statistics of every ROI in the order of the columns returned by ROIStatistics.compute
+roiQuantities=['sum', 'mean', 'x', 'y', 'sigmaX', 'sigmaY']
+
+
+# Largest block of pixels covered by the summed-area tables, i.e. 40 MB of tables per thread of the analysis pool.
+# The ROIs of larger blocks are summed directly.
+maxTablePixels=1<<20
+
+
+@jit(nopython=True, cache=True, nogil=True, fastmath=True)
+def integralImages(data, weights, row0, col0, tables):
+    """
+    Summed-area tables of the moments of a 3D frame over the block of tables.shape[0]-1 rows and
+    tables.shape[1]-1 columns starting at (row0, col0), in a single pass over the block. tables[r, c] holds the
+    sums of I, col*I, row*I, col**2*I and row**2*I over the pixels above and left of (row0+r, col0+c), with I the
+    weighted sum of the channels and row, col the indices relative to (row0, col0), which keeps the second moments
+    small within the block.
+
+    :param data: 3D frame, 2D frames are passed as data[:, :, np.newaxis] with weights [1.0]
+    :param weights: weights of the channels
+    :param tables: float64 array of shape (rows+1, columns+1, 5)
+    """
+    nr=tables.shape[0]-1
+    nc=tables.shape[1]-1
+    nk=data.shape[2]
+    tables[0, :, :]=0.0
+    for r in range(nr):
+        row=float(r)
+        s0=0.0
+        s1=0.0
+        s3=0.0
+        tables[r+1, 0, :]=0.0
+        for c in range(nc):
+            col=float(c)
+            value=0.0
+            for k in range(nk):
+                value+=weights[k]*data[row0+r, col0+c, k]
+            s0+=value
+            s1+=value*col
+            s3+=value*col*col
+            tables[r+1, c+1, 0]=tables[r, c+1, 0]+s0
+            tables[r+1, c+1, 1]=tables[r, c+1, 1]+s1
+            tables[r+1, c+1, 2]=tables[r, c+1, 2]+s0*row
+            tables[r+1, c+1, 3]=tables[r, c+1, 3]+s3
+            tables[r+1, c+1, 4]=tables[r, c+1, 4]+s0*row*row
+
+
+@jit(nopython=True, cache=True, nogil=True)
+def roiStatistics(tables, row0, col0, rects, out):
+    """
+    Statistics of rectangular ROIs from the summed-area tables of integralImages, in O(1) per ROI
+
+    :param rects: int array of shape (n, 4) with the first row, the row after the last one, the first column and
+    the column after the last one of every ROI in the frame
+    :param out: float64 array of shape (n, 6) receiving the sum, the mean, the centroid along the columns and the
+    rows and the standard deviations along the columns and the rows, nan for empty ROIs
+    """
+    nr=tables.shape[0]-1
+    nc=tables.shape[1]-1
+    for i in range(rects.shape[0]):
+        r0=min(max(rects[i, 0]-row0, 0), nr)
+        r1=min(max(rects[i, 1]-row0, r0), nr)
+        c0=min(max(rects[i, 2]-col0, 0), nc)
+        c1=min(max(rects[i, 3]-col0, c0), nc)
+        area=(r1-r0)*(c1-c0)
+        if area==0:
+            out[i, :]=np.nan
+            continue
+        s=np.empty(5)
+        for k in range(5):
+            s[k]=tables[r1, c1, k]-tables[r0, c1, k]-tables[r1, c0, k]+tables[r0, c0, k]
+        out[i, 0]=s[0]
+        out[i, 1]=s[0]/area
+        if s[0]==0.0:
+            out[i, 2:]=np.nan
+            continue
+        col=s[1]/s[0]
+        row=s[2]/s[0]
+        out[i, 2]=col0+col
+        out[i, 3]=row0+row
+        out[i, 4]=np.sqrt(max(s[3]/s[0]-col*col, 0.0))
+        out[i, 5]=np.sqrt(max(s[4]/s[0]-row*row, 0.0))
+
+
+@jit(nopython=True, cache=True, nogil=True)
+def directStatistics(data, weights, rects, out):
+    """
+    Same as roiStatistics summed directly over the pixels of every ROI, in two passes so that the standard
+    deviations are taken around the centroid
+
+    :param data: 3D frame, 2D frames are passed as data[:, :, np.newaxis] with weights [1.0]
+    """
+    nk=data.shape[2]
+    for i in range(rects.shape[0]):
+        r0=min(max(rects[i, 0], 0), data.shape[0])
+        r1=min(max(rects[i, 1], r0), data.shape[0])
+        c0=min(max(rects[i, 2], 0), data.shape[1])
+        c1=min(max(rects[i, 3], c0), data.shape[1])
+        area=(r1-r0)*(c1-c0)
+        if area==0:
+            out[i, :]=np.nan
+            continue
+        s0=0.0
+        s1=0.0
+        s2=0.0
+        for r in range(r0, r1):
+            for c in range(c0, c1):
+                value=0.0
+                for k in range(nk):
+                    value+=weights[k]*data[r, c, k]
+                s0+=value
+                s1+=value*(c-c0)
+                s2+=value*(r-r0)
+        out[i, 0]=s0
+        out[i, 1]=s0/area
+        if s0==0.0:
+            out[i, 2:]=np.nan
+            continue
+        col=s1/s0
+        row=s2/s0
+        s3=0.0
+        s4=0.0
+        for r in range(r0, r1):
+            for c in range(c0, c1):
+                value=0.0
+                for k in range(nk):
+                    value+=weights[k]*data[r, c, k]
+                s3+=value*(c-c0-col)**2
+                s4+=value*(r-r0-row)**2
+        out[i, 2]=c0+col
+        out[i, 3]=r0+row
+        out[i, 4]=np.sqrt(max(s3/s0, 0.0))
+        out[i, 5]=np.sqrt(max(s4/s0, 0.0))
+
+
+def boxArea(box):
+    return (box[1]-box[0])*(box[3]-box[2])
+
+
+def roiClusters(rects):
+    """
+    Groups the ROIs whose common bounding box is not larger than their own boxes, so that overlapping and adjacent
+    ROIs share summed-area tables while distant ROIs get tables of their own
+
+    :param rects: int array of shape (n, 4) as taken by roiStatistics
+    :return: list of (indices of the ROIs, bounding box (row start, row stop, column start, column stop))
+    """
+    clusters=[([i], tuple(int(value) for value in rect)) for i, rect in enumerate(rects)]
+    merged=True
+    while merged:
+        merged=False
+        for a in range(len(clusters)):
+            for b in range(a+1, len(clusters)):
+                boxA, boxB = clusters[a][1], clusters[b][1]
+                box=(min(boxA[0], boxB[0]), max(boxA[1], boxB[1]), min(boxA[2], boxB[2]), max(boxA[3], boxB[3]))
+                if boxArea(box)<=boxArea(boxA)+boxArea(boxB):
+                    clusters[a]=(clusters[a][0]+clusters[b][0], box)
+                    del clusters[b]
+                    merged=True
+                    break
+            if merged:
+                break
+    return clusters
+
+
+def roiValues(stats, pixelSize):
+    """
+    Returns the statistics of the ROIs returned by ROIStatistics.compute as a list of values for the time series,
+    positions and sizes in mm, see time_series.roiColumns
+    """
+    values=stats.copy()
+    values[:, 2:]*=1e3*pixelSize
+    return values.reshape(-1).tolist()
+
+
+def readROIFile(fname):
+    """
+    Reads the ROIs from a file with one 'name x0 y0 x1 y1' line per ROI in pixels of the displayed image. The
+    lines starting with # are skipped.
+
+    :return: list of (name, (x0, y0, x1, y1)) tuples
+    """
+    rois=[]
+    with open(fname, 'r') as fh:
+        for line in fh:
+            line=line.strip()
+            if line=='' or line.startswith('#'):
+                continue
+            values=line.split()
+            rois.append((values[0], tuple(int(float(value)) for value in values[1:5])))
+    return rois
+
+
+def writeROIFile(fname, rois):
+    with open(fname, 'w') as fh:
+        fh.write('# ROI file saved on %s\n'%time.ctime())
+        fh.write('#name x0 y0 x1 y1\n')
+        for name, rect in rois:
+            fh.write('%s %d %d %d %d\n'%((name,)+tuple(rect)))
+
+
+class ROIStatistics(object):
+    def __init__(self, rois=()):
+        """
+        Sum, mean, centroid and size of any number of rectangular ROIs of every frame. The summed-area tables of
+        the moments of the frame are built once per frame over the bounding box of every cluster of ROIs, see
+        roiClusters, and every ROI is then read from them in O(1), so tens of overlapping ROIs cost about the same
+        as one. Clusters larger than maxTablePixels are summed directly. compute() runs in the threads of the
+        analysis pool, each of them keeps its own tables of at most maxTablePixels.
+
+        :param rois: list of (name, (x0, y0, x1, y1)) tuples with the ROIs in pixels of the displayed image, x1 and
+        y1 excluded
+        """
+        self.local=threading.local()
+        self.setROIs(rois)
+
+    def setROIs(self, rois):
+        self.rois=[(name, tuple(int(value) for value in rect)) for name, rect in rois]
+        self.names=[name for name, rect in self.rois]
+        # ROIs in the frame and their clusters for the shape of the frames and the orientation they were made for
+        self.clusters=None
+
+    def __len__(self):
+        return len(self.rois)
+
+    def compute(self, data, orientation, weights=None):
+        """
+        Statistics of the ROIs in the frame data displayed with orientation
+
+        :param weights: weights of the channels of RGB frames, luminance by default
+        :return: array of shape (number of ROIs, 6) with the roiQuantities of every ROI, positions and sizes in
+        pixels of the displayed image
+        """
+        rois=self.rois
+        out=np.full((len(rois), len(roiQuantities)), np.nan)
+        if len(rois)==0:
+            return out
+        key=(rois, data.shape, orientation.name)
+        cached=self.clusters
+        if cached is None or cached[0]!=key:
+            rects=np.zeros((len(rois), 4), dtype=np.int64)
+            for i, (name, (x0, y0, x1, y1)) in enumerate(rois):
+                rowBand, colBand = orientation.rawBands(data.shape, min(x0, x1), max(x0, x1), min(y0, y1),
+                                                        max(y0, y1))
+                rects[i]=rowBand+colBand
+            cached=(key, rects, roiClusters(rects))
+            self.clusters=cached
+        key, rects, clusters = cached
+        if data.ndim==2:
+            frame=data[:, :, np.newaxis]
+            weights=np.ones(1)
+        else:
+            frame=data
+            if weights is None:
+                weights=channelWeights['Luminance']
+        for indices, (row0, row1, col0, col1) in clusters:
+            clusterRects=rects[indices]
+            clusterOut=np.empty((len(indices), len(roiQuantities)))
+            if (row1-row0)*(col1-col0)>maxTablePixels:
+                directStatistics(frame, weights, clusterRects, clusterOut)
+            else:
+                shape=(row1-row0+1, col1-col0+1, 5)
+                tables=getattr(self.local, 'tables', None)
+                if tables is None or tables.size<np.prod(shape):
+                    tables=np.empty(np.prod(shape))
+                    self.local.tables=tables
+                tables=tables[:np.prod(shape)].reshape(shape)
+                integralImages(frame, weights, row0, col0, tables)
+                roiStatistics(tables, row0, col0, clusterRects, clusterOut)
+            out[indices]=clusterOut
+        # Columns and rows of the frame to x and y of the displayed image
+        sizeX, sizeY = orientation.displayShape(data.shape)
+        if orientation.transpose:
+            out[:, [2, 3, 4, 5]]=out[:, [3, 2, 5, 4]]
+        if orientation.flipX:
+            out[:, 2]=sizeX-1-out[:, 2]
+        if orientation.flipY:
+            out[:, 3]=sizeY-1-out[:, 3]
+        return out
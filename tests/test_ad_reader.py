@@ -0,0 +1,82 @@
+import os
+import sys
+import threading
+import time
+import numpy as np
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from pyqtgraph.Qt import QtCore
+from frame_sources import FrameSource
+from ad_reader import AD_Reader, releaseFrame
+from beam_analysis import warmUp
+
+
+class CounterSource(FrameSource):
+    """
+    Source of 8x8 frames filled with their counter, pushed by the test
+    """
+    def connect(self):
+        self.sizeX=8
+        self.sizeY=8
+        self.connected=True
+        return True
+
+    def start(self, notify, colorMode='Greyscale', acquisitionMode='Monitor'):
+        self.notify=notify
+
+    def stop(self):
+        self.pendingData=None
+
+    def push(self, value):
+        self.putData(np.full(64, value, dtype=np.uint16))
+        # Waits until the reader fetched the frame
+        while self.pendingData is not None:
+            time.sleep(1e-4)
+
+
+def slowAnalysis(data, counter):
+    time.sleep(0.005)
+    return data.min(), data.max()
+
+
+def test_frame_slots_are_not_overwritten_while_in_use():
+    app=QtCore.QCoreApplication.instance() or QtCore.QCoreApplication([])
+    # Compiling the kernels with an empty numba cache would stall the frames for seconds
+    warmUp().result()
+    source=CounterSource()
+    reader=AD_Reader('test:', source=source)
+    reader.bufferLength=4
+    reader.analyze=slowAnalysis
+    reader.startAcquisition()
+    consumed=[]
+    stop=threading.Event()
+
+    def consume():
+        # A slow consumer holding every frame for a while, the reader wraps around the 4 slots many times
+        held=None
+        while not stop.is_set() or len(reader.frameQueue.frames)>0:
+            for frame in reader.frameQueue.getAll():
+                time.sleep(0.003)
+                low, high = frame['analysis'].result()
+                consumed.append((frame['counter'], low, high, frame['greyData'].min(), frame['greyData'].max()))
+                if held is not None:
+                    releaseFrame(held)
+                held=frame
+            time.sleep(1e-3)
+        releaseFrame(held)
+
+    consumer=threading.Thread(target=consume)
+    consumer.start()
+    for value in range(1, 201):
+        source.push(value)
+        time.sleep(0.002)
+    time.sleep(0.05)
+    stop.set()
+    consumer.join()
+    reader.stopAcquisition()
+    assert len(consumed)>20
+    assert reader.overrunFrames>0
+    assert reader.receivedFrames==200
+    for counter, low, high, greyLow, greyHigh in consumed:
+        assert low==high==greyLow==greyHigh==counter
+    assert reader.receivedFrames==len(consumed)+reader.droppedFrames
+    assert np.all(reader.frameBuffer.holds==0)
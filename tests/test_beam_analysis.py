@@ -0,0 +1,147 @@
+import os
+import sys
+import numpy as np
+import pytest
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from beam_analysis import (Orientation, PeakFitter, ProjectionCache, bandCuts, bandCutsRGB, channelWeights,
+                           fwhmFactor, gaussianFit)
+
+
+def baselineImage(data, orientation):
+    """
+    Displayed image with the x-axis along axis 0 and the y-axis, pointing upwards, along axis 1 as np.rot90 gave it
+    to the cut code of the viewer
+    """
+    image=data.T if orientation.transpose else data
+    if orientation.flipX:
+        image=image[:, ::-1]
+    if orientation.flipY:
+        image=image[::-1]
+    return image.T
+
+
+def baselineCuts(image, left, right, up, down):
+    return np.sum(image[left:right, :], axis=0), np.sum(image[:, up:down], axis=1)
+
+
+def test_baseline_image_of_the_normal_orientation_is_rot90():
+    data=np.arange(12).reshape(3, 4)
+    assert np.array_equal(baselineImage(data, Orientation('Normal')), np.rot90(data, k=-1, axes=(0, 1)))
+
+
+@pytest.mark.parametrize('order', ['C', 'F'])
+def test_band_cuts_match_numpy(order):
+    data=np.asarray(np.random.RandomState(0).randint(0, 65536, size=(70, 90)).astype(np.uint16), order=order)
+    for left, right, up, down in [(10, 25, 30, 41), (0, 70, 0, 90), (-5, 3, 85, 200), (40, 40, 12, 13)]:
+        verCut, horCut = bandCuts(data, left, right, up, down)
+        refVer, refHor = baselineCuts(data.astype(float), max(left, 0), right, max(up, 0), down)
+        assert np.array_equal(verCut, refVer)
+        assert np.array_equal(horCut, refHor)
+
+
+def test_rgb_band_cuts_match_numpy():
+    data=np.random.RandomState(1).randint(0, 256, size=(50, 40, 3)).astype(np.uint8)
+    weights=channelWeights['Luminance']
+    verCut, horCut = bandCutsRGB(data, 5, 17, 20, 33, weights)
+    refVer, refHor = baselineCuts(np.dot(data, weights), 5, 17, 20, 33)
+    assert np.allclose(verCut, refVer, rtol=1e-12)
+    assert np.allclose(horCut, refHor, rtol=1e-12)
+
+
+@pytest.mark.parametrize('name', list(Orientation.orientations.keys()))
+@pytest.mark.parametrize('rgb', [False, True])
+def test_oriented_cuts_match_the_baseline(name, rgb):
+    shape=(48, 64, 3) if rgb else (48, 64)
+    data=np.random.RandomState(2).randint(0, 4096, size=shape).astype(np.uint16)
+    orientation=Orientation(name)
+    weights=channelWeights['Luminance']
+    image=baselineImage(np.dot(data, weights) if rgb else data.astype(float), orientation)
+    assert orientation.displayShape(data.shape)==image.shape
+    projections=ProjectionCache(data)
+    for left, right, up, down in [(3, 14, 20, 29), (0, 5, 30, 60), (image.shape[0]-4, image.shape[0], 0, 2)]:
+        refVer, refHor = baselineCuts(image, left, right, up, down)
+        verCut, horCut = orientation.cuts(data, left, right, up, down)
+        assert np.allclose(verCut, refVer, rtol=1e-12)
+        assert np.allclose(horCut, refHor, rtol=1e-12)
+        # Same cuts from the projections while the ROI is dragged
+        assert np.allclose(orientation.verCut(projections, left, right), refVer, rtol=1e-12)
+        assert np.allclose(orientation.horCut(projections, up, down), refHor, rtol=1e-12)
+
+
+@pytest.mark.parametrize('dtype', [np.uint8, np.uint16, np.float32])
+def test_projection_cache_matches_numpy(dtype):
+    data=(1000*np.random.RandomState(3).random_sample((30, 40))).astype(dtype)
+    projections=ProjectionCache(data)
+    bands=[(4, 9), (4, 9), (0, 30), (12, 13), (7, 7), (-3, 5), (25, 100)]
+    for axis in [0, 1]:
+        for start, stop in bands:
+            band=data[max(start, 0):stop] if axis==0 else data[:, max(start, 0):stop]
+            assert np.allclose(projections.bandSum(axis, start, stop), np.sum(band, axis=axis, dtype=np.float64),
+                               rtol=1e-6)
+        # The cumulative sum is built from the second band on
+        assert projections.prefix[axis] is not None
+    projections.setData(data[::-1])
+    assert projections.prefix==[None, None]
+    assert np.allclose(projections.bandSum(0, 2, 6), np.sum(data[::-1][2:6], axis=0, dtype=np.float64), rtol=1e-6)
+
+
+def gaussian(center, sigma, amplitude=1000.0, offset=50.0, n=200, noise=0.0):
+    i=np.arange(n)
+    profile=amplitude*np.exp(-0.5*((i-center)/sigma)**2)+offset
+    return profile+noise*np.random.RandomState(4).standard_normal(n)
+
+
+@pytest.mark.parametrize('background', [False, True])
+def test_gaussian_fit_finds_the_sub_pixel_center_and_sigma(background):
+    offset=50.0 if background else 0.0
+    params=np.array([800.0, 85.0, 8.0, 0.0])
+    quality, iterations = gaussianFit(gaussian(87.3, 6.2, offset=offset), params, background, 50, 1e-12)
+    assert quality>1-1e-9
+    assert np.allclose(params, [1000.0, 87.3, 6.2, offset], rtol=1e-6)
+
+
+def test_gaussian_fit_of_a_flat_profile_fails():
+    params=np.array([1.0, 5.0, 2.0, 0.0])
+    assert np.isnan(gaussianFit(np.ones(20), params, True, 10, 1e-6)[0])
+
+
+@pytest.mark.parametrize('model', ['Gaussian', 'Gaussian+Background'])
+def test_peak_fitter_cold_and_warm_start(model):
+    offset=50.0 if model=='Gaussian+Background' else 0.0
+    values=0.01*np.arange(200)
+    fitter=PeakFitter(model)
+    # Cold start from the centroid, then warm starts from the previous frame as the beam drifts
+    for center, sigma in [(87.3, 6.2), (88.1, 6.3), (88.45, 6.1)]:
+        peak, width, std, quality = fitter.peakPosWidth(gaussian(center, sigma, offset=offset, noise=2.0), values, 'x')
+        assert abs(peak-0.01*center)<0.01*0.05
+        assert abs(std-0.01*sigma)<0.01*0.05
+        assert np.isclose(width, fwhmFactor*std)
+        assert quality>0.99
+        assert np.isclose(fitter.params['x'][2][1], 100*peak)
+
+
+def test_peak_fitter_fits_a_poor_warm_start_again_from_the_centroid():
+    values=0.01*np.arange(200)
+    fitter=PeakFitter('Gaussian+Background', maxIter=3)
+    # A warm start which does not converge in 3 iterations (R^2~0.3)
+    fitter.params['x']=(None, 200, np.array([300.0, 100.0, 60.0, 0.0]))
+    peak, width, std, quality = fitter.peakPosWidth(gaussian(88.6, 6.3), values, 'x')
+    assert np.isclose(peak, 0.886, atol=1e-6)
+    assert np.isclose(std, 0.063, atol=1e-6)
+    assert quality>0.999
+    # A beam which jumped further than its width is not fitted from the previous frame either
+    peak, width, std, quality = fitter.peakPosWidth(gaussian(160.0, 6.3), values, 'x')
+    assert np.isclose(peak, 1.6, atol=1e-6)
+
+
+def test_peak_fitter_keeps_the_fit_of_the_latest_frame():
+    values=0.01*np.arange(200)
+    fitter=PeakFitter('Gaussian')
+    fitter.peakPosWidth(gaussian(90.0, 6.0, offset=0.0), values, 'y', counter=5)
+    # A cut of an earlier frame finished late is fitted from its centroid and does not replace the fit of frame 5
+    peak=fitter.peakPosWidth(gaussian(80.0, 6.0, offset=0.0), values, 'y', counter=3)[0]
+    assert np.isclose(peak, 0.8, atol=1e-6)
+    assert fitter.params['y'][0]==5
+    assert np.isclose(fitter.params['y'][2][1], 90.0)
+    fitter.reset()
+    assert fitter.params=={}
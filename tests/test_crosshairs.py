@@ -0,0 +1,67 @@
+import os
+import sys
+import numpy as np
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from crosshairs import CrosshairItem, CrosshairModel, newCrosshair, readCrosshairFile, writeCrosshairFile
+
+
+def randomCrosshairs(n=500):
+    random=np.random.RandomState(0)
+    x, y = random.uniform(-5, 5, size=(2, n))
+    angles=random.uniform(0, 360, size=n)
+    colors=random.choice(['r', 'g', 'b'], size=n)
+    widths=random.choice([1.0, 2.0], size=n)
+    shows=random.random_sample(n)<0.8
+    return [newCrosshair('ch_%d'%i, x[i], y[i], angles[i], widths[i], colors[i], shows[i]) for i in range(n)]
+
+
+def test_crosshair_paths_match_numpy():
+    crosshairs=randomCrosshairs()
+    model=CrosshairModel()
+    model.setCrosshairs(crosshairs)
+    item=CrosshairItem(model, length=0.01, maxLabels=10)
+    item.buildPaths()
+    # One path per color and line width with the 4 end points of the two lines of every shown crosshair
+    shown=[ch for ch in crosshairs if ch['Show']]
+    assert len(item.paths)==len({(ch['Color'].rgba(), ch['Linewidth (pix)']) for ch in shown})
+    points=np.array([[path.elementAt(i).x, path.elementAt(i).y] for pen, path in item.paths
+                     for i in range(path.elementCount())])
+    x=1e-3*np.array([ch['Pos-X (mm)'] for ch in shown])
+    y=1e-3*np.array([ch['Pos-Y (mm)'] for ch in shown])
+    angle=np.radians([ch['Angle (deg)'] for ch in shown])
+    dx, dy = 0.01*np.cos(angle), 0.01*np.sin(angle)
+    reference=np.stack([np.stack([x-dx, y-dy], axis=1), np.stack([x+dx, y+dy], axis=1),
+                        np.stack([x+dy, y-dx], axis=1), np.stack([x-dy, y+dx], axis=1)], axis=1).reshape(-1, 2)
+    assert len(points)==len(reference)
+    assert np.allclose(np.unique(np.round(points, 12), axis=0), np.unique(np.round(reference, 12), axis=0))
+    bounds=item.boundingRect()
+    assert np.allclose([bounds.left(), bounds.top(), bounds.right(), bounds.bottom()],
+                       [*reference.min(axis=0), *reference.max(axis=0)])
+    # Too many crosshairs for their names
+    assert item.labels==[]
+
+
+def test_removing_crosshairs_matches_the_list():
+    crosshairs=randomCrosshairs(50)
+    model=CrosshairModel()
+    model.setCrosshairs(crosshairs)
+    rows=[3, 4, 5, 9, 20, 21, 49, 0, 4]
+    model.removeCrosshairs(rows)
+    assert [ch['Name'] for ch in model.crosshairs]==[ch['Name'] for i, ch in enumerate(crosshairs) if i not in rows]
+    assert model.rowCount()==len(crosshairs)-len(set(rows))
+
+
+def test_crosshair_file_round_trip(tmp_path):
+    fname=str(tmp_path/'crosshairs.chr')
+    crosshairs=randomCrosshairs(20)
+    writeCrosshairFile(fname, crosshairs)
+    readCrosshairs=readCrosshairFile(fname)
+    assert len(readCrosshairs)==len(crosshairs)
+    for ch, read in zip(crosshairs, readCrosshairs):
+        for key, value in ch.items():
+            if key=='Color':
+                assert read[key].rgba()==value.rgba()
+            elif isinstance(value, float):
+                assert np.isclose(read[key], value, rtol=1e-9)
+            else:
+                assert read[key]==value
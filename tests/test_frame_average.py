@@ -0,0 +1,55 @@
+import os
+import sys
+import numpy as np
+import pytest
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from ad_reader import FrameBuffer
+from frame_average import FrameAverager
+
+
+def averagedFrames(mode, length, frames, bufferLength=8):
+    frameBuffer=FrameBuffer(bufferLength, frames.shape[1:], frames.dtype)
+    averager=FrameAverager()
+    averager.setMode(mode, length)
+    averages=[]
+    for counter, frame in enumerate(frames):
+        index=frameBuffer.write(frame.reshape(-1), counter, 0.0)
+        averages.append(averager.add(frameBuffer, index).copy())
+        assert averager.getFrame(index) is not None
+    return averager, np.array(averages)
+
+
+@pytest.mark.parametrize('length', [1, 3, 7, 20])
+def test_rolling_average_matches_numpy(length):
+    frames=np.random.RandomState(0).randint(0, 4096, size=(25, 6, 5)).astype(np.uint16)
+    averager, averages = averagedFrames('Rolling', length, frames)
+    # The window is limited by the 8 slots of the frame buffer
+    window=min(length, 7)
+    for i in range(len(frames)):
+        reference=frames[max(i+1-window, 0):i+1].mean(axis=0)
+        assert np.allclose(averages[i], reference, rtol=1e-5), i
+
+
+@pytest.mark.parametrize('length', [1, 4, 50])
+def test_exponential_moving_average_matches_numpy(length):
+    frames=np.random.RandomState(1).randint(0, 256, size=(30, 4, 7, 3)).astype(np.uint8)
+    averager, averages = averagedFrames('EMA', length, frames)
+    reference=frames[0].astype(float)
+    for i, frame in enumerate(frames):
+        reference=reference+(frame-reference)/length
+        assert np.allclose(averages[i], reference, rtol=1e-5), i
+
+
+def test_changing_the_mode_starts_the_average_again():
+    frames=np.random.RandomState(2).randint(0, 4096, size=(6, 3, 4)).astype(np.uint16)
+    frameBuffer=FrameBuffer(8, frames.shape[1:], frames.dtype)
+    averager=FrameAverager('Rolling', 4)
+    for counter, frame in enumerate(frames[:4]):
+        averager.add(frameBuffer, frameBuffer.write(frame.reshape(-1), counter, 0.0))
+    averager.setMode('Rolling', 2)
+    index=frameBuffer.write(frames[4].reshape(-1), 4, 0.0)
+    assert np.allclose(averager.add(frameBuffer, index), frames[4])
+    assert averager.getFrame(frameBuffer.slotIndex(1)) is None
+    averager.setMode('Off', 2)
+    assert averager.add(frameBuffer, frameBuffer.write(frames[5].reshape(-1), 5, 0.0)) is None
+    assert not averager.active
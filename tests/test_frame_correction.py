@@ -0,0 +1,58 @@
+import os
+import sys
+import numpy as np
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from frame_correction import FrameCorrection, correctFrame
+
+
+def correctedFrame(correction, raw):
+    dark, gain = correction.activeMaps(raw.shape)
+    out=np.empty(raw.size, dtype=np.float32)
+    correctFrame(raw.reshape(-1), dark, gain, out)
+    return out.reshape(raw.shape)
+
+
+def test_corrected_frames_match_numpy():
+    random=np.random.RandomState(0)
+    raw=random.randint(0, 4096, size=(30, 40)).astype(np.uint16)
+    dark=random.uniform(90, 110, size=raw.shape).astype(np.float32)
+    flat=random.uniform(1000, 3000, size=raw.shape).astype(np.float32)
+    flat[3, 4]=dark[3, 4]-1
+    correction=FrameCorrection()
+    correction.enabled=True
+    correction.setDark(dark)
+    assert np.allclose(correctedFrame(correction, raw), raw-dark.astype(float), rtol=1e-6)
+    correction.setFlat(flat)
+    signal=flat.astype(float)-dark
+    valid=signal>0
+    gain=np.where(valid, np.mean(signal[valid])/np.where(valid, signal, 1), 0)
+    assert np.allclose(correctedFrame(correction, raw), (raw-dark.astype(float))*gain, rtol=1e-5, atol=1e-3)
+    assert correctedFrame(correction, raw)[3, 4]==0
+    correction.setDark(None)
+    gain=np.mean(flat.astype(float))/flat
+    assert np.allclose(correctedFrame(correction, raw), raw*gain, rtol=1e-5)
+
+
+def test_frames_are_only_corrected_with_maps_of_their_shape():
+    correction=FrameCorrection()
+    assert correction.activeMaps((4, 5)) is None
+    correction.setDark(np.ones((4, 5)))
+    assert correction.activeMaps((4, 5)) is None
+    correction.enabled=True
+    assert correction.shape==(4, 5)
+    assert correction.activeMaps((4, 5)) is not None
+    assert correction.activeMaps((5, 4)) is None
+    # A flat-field of another shape than the dark map is ignored
+    correction.setFlat(np.ones((5, 4)))
+    assert correction.activeMaps((4, 5))[1].size==0
+
+
+def test_captured_dark_is_the_mean_of_the_frames():
+    frames=np.random.RandomState(1).randint(0, 256, size=(5, 6, 7)).astype(np.uint8)
+    correction=FrameCorrection()
+    correction.startDarkCapture(4)
+    assert correction.capturing
+    assert [correction.addDarkFrame(frame.reshape(-1), frame.shape) for frame in frames[:4]]==[False]*3+[True]
+    assert not correction.capturing
+    assert not correction.addDarkFrame(frames[4].reshape(-1), frames[4].shape)
+    assert np.allclose(correction.dark, frames[:4].mean(axis=0), rtol=1e-6)
@@ -0,0 +1,44 @@
+import os
+import sys
+import time
+import numpy as np
+import pytest
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from frame_recorder import FrameRecorder
+
+
+def recordFrames(fname, fileFormat, nFrames=37):
+    frames=np.random.RandomState(0).randint(0, 4096, size=(nFrames, 6, 5)).astype(np.uint16)
+    recorder=FrameRecorder(fname, fileFormat=fileFormat, maxFrames=100, queueDepth=8, batchSize=4)
+    for i, frame in enumerate(frames):
+        # Waits for a free buffer, so that no frame is dropped
+        while recorder.queueFull():
+            time.sleep(1e-3)
+        assert recorder.add(frame, 10+i, 1000.0+i, 2000.0+i)
+    recorder.close()
+    assert recorder.error is None
+    assert recorder.writtenFrames==nFrames
+    return frames
+
+
+def test_npy_recording_round_trip(tmp_path):
+    fname=str(tmp_path/'frames.npy')
+    frames=recordFrames(fname, 'NPY')
+    data=np.load(fname, mmap_mode='r')
+    assert data.dtype==np.uint16
+    assert np.array_equal(data, frames)
+    table=np.load(str(tmp_path/'frames_frames.npy'))
+    assert np.array_equal(table['arrayCounter'], 10+np.arange(len(frames)))
+    assert np.array_equal(table['timestamp'], 1000.0+np.arange(len(frames)))
+    assert np.array_equal(table['receiveTime'], 2000.0+np.arange(len(frames)))
+
+
+def test_hdf5_recording_round_trip(tmp_path):
+    h5py=pytest.importorskip('h5py')
+    fname=str(tmp_path/'frames.h5')
+    frames=recordFrames(fname, 'HDF5')
+    with h5py.File(fname, 'r') as fh:
+        assert np.array_equal(fh['frames'][()], frames)
+        assert np.array_equal(fh['arrayCounter'][()], 10+np.arange(len(frames)))
+        assert np.array_equal(fh['timestamp'][()], 1000.0+np.arange(len(frames)))
+        assert fh['frames'].attrs['droppedFrames']==0
@@ -0,0 +1,66 @@
+import os
+import sys
+import numpy as np
+import pytest
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import roi_stats
+from beam_analysis import Orientation
+from roi_stats import ROIStatistics
+
+
+def displayedImage(data, orientation):
+    image=data.T if orientation.transpose else data
+    if orientation.flipX:
+        image=image[:, ::-1]
+    if orientation.flipY:
+        image=image[::-1]
+    return image
+
+
+def referenceStatistics(image, rect):
+    x0, y0, x1, y1 = rect
+    block=image[y0:y1, x0:x1].astype(float)
+    y, x = np.mgrid[y0:y1, x0:x1]
+    total=block.sum()
+    cx=(block*x).sum()/total
+    cy=(block*y).sum()/total
+    return [total, block.mean(), cx, cy, np.sqrt((block*(x-cx)**2).sum()/total),
+            np.sqrt((block*(y-cy)**2).sum()/total)]
+
+
+@pytest.mark.parametrize('name', list(Orientation.orientations.keys()))
+@pytest.mark.parametrize('maxTablePixels', [1<<20, 100])
+def test_roi_statistics_match_numpy(name, maxTablePixels, monkeypatch):
+    monkeypatch.setattr(roi_stats, 'maxTablePixels', maxTablePixels)
+    data=np.random.RandomState(1).randint(0, 4096, size=(120, 160)).astype(np.uint16)
+    orientation=Orientation(name)
+    rois=[('a', (10, 20, 60, 90)), ('b', (30, 40, 80, 100)), ('c', (100, 5, 119, 40)), ('all', (0, 0, 120, 120))]
+    stats=ROIStatistics(rois)
+    out=stats.compute(data, orientation)
+    image=displayedImage(data, orientation)
+    for i, (roiName, rect) in enumerate(rois):
+        assert np.allclose(out[i], referenceStatistics(image, rect), rtol=1e-9, atol=1e-9), roiName
+
+
+def test_rgb_roi_statistics_use_the_channel_weights():
+    data=np.random.RandomState(2).randint(0, 256, size=(40, 50, 3)).astype(np.uint8)
+    orientation=Orientation('Normal')
+    weights=np.array([0.2, 0.5, 0.3])
+    out=ROIStatistics([('a', (5, 5, 30, 25))]).compute(data, orientation, weights=weights)
+    image=displayedImage(np.dot(data, weights), orientation)
+    assert np.allclose(out[0], referenceStatistics(image, (5, 5, 30, 25)), rtol=1e-9)
+
+
+def test_distant_rois_do_not_share_tables():
+    image=np.zeros((2048, 2048))
+    y, x = np.mgrid[2000:2020, 2000:2020]
+    image[2000:2020, 2000:2020]=1e4*np.exp(-((x-2010.3)**2+(y-2009.7)**2)/2/0.7**2)+100
+    image[:10, :10]=1.0
+    orientation=Orientation('Normal')
+    rois=[('corner', (0, 0, 10, 10)), ('beam', (2000, 2000, 2020, 2020))]
+    stats=ROIStatistics(rois)
+    out=stats.compute(np.ascontiguousarray(displayedImage(image, orientation)), orientation)
+    for i, (name, rect) in enumerate(rois):
+        assert np.allclose(out[i], referenceStatistics(image, rect), rtol=1e-9), name
+    # One table per ROI instead of one over the whole frame
+    assert stats.local.tables.size<=21*21*5
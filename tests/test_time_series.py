@@ -0,0 +1,108 @@
+import io
+import os
+import sys
+import time
+import numpy as np
+import pytest
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from time_series import TimeSeriesBuffer, TimeSeriesWriter, npyHeader, timeSeriesLayout
+
+
+def test_npy_header_is_rewritten_in_place():
+    dtype=np.dtype([('time', '<f8'), ('x', '<f8')])
+    header=npyHeader(dtype, (0,))
+    assert len(header)%64==0
+    longer=npyHeader(dtype, (10**19,), len(header)-10)
+    assert len(longer)==len(header)
+    fh=io.BytesIO(longer)
+    assert np.lib.format.read_magic(fh)==(1, 0)
+    assert np.lib.format.read_array_header_1_0(fh)==((10**19,), False, dtype)
+
+
+def test_npy_time_series_is_readable_while_it_grows(tmp_path):
+    fname=str(tmp_path/'timeSeries.npy')
+    writer=TimeSeriesWriter(fname, ['time', 'x', 'y'], fileFormat='NPY', batchSize=10, flushInterval=0.01)
+    rows=[[i, 2.0*i, -1.0*i] for i in range(35)]
+    for batch in range(4):
+        for row in rows[10*batch:10*batch+10]:
+            writer.write(row)
+        deadline=time.time()+5
+        while writer.writtenRows<min(10*batch+10, 35) and time.time()<deadline:
+            time.sleep(0.01)
+        data=np.load(fname, mmap_mode='r')
+        assert data.shape==(writer.writtenRows,)
+        assert np.array_equal(data['x'], [row[1] for row in rows[:writer.writtenRows]])
+    writer.close()
+    data=np.load(fname, mmap_mode='r')
+    assert writer.error is None
+    assert data.dtype.names==('time', 'x', 'y')
+    assert np.array_equal(np.stack([data['time'], data['x'], data['y']], axis=1), np.array(rows))
+
+
+def timeSeriesRows(colNames, nRows=57):
+    rows=np.round(np.random.RandomState(0).uniform(-10, 10, size=(nRows, len(colNames))), 6)
+    rows[:, 0]=1.7e9+0.1*np.arange(nRows)
+    return rows
+
+
+def test_text_time_series_round_trip(tmp_path):
+    fname=str(tmp_path/'timeSeries.txt')
+    colNames, header, rowFormat = timeSeriesLayout(['15IDA:m1.RBV'], 0.1, fitModel='Gaussian', roiNames=['a'])
+    rows=timeSeriesRows(colNames)
+    writer=TimeSeriesWriter(fname, colNames, header=header, rowFormat=rowFormat, batchSize=10)
+    for row in rows:
+        writer.write(list(row))
+    writer.close()
+    assert writer.error is None and writer.writtenRows==len(rows)
+    with open(fname) as fh:
+        assert fh.read(len(header))==header
+    assert np.allclose(np.loadtxt(fname), rows, rtol=1e-9, atol=1e-6)
+
+
+def test_hdf5_time_series_round_trip(tmp_path):
+    h5py=pytest.importorskip('h5py')
+    fname=str(tmp_path/'timeSeries.h5')
+    colNames=['time', 'x', 'y']
+    rows=timeSeriesRows(colNames)
+    writer=TimeSeriesWriter(fname, colNames, fileFormat='HDF5', header='#header\n', batchSize=10)
+    for row in rows:
+        writer.write(list(row))
+    writer.close()
+    assert writer.error is None
+    with h5py.File(fname, 'r') as fh:
+        assert np.array_equal(fh['timeSeries'][()], rows)
+        assert list(fh['timeSeries'].attrs['col_names'])==colNames
+        assert fh['timeSeries'].attrs['header']=='#header\n'
+
+
+def appendedRows(buffer, nRows):
+    rows=np.random.RandomState(1).standard_normal((nRows, len(buffer.colNames)))
+    rows[:, 0]=np.arange(nRows)
+    for row in rows:
+        buffer.append(row)
+    return rows
+
+
+@pytest.mark.parametrize('nRows', [0, 1, 30, 50, 51, 137])
+def test_time_series_buffer_keeps_the_last_rows_in_order(nRows):
+    buffer=TimeSeriesBuffer(50, ['time', 'x', 'y'])
+    rows=appendedRows(buffer, nRows)
+    assert len(buffer)==min(nRows, 50)
+    assert np.array_equal(buffer.getData(), rows[len(rows)-len(buffer):].T)
+    buffer.clear()
+    assert buffer.getData().shape==(3, 0)
+
+
+@pytest.mark.parametrize('nRows', [21, 37, 100, 253, 260])
+def test_time_series_buffer_decimates_to_the_block_extrema(nRows):
+    buffer=TimeSeriesBuffer(100, ['time', 'x', 'y'], maxPoints=10)
+    assert buffer.blockSize==10
+    rows=appendedRows(buffer, nRows)
+    # The blocks of 10 consecutive rows still kept, the one being filled only holds its newest rows
+    blocks=np.arange(nRows)//10
+    kept=np.unique(blocks)[-10:]
+    reference=np.empty((3, 2*len(kept)))
+    for i, block in enumerate(kept):
+        reference[:, 2*i]=rows[blocks==block].min(axis=0)
+        reference[:, 2*i+1]=rows[blocks==block].max(axis=0)
+    assert np.array_equal(buffer.getData(), reference)
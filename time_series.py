@@ -0,0 +1,285 @@
+import threading
+import time
+import queue
+import sys
+import importlib.util
+import numpy as np
+
+# Formats supported by TimeSeriesWriter with the extensions of their files
+fileFormats={'Text': '.txt', 'NPY': '.npy'}
+# HDF5 is offered when h5py is installed, h5py itself is only imported once an HDF5 file is written
+if importlib.util.find_spec('h5py') is not None:
+    fileFormats['HDF5']='.h5'
+
+# Peak positions and widths following the monitor PVs in every row of the time series
+peakColumns=['horPeakPos(mm)','horPeakWid(mm)','verPeakPos(mm)','verPeakWid(mm)']
+
+# Standard deviations and R^2 of the fitted peaks following the peak positions and widths
+fitColumns=['horPeakSigma(mm)','horPeakR2','verPeakSigma(mm)','verPeakR2']
+
+
+def roiColumns(roiNames):
+    """
+    Returns the names of the columns of the statistics of the ROIs, see roi_stats.roiQuantities
+    """
+    return ['%s_%s'%(name, quantity) for name in roiNames
+            for quantity in ['sum', 'mean', 'x(mm)', 'y(mm)', 'sigX(mm)', 'sigY(mm)']]
+
+
+def timeSeriesLayout(pvNames, expTime, saveAges=False, fitModel='Centroid', roiNames=()):
+    """
+    Returns the column names, the header and the row format of a saved time series
+
+    :param pvNames: names of the monitor PVs
+    :param expTime: exposure time written in the header
+    :param saveAges: adds the ages of the PV values after the values
+    :param fitModel: one of beam_analysis.fitModels, the fitted peaks add the fitColumns
+    :param roiNames: names of the ROIs whose statistics follow the peaks
+    """
+    colNames=['time']+list(pvNames)
+    if saveAges:
+        colNames+=[name+'_age' for name in pvNames]
+    colNames+=peakColumns
+    if fitModel!='Centroid':
+        colNames+=fitColumns
+    colNames+=roiColumns(roiNames)
+    header='#File saved on %s\n'%time.asctime()
+    header+='#Exposure_time=%.4f\n'%expTime
+    if fitModel!='Centroid':
+        header+='#Peak_fit=%s\n'%fitModel
+    header+='#col_names=[%s]\n'%','.join(["'%s'"%name for name in colNames])
+    header+='#%s \n'%' '.join(colNames)
+    nROIColumns=len(roiColumns(roiNames))
+    nPeakColumns=len(colNames)-colNames.index(peakColumns[0])-nROIColumns
+    rowFormat=' '.join(['%.6f']+['%.10g']*(len(colNames)-1-nPeakColumns-nROIColumns)+['%.6f']*nPeakColumns+
+                       ['%.10g']*nROIColumns)+'\n'
+    return colNames, header, rowFormat
+
+
+def npyHeader(dtype, shape, headerLength=None):
+    """
+    Returns the version 1.0 .npy header of an array as bytes. The header is padded to a fixed length so that it can
+    be rewritten in place as the array grows, which keeps the file readable with np.load(fname, mmap_mode='r').
+
+    :param dtype: dtype of the array
+    :param shape: shape of the array
+    :param headerLength: length of the header after the magic string and the length field, by default with room
+    for 20 more digits of the shape, aligned to 64 bytes with them
+    """
+    header="{'descr': %s, 'fortran_order': False, 'shape': %s, }"%(repr(np.lib.format.dtype_to_descr(np.dtype(dtype))),
+                                                                    repr(tuple(shape)))
+    if headerLength is None:
+        headerLength=64*((len(header)+20+10)//64+1)-10
+    if len(header)+1>headerLength:
+        raise ValueError('The .npy header of the shape %s does not fit in %d bytes'%(shape, headerLength))
+    return b'\x93NUMPY\x01\x00'+np.uint16(headerLength).astype('<u2').tobytes()+\
+        (header+' '*(headerLength-len(header)-1)+'\n').encode('latin1')
+
+
+class TimeSeriesWriter(threading.Thread):
+    def __init__(self, fname, colNames, fileFormat='Text', header='', rowFormat=None, batchSize=1000,
+                 flushInterval=1.0, maxRows=1000000):
+        """
+        Writes the rows of a time series to a file in a background thread. The rows are queued by write() and
+        written in batches whenever batchSize rows are collected or flushInterval seconds have passed.
+
+        :param fname: name of the file, '-' writes the text to stdout
+        :param colNames: names of the columns
+        :param fileFormat: 'Text', 'NPY' (structured .npy file which is kept readable while it grows) or 'HDF5'
+        (chunked dataset 'timeSeries' with the column names as attribute)
+        :param header: lines written at the top of the text file or saved as attribute of the binary files
+        :param rowFormat: format of a row in the text file, '%.6f' for every column by default
+        :param batchSize: number of rows written at once
+        :param flushInterval: maximum time in seconds the rows are kept in memory
+        :param maxRows: maximum number of rows waiting in the queue. Further rows are dropped and counted.
+        The file is closed on the first error of a write, the rows queued after it are dropped as well.
+        """
+        threading.Thread.__init__(self, daemon=True)
+        self.fname=fname
+        self.colNames=list(colNames)
+        self.fileFormat=fileFormat
+        self.header=header
+        if rowFormat is None:
+            rowFormat=' '.join(['%.6f']*len(self.colNames))+'\n'
+        self.rowFormat=rowFormat
+        self.batchSize=batchSize
+        self.flushInterval=flushInterval
+        self.queue=queue.Queue(maxsize=maxRows)
+        self.writtenRows=0
+        self.droppedRows=0
+        self.lock=threading.Lock()
+        self.error=None
+        self.openFile()
+        self.start()
+
+    def write(self, row):
+        """
+        Queues a row for writing without blocking
+        """
+        try:
+            self.queue.put_nowait(row)
+        except queue.Full:
+            with self.lock:
+                self.droppedRows+=1
+
+    def close(self):
+        """
+        Writes the remaining rows and closes the file
+        """
+        self.queue.put(None)
+        self.join()
+
+    def run(self):
+        batch=[]
+        lastFlush=time.time()
+        closing=False
+        while not closing:
+            try:
+                row=self.queue.get(timeout=self.flushInterval)
+                if row is None:
+                    closing=True
+                else:
+                    batch.append(row)
+            except queue.Empty:
+                pass
+            if len(batch)>0 and (closing or len(batch)>=self.batchSize or time.time()-lastFlush>=self.flushInterval):
+                if self.error is None:
+                    try:
+                        self.writeRows(batch)
+                        self.writtenRows+=len(batch)
+                    except Exception as error:
+                        # The file keeps the rows of the previous batches, the following rows are dropped
+                        self.error=error
+                        self.closeFile()
+                if self.error is not None:
+                    with self.lock:
+                        self.droppedRows+=len(batch)
+                batch=[]
+                lastFlush=time.time()
+        if self.error is None:
+            self.closeFile()
+
+    def openFile(self):
+        if self.fileFormat=='Text':
+            self.fh=sys.stdout if self.fname=='-' else open(self.fname,'w')
+            self.fh.write(self.header)
+        elif self.fileFormat=='NPY':
+            self.fh=open(self.fname,'wb')
+            self.dtype=np.dtype([(name, '<f8') for name in self.colNames])
+            self.npyHeaderLength=None
+            self.writeNPYHeader(0)
+        elif self.fileFormat=='HDF5':
+            import h5py
+            self.fh=h5py.File(self.fname,'w')
+            self.dataset=self.fh.create_dataset('timeSeries', shape=(0, len(self.colNames)),
+                                                maxshape=(None, len(self.colNames)), dtype='f8',
+                                                chunks=(self.batchSize, len(self.colNames)))
+            self.dataset.attrs['col_names']=self.colNames
+            self.dataset.attrs['header']=self.header
+        else:
+            raise ValueError('Unknown file format %s'%self.fileFormat)
+
+    def writeNPYHeader(self, nrows):
+        """
+        Writes the .npy header for nrows rows in place, see npyHeader
+        """
+        header=npyHeader(self.dtype, (nrows,), self.npyHeaderLength)
+        self.npyHeaderLength=len(header)-10
+        self.fh.seek(0)
+        self.fh.write(header)
+        self.fh.seek(0,2)
+
+    def writeRows(self, rows):
+        if self.fileFormat=='Text':
+            self.fh.write(''.join([self.rowFormat%tuple(row) for row in rows]))
+            self.fh.flush()
+        elif self.fileFormat=='NPY':
+            self.fh.write(np.array(rows, dtype='<f8').tobytes())
+            self.writeNPYHeader(self.writtenRows+len(rows))
+            self.fh.flush()
+        else:
+            nrows=self.dataset.shape[0]
+            self.dataset.resize(nrows+len(rows), axis=0)
+            self.dataset[nrows:]=np.array(rows, dtype='f8')
+            self.fh.flush()
+
+    def closeFile(self):
+        if self.fh is sys.stdout:
+            self.fh.flush()
+            return
+        try:
+            self.fh.close()
+        except:
+            pass
+
+
+class TimeSeriesBuffer(object):
+    def __init__(self, length, colNames, maxPoints=2000):
+        """
+        Preallocated columnar ring buffer for a time series. Along with the values the minimum and maximum of every
+        column are kept for blocks of length/maxPoints consecutive rows, so that the full history can be displayed
+        with at most 2*maxPoints points without going through all the rows.
+
+        :param length: maximum number of rows kept, rounded up to a multiple of the block size
+        :param colNames: names of the columns, the first one being the time
+        :param maxPoints: maximum number of blocks used for display
+        """
+        self.colNames=list(colNames)
+        self.columns={name: i for i, name in enumerate(self.colNames)}
+        self.blockSize=max(1, int(np.ceil(length/maxPoints)))
+        self.nBlocks=int(np.ceil(length/self.blockSize))
+        self.length=self.nBlocks*self.blockSize
+        self.data=np.full((len(self.colNames), self.length), np.nan)
+        self.blockMin=np.full((len(self.colNames), self.nBlocks), np.nan)
+        self.blockMax=np.full((len(self.colNames), self.nBlocks), np.nan)
+        self.clear()
+
+    def clear(self):
+        self.index=0
+        self.count=0
+
+    def __len__(self):
+        return self.count
+
+    def append(self, row):
+        """
+        Adds a row with a value for every column
+        """
+        row=np.asarray(row, dtype=np.float64)
+        i=self.index
+        self.data[:, i]=row
+        block, offset=divmod(i, self.blockSize)
+        if offset==0:
+            self.blockMin[:, block]=row
+            self.blockMax[:, block]=row
+        else:
+            np.fmin(self.blockMin[:, block], row, out=self.blockMin[:, block])
+            np.fmax(self.blockMax[:, block], row, out=self.blockMax[:, block])
+        self.index=(i+1)%self.length
+        self.count=min(self.count+1, self.length)
+
+    def getData(self):
+        """
+        Returns the time series ordered in time as an array of shape (number of columns, number of points). Up to
+        2*maxPoints rows are returned as they are, longer histories are decimated to the minimum and maximum of
+        every block placed at the first and last time of the block.
+        """
+        if self.count<=2*self.nBlocks:
+            if self.count<self.length:
+                start=(self.index-self.count)%self.length
+                if start<=self.index:
+                    return self.data[:, start:self.index]
+            else:
+                start=self.index
+            return np.concatenate((self.data[:, start:], self.data[:, :self.index]), axis=1)
+        block, offset=divmod(self.index, self.blockSize)
+        if self.count<self.length:
+            # The ring has not wrapped yet and the blocks are in order up to the one being filled
+            blocks=np.arange(block+(offset>0))
+        else:
+            # The block being filled only holds the newest rows
+            blocks=np.roll(np.arange(self.nBlocks), -(block+(offset>0)))
+        data=np.empty((len(self.colNames), 2*len(blocks)))
+        data[:, 0::2]=self.blockMin[:, blocks]
+        data[:, 1::2]=self.blockMax[:, blocks]
+        return data